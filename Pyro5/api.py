@@ -11,8 +11,9 @@ Pyro - Python Remote Objects.  Copyright by Irmen de Jong (irmen@razorvine.net).
 from . import __version__
 from .configure import global_config as config
 from .core import URI, locate_ns, resolve, type_meta
-from .client import Proxy, BatchProxy, SerializedBlob
-from .server import Daemon, DaemonObject, callback, expose, behavior, oneway, serve
+from .client import Proxy, BatchProxy, BalancingProxy, SerializedBlob, RetryPolicy
+from .server import Daemon, DaemonObject, callback, expose, behavior, oneway, idempotent, cacheable, \
+    cache_serialized, serve
 from .nameserver import start_ns, start_ns_loop
 from .serializers import SerializerBase
 from .callcontext import current_context
@@ -21,10 +22,13 @@ register_dict_to_class = SerializerBase.register_dict_to_class
 register_class_to_dict = SerializerBase.register_class_to_dict
 unregister_dict_to_class = SerializerBase.unregister_dict_to_class
 unregister_class_to_dict = SerializerBase.unregister_class_to_dict
+register_schema = SerializerBase.register_schema
+unregister_schema = SerializerBase.unregister_schema
 
 
 __all__ = ["config", "URI", "locate_ns", "resolve", "type_meta", "current_context",
-           "Proxy", "BatchProxy", "SerializedBlob", "SerializerBase",
-           "Daemon", "DaemonObject", "callback", "expose", "behavior", "oneway",
+           "Proxy", "BatchProxy", "BalancingProxy", "SerializedBlob", "RetryPolicy", "SerializerBase",
+           "Daemon", "DaemonObject", "callback", "expose", "behavior", "oneway", "idempotent", "cacheable", "cache_serialized",
            "start_ns", "start_ns_loop", "serve", "register_dict_to_class",
-           "register_class_to_dict", "unregister_dict_to_class", "unregister_class_to_dict"]
+           "register_class_to_dict", "unregister_dict_to_class", "unregister_class_to_dict",
+           "register_schema", "unregister_schema"]
@@ -0,0 +1,194 @@
+"""
+Microbenchmarks for the serializers, the wire protocol messages, and loopback calls.
+This is usually invoked by starting this module as a script:
+
+  :command:`python -m Pyro5.bench`
+  or simply: :command:`pyro5-bench`
+
+The results are written as JSON so they can be stored and compared, for instance to spot
+performance regressions after upgrading Pyro or Python, or to choose a serializer for your data.
+All timings are in microseconds per operation.
+
+Pyro - Python Remote Objects.  Copyright by Irmen de Jong (irmen@razorvine.net).
+"""
+
+import sys
+import json
+import time
+import platform
+import threading
+from argparse import ArgumentParser
+from . import __version__, config, protocol, serializers, server, client
+
+
+__all__ = ["payloads", "measure", "bench_serializers", "bench_protocol", "bench_roundtrips", "run"]
+
+
+def payloads():
+    """The representative payload shapes that are used for the serializer benchmarks."""
+    return {
+        "small": ("hello", 42, 3.14, True, None),
+        "records": [{"id": i, "name": "record%d" % i, "value": i * 1.5, "tags": ["a", "b"]} for i in range(200)],
+        "numbers": [i * 0.25 for i in range(10000)],
+        "text": "Pyro benchmark text " * 5000,
+        "binary": bytes(range(256)) * 400,
+        "nested": {"level%d" % i: {"items": list(range(20)), "more": {"x": i, "y": [i] * 5}} for i in range(50)},
+    }
+
+
+def measure(function, min_time=0.2):
+    """
+    Calls the function repeatedly, doubling the number of calls until they take at least min_time seconds.
+    Returns the time per call in microseconds.
+    """
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        duration = time.perf_counter() - start
+        if duration >= min_time:
+            return round(duration / number * 1e6, 3)
+        number *= 2
+
+
+def bench_serializers(min_time=0.2, serializer_names=None):
+    """Times dumps/loads/dumpsCall/loadsCall of every serializer for every payload shape, and the encoded size."""
+    results = {}
+    data = payloads()
+    for name in serializer_names or sorted(serializers.serializers):
+        serializer = serializers.serializers[name]
+        results[name] = {}
+        for shape, payload in data.items():
+            try:
+                encoded = serializer.dumps(payload)
+                encoded_call = serializer.dumpsCall("object", "method", (payload,), {"option": True})
+                serializer.loads(encoded)
+                serializer.loadsCall(encoded_call)
+            except Exception as x:
+                results[name][shape] = {"error": str(x)}
+                continue
+            results[name][shape] = {
+                "size": len(encoded),
+                "dumps": measure(lambda: serializer.dumps(payload), min_time),
+                "loads": measure(lambda: serializer.loads(encoded), min_time),
+                "dumpsCall": measure(lambda: serializer.dumpsCall("object", "method", (payload,), {"option": True}), min_time),
+                "loadsCall": measure(lambda: serializer.loadsCall(encoded_call), min_time),
+            }
+    return results
+
+
+def bench_protocol(min_time=0.2):
+    """Times building a SendingMessage and parsing it as a ReceivingMessage, with and without compression and annotations."""
+    results = {}
+    annotations = {"XYZZ": b"annotation data" * 4, "CORR": b"0123456789abcdef"}
+    original_compression = config.COMPRESSION
+    try:
+        for size in (100, 100000):
+            payload = (b"Pyro benchmark " * (size // 15 + 1))[:size]
+            for compression in (False, True):
+                for with_annotations in (False, True):
+                    config.COMPRESSION = compression
+                    anns = annotations if with_annotations else None
+                    msg = protocol.SendingMessage(protocol.MSG_INVOKE, 0, 42, 1, payload, anns)
+                    header, body = msg.data[:protocol._header_size], msg.data[protocol._header_size:]
+                    key = "%d%s%s" % (size, "_compressed" if compression else "", "_annotations" if with_annotations else "")
+                    results[key] = {
+                        "size": len(msg.data),
+                        "send": measure(lambda: protocol.SendingMessage(protocol.MSG_INVOKE, 0, 42, 1, payload, anns), min_time),
+                        "receive": measure(lambda: protocol.ReceivingMessage(header, body), min_time),
+                    }
+    finally:
+        config.COMPRESSION = original_compression
+    return results
+
+
+@server.expose
+class BenchObject(object):
+    """The Pyro object that is called in the loopback round-trip benchmarks."""
+    def echo(self, value):
+        return value
+
+    @server.oneway
+    def oneway(self, value):
+        pass
+
+
+def bench_roundtrips(min_time=0.2, serializer_names=None, servertypes=("thread", "multiplex")):
+    """Times remote method calls over a loopback connection, for every server type and serializer."""
+    results = {}
+    data = payloads()
+    original_servertype = config.SERVERTYPE
+    original_accepted = config.SERIALIZERS_ACCEPTED
+    config.SERIALIZERS_ACCEPTED = set(serializers.serializers)   # the proxies must also be allowed to use pickle
+    try:
+        for servertype in servertypes:
+            config.SERVERTYPE = servertype
+            daemon = server.Daemon(host="localhost", port=0)
+            daemon.serializers_accepted = set(serializers.serializers)
+            uri = daemon.register(BenchObject())
+            thread = threading.Thread(target=daemon.requestLoop, daemon=True)
+            thread.start()
+            results[servertype] = {}
+            try:
+                for name in serializer_names or sorted(serializers.serializers):
+                    with client.Proxy(uri) as proxy:
+                        proxy._pyroSerializer = name
+                        proxy._pyroBind()
+                        results[servertype][name] = {
+                            "connect": measure(lambda: (proxy._pyroRelease(), proxy._pyroBind()), min_time),
+                            "echo_small": measure(lambda: proxy.echo(data["small"]), min_time),
+                            "echo_records": measure(lambda: proxy.echo(data["records"]), min_time),
+                            "oneway": measure(lambda: proxy.oneway(data["small"]), min_time),
+                        }
+            finally:
+                daemon.shutdown()
+                thread.join()
+    finally:
+        config.SERVERTYPE = original_servertype
+        config.SERIALIZERS_ACCEPTED = original_accepted
+    return results
+
+
+def run(min_time=0.2, serializer_names=None, groups=("serializers", "protocol", "roundtrips")):
+    """Runs the selected benchmark groups and returns the results as a dict, including version information."""
+    results = {
+        "pyro_version": __version__,
+        "protocol_version": protocol.PROTOCOL_VERSION,
+        "python_version": platform.python_version(),
+        "python_implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "min_time": min_time,
+        "unit": "usec",
+    }
+    if "serializers" in groups:
+        results["serializers"] = bench_serializers(min_time, serializer_names)
+    if "protocol" in groups:
+        results["protocol"] = bench_protocol(min_time)
+    if "roundtrips" in groups:
+        results["roundtrips"] = bench_roundtrips(min_time, serializer_names)
+    return results
+
+
+def main(args=None):
+    parser = ArgumentParser(description="Pyro serializer and protocol benchmarks. Outputs the results as JSON.")
+    parser.add_argument("-t", "--time", type=float, default=0.2,
+                        help="minimum time in seconds to run each single benchmark (default=%(default)s)")
+    parser.add_argument("-s", "--serializer", action="append", choices=sorted(serializers.serializers),
+                        help="serializer to benchmark (can be given multiple times, default=all)")
+    parser.add_argument("-g", "--group", action="append", choices=("serializers", "protocol", "roundtrips"),
+                        help="benchmark group to run (can be given multiple times, default=all)")
+    parser.add_argument("-o", "--output", help="file to write the results to (default=stdout)")
+    args = parser.parse_args(args)
+    results = run(args.time, args.serializer, args.group or ("serializers", "protocol", "roundtrips"))
+    if args.output:
+        with open(args.output, "w") as outf:
+            json.dump(results, outf, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -5,7 +5,11 @@ Pyro - Python Remote Objects.  Copyright by Irmen de Jong (irmen@razorvine.net).
 """
 
 import time
+import random
 import logging
+import threading
+import collections
+import concurrent.futures
 import serpent
 import contextlib
 from . import config, core, serializers, protocol, errors, socketutil
@@ -18,7 +22,7 @@ except ImportError:
 
 log = logging.getLogger("Pyro5.client")
 
-__all__ = ["Proxy", "BatchProxy", "SerializedBlob"]
+__all__ = ["Proxy", "BatchProxy", "BalancingProxy", "SerializedBlob", "RetryPolicy"]
 
 
 class Proxy(object):
@@ -29,14 +33,27 @@ class Proxy(object):
     .. automethod:: _pyroRelease
     .. automethod:: _pyroReconnect
     .. automethod:: _pyroValidateHandshake
+    .. automethod:: _pyroCacheInvalidate
     .. autoattribute:: _pyroTimeout
     .. attribute:: _pyroMaxRetries
 
         Number of retries to perform on communication calls by this proxy, allows you to override the default setting.
 
+    .. attribute:: _pyroRetryPolicy
+
+        The :py:class:`RetryPolicy` that determines the delays between retries and reconnect attempts.
+        By default all proxies share the same policy (and thus the same retry budget).
+
     .. attribute:: _pyroSerializer
 
         Name of the serializer to use by this proxy, allows you to override the default setting.
+        If it is not set and the ``SERIALIZERS_PREFERRED`` config item is, it is set to the serializer
+        that was negotiated with the daemon when connecting.
+
+    .. attribute:: _pyroChunkedResults
+
+        Set to True to accept large list and tuple results in chunks. Such calls then return an iterator
+        that produces the elements as the chunks arrive. Defaults to False.
 
     .. attribute:: _pyroHandshake
 
@@ -44,9 +61,9 @@ class Proxy(object):
     """
     __pyroAttributes = frozenset(
         ["__getnewargs__", "__getnewargs_ex__", "__getinitargs__", "_pyroConnection", "_pyroUri",
-         "_pyroOneway", "_pyroMethods", "_pyroAttrs", "_pyroTimeout", "_pyroSeq",
-         "_pyroRawWireResponse", "_pyroHandshake", "_pyroMaxRetries", "_pyroSerializer",
-         "_Proxy__pyroTimeout", "_Proxy__pyroOwnerThread"])
+         "_pyroOneway", "_pyroMethods", "_pyroAttrs", "_pyroIdempotent", "_pyroCacheable", "_pyroTimeout", "_pyroSeq",
+         "_pyroRawWireResponse", "_pyroHandshake", "_pyroMaxRetries", "_pyroRetryPolicy", "_pyroSerializer", "_pyroResultCache",
+         "_pyroChunkedResults", "_Proxy__pyroTimeout", "_Proxy__pyroOwnerThread", "_Proxy__pyroChunkedResult"])
 
     def __init__(self, uri, connected_socket=None):
         if connected_socket:
@@ -61,10 +78,16 @@ class Proxy(object):
         self._pyroMethods = set()  # all methods of the remote object, gotten from meta-data
         self._pyroAttrs = set()  # attributes of the remote object, gotten from meta-data
         self._pyroOneway = set()  # oneway-methods of the remote object, gotten from meta-data
+        self._pyroIdempotent = set()  # idempotent methods of the remote object, gotten from meta-data
+        self._pyroCacheable = {}  # cacheable methods and attributes (with their ttl) of the remote object, gotten from meta-data
+        self._pyroResultCache = _ResultCache(config.RESULT_CACHE_SIZE)
         self._pyroSeq = 0  # message sequence number
         self._pyroRawWireResponse = False  # internal switch to enable wire level responses
         self._pyroHandshake = "hello"  # the data object that should be sent in the initial connection handshake message
         self._pyroMaxRetries = config.MAX_RETRIES
+        self._pyroRetryPolicy = default_retry_policy
+        self._pyroChunkedResults = False  # accept large sequence results in chunks (returned as an iterator)
+        self.__pyroChunkedResult = None  # the chunked result that is currently being received, if any
         self.__pyroTimeout = config.COMMTIMEOUT
         self.__pyroOwnerThread = get_ident()     # the thread that owns this proxy
         if config.SERIALIZER not in serializers.serializers:
@@ -95,7 +118,7 @@ class Proxy(object):
         if name not in self._pyroMethods:
             # client side check if the requested attr actually exists
             raise AttributeError("remote object '%s' has no exposed attribute or method '%s'" % (self._pyroUri, name))
-        return _RemoteMethod(self._pyroInvoke, name, self._pyroMaxRetries)
+        return _RemoteMethod(self._pyroInvoke, name, self._pyroMaxRetries, self._pyroRetryPolicy)
 
     def __setattr__(self, name, value):
         if name in Proxy.__pyroAttributes:
@@ -104,6 +127,7 @@ class Proxy(object):
         if not self._pyroMethods and not self._pyroAttrs:
             self._pyroGetMetadata()
         if name in self._pyroAttrs:
+            self._pyroResultCache.invalidate(name)
             return self._pyroInvoke("__setattr__", (name, value), None)  # remote attribute
         # client side validation if the requested attr actually exists
         raise AttributeError("remote object '%s' has no exposed attribute '%s'" % (self._pyroUri, name))
@@ -119,17 +143,23 @@ class Proxy(object):
     def __getstate__(self):
         # make sure a tuple of just primitive types are used to allow for proper serialization
         return str(self._pyroUri), tuple(self._pyroOneway), tuple(self._pyroMethods), \
-               tuple(self._pyroAttrs), self._pyroHandshake, self._pyroSerializer
+               tuple(self._pyroAttrs), self._pyroHandshake, self._pyroSerializer, tuple(self._pyroIdempotent)
 
     def __setstate__(self, state):
         self._pyroUri = core.URI(state[0])
         self._pyroOneway = set(state[1])
         self._pyroMethods = set(state[2])
         self._pyroAttrs = set(state[3])
+        self._pyroIdempotent = set(state[6]) if len(state) > 6 else set()    # older versions don't send it
+        self._pyroCacheable = {}
+        self._pyroResultCache = _ResultCache(config.RESULT_CACHE_SIZE)
         self._pyroHandshake = state[4]
         self._pyroSerializer = state[5]
         self.__pyroTimeout = config.COMMTIMEOUT
         self._pyroMaxRetries = config.MAX_RETRIES
+        self._pyroRetryPolicy = default_retry_policy
+        self._pyroChunkedResults = False
+        self.__pyroChunkedResult = None
         self._pyroConnection = None
         self._pyroSeq = 0
         self._pyroRawWireResponse = False
@@ -141,6 +171,8 @@ class Proxy(object):
         p._pyroTimeout = self._pyroTimeout
         p._pyroRawWireResponse = self._pyroRawWireResponse
         p._pyroMaxRetries = self._pyroMaxRetries
+        p._pyroRetryPolicy = self._pyroRetryPolicy
+        p._pyroChunkedResults = self._pyroChunkedResults
         return p
 
     def __enter__(self):
@@ -169,6 +201,7 @@ class Proxy(object):
     def _pyroRelease(self):
         """release the connection to the pyro daemon"""
         self.__check_owner()
+        self.__pyroChunkedResult = None
         if self._pyroConnection is not None:
             self._pyroConnection.close()
             self._pyroConnection = None
@@ -198,9 +231,11 @@ class Proxy(object):
         """perform the remote method call communication"""
         self.__check_owner()
         current_context.response_annotations = {}
+        if self.__pyroChunkedResult is not None:
+            self.__pyroChunkedResult.close()
         if self._pyroConnection is None:
             self.__pyroCreateConnection()
-        serializer = serializers.serializers[self._pyroSerializer or config.SERIALIZER]
+        serializer = _proxy_serializer(self._pyroSerializer or config.SERIALIZER)
         objectId = objectId or self._pyroConnection.objectId
         annotations = current_context.annotations
         if vargs and isinstance(vargs[0], SerializedBlob):
@@ -209,8 +244,21 @@ class Proxy(object):
         else:
             # normal serialization of the remote call
             data = serializer.dumpsCall(objectId, methodname, vargs, kwargs)
+        cache_name = cache_ttl = None
+        if self._pyroCacheable and not flags:
+            cache_name = vargs[0] if methodname == "__getattr__" and vargs else methodname
+            cache_ttl = self._pyroCacheable.get(cache_name)
+            if cache_ttl:
+                # the serialized call data (containing object, method and arguments) is the cache key.
+                # the cache holds the serialized result, so every caller gets its own copy of the result object.
+                data = bytes(data)
+                found, result = self._pyroResultCache.get((serializer.serializer_id, data))
+                if found:
+                    return serializer.loads(result)
         if methodname in self._pyroOneway:
             flags |= protocol.FLAGS_ONEWAY
+        elif self._pyroChunkedResults and not flags and not cache_ttl and not self._pyroRawWireResponse:
+            flags |= protocol.FLAGS_CHUNKED
         self._pyroSeq = (self._pyroSeq + 1) & 0xffff
         msg = protocol.SendingMessage(protocol.MSG_INVOKE, flags, self._pyroSeq, serializer.serializer_id, data, annotations=annotations)
         if config.LOGWIRE:
@@ -218,6 +266,7 @@ class Proxy(object):
         try:
             self._pyroConnection.send(msg.data)
             del msg  # invite GC to collect the object, don't wait for out-of-scope
+            cache_key = (serializer.serializer_id, data) if cache_ttl else None
             if flags & protocol.FLAGS_ONEWAY:
                 return None  # oneway call, no response data
             else:
@@ -234,6 +283,9 @@ class Proxy(object):
                 if self._pyroRawWireResponse:
                     return msg
                 data = serializer.loads(msg.data)
+                if msg.flags & protocol.FLAGS_CHUNKED:
+                    self.__pyroChunkedResult = _ChunkedResultIterator(self, serializer, data)
+                    return self.__pyroChunkedResult
                 if msg.flags & protocol.FLAGS_ITEMSTREAMRESULT:
                     streamId = bytes(msg.annotations.get("STRM", b"")).decode()
                     if not streamId:
@@ -242,6 +294,8 @@ class Proxy(object):
                 if msg.flags & protocol.FLAGS_EXCEPTION:
                     raise data  # if you see this in your traceback, you should probably inspect the remote traceback as well
                 else:
+                    if cache_key is not None:
+                        self._pyroResultCache.put(cache_key, cache_name, bytes(msg.data), cache_ttl)
                     return data
         except (errors.CommunicationError, KeyboardInterrupt):
             # Communication error during read. To avoid corrupt transfers, we close the connection.
@@ -268,22 +322,27 @@ class Proxy(object):
             try:
                 if self._pyroConnection is not None:
                     return False  # already connected
+                endpoint_states.check(connect_location)
                 if config.SSL:
                     sslContext = socketutil.get_ssl_context(clientcert=config.SSL_CLIENTCERT,
                                                             clientkey=config.SSL_CLIENTKEY,
                                                             keypassword=config.SSL_CLIENTKEYPASSWD,
                                                             cacerts=config.SSL_CACERTS)
+                    sslSession = socketutil.get_ssl_session(sslContext, connect_location)
                 else:
-                    sslContext = None
+                    sslContext = sslSession = None
                 sock = socketutil.create_socket(connect=connect_location,
                                                 reuseaddr=config.SOCK_REUSE,
                                                 timeout=self.__pyroTimeout,
                                                 nodelay=config.SOCK_NODELAY,
-                                                sslContext=sslContext)
+                                                sslContext=sslContext,
+                                                sslSession=sslSession)
                 conn = socketutil.SocketConnection(sock, uri.object)
                 # Do handshake.
-                serializer = serializers.serializers[self._pyroSerializer or config.SERIALIZER]
                 data = {"handshake": self._pyroHandshake, "object": uri.object}
+                if offered_serializers:
+                    # let the daemon choose the serializer, the configured one is the fallback
+                    data["serializers"] = offered_serializers
                 data = serializer.dumps(data)
                 msg = protocol.SendingMessage(protocol.MSG_CONNECT, 0, self._pyroSeq, serializer.serializer_id,
                                               data, annotations=current_context.annotations)
@@ -293,9 +352,14 @@ class Proxy(object):
                 msg = protocol.recv_stub(conn, [protocol.MSG_CONNECTOK, protocol.MSG_CONNECTFAIL])
                 if config.LOGWIRE:
                     protocol.log_wiredata(log, "proxy connect response received", msg)
+                if sslContext:
+                    socketutil.store_ssl_session(sslContext, connect_location, sock)
             except Exception as x:
+                if getattr(x, "retry_after", None) is not None:
+                    raise   # failing fast, no connection was attempted
                 if conn:
                     conn.close()
+                endpoint_states.failed(connect_location, self._pyroRetryPolicy)
                 err = "cannot connect to %s: %s" % (connect_location, x)
                 log.error(err)
                 if isinstance(x, errors.CommunicationError):
@@ -303,16 +367,26 @@ class Proxy(object):
                 else:
                     raise errors.CommunicationError(err) from x
             else:
+                if msg.serializer_id != serializer.serializer_id:
+                    # never deserialize with a serializer that the server picked, that would allow it to use pickle
+                    conn.close()
+                    error = "invalid serializer in connect response: %d" % msg.serializer_id
+                    log.error(error)
+                    raise errors.SerializeError(error)
                 handshake_response = "?"
                 if msg.data:
-                    serializer = serializers.serializers_by_id[msg.serializer_id]
                     handshake_response = serializer.loads(msg.data)
                 if msg.type == protocol.MSG_CONNECTFAIL:
+                    endpoint_states.succeeded(connect_location)    # the daemon is reachable, it just refused this connection
                     error = "connection to %s rejected: %s" % (connect_location, handshake_response)
                     conn.close()
                     log.error(error)
                     raise errors.CommunicationError(error)
                 elif msg.type == protocol.MSG_CONNECTOK:
+                    endpoint_states.succeeded(connect_location)
+                    # only switch to a serializer that this proxy offered itself (never to one the daemon made up)
+                    if handshake_response.get("serializer") in offered_serializers:
+                        self._pyroSerializer = handshake_response["serializer"]
                     self.__processMetadata(handshake_response["meta"])
                     handshake_response = handshake_response["handshake"]
                     self._pyroConnection = conn
@@ -339,6 +413,10 @@ class Proxy(object):
         if connected_socket:
             self._pyroConnection = socketutil.SocketConnection(connected_socket, uri.object, True)
         else:
+            serializer = _proxy_serializer(self._pyroSerializer or config.SERIALIZER)
+            offered_serializers = []
+            if config.SERIALIZERS_PREFERRED and not self._pyroSerializer:
+                offered_serializers = [name for name in config.SERIALIZERS_PREFERRED if name in serializers.serializers]
             connect_and_handshake(conn)
         # obtain metadata if this feature is enabled, and the metadata is not known yet
         if not self._pyroMethods and not self._pyroAttrs:
@@ -375,31 +453,59 @@ class Proxy(object):
         self._pyroOneway = set(metadata["oneway"])
         self._pyroMethods = set(metadata["methods"])
         self._pyroAttrs = set(metadata["attrs"])
+        self._pyroIdempotent = set(metadata.get("idempotent", ()))
+        self._pyroCacheable = dict(metadata.get("cacheable", {}))
         if log.isEnabledFor(logging.DEBUG):
             log.debug("from meta: methods=%s, oneway methods=%s, attributes=%s",
                       sorted(self._pyroMethods), sorted(self._pyroOneway), sorted(self._pyroAttrs))
         if not self._pyroMethods and not self._pyroAttrs:
             raise errors.PyroError("remote object doesn't expose any methods or attributes. Did you forget setting @expose on them?")
 
-    def _pyroReconnect(self, tries=100000000):
+    def _pyroReconnect(self, tries=100000000, deadline=None):
         """
         (Re)connect the proxy to the daemon containing the pyro object which the proxy is for.
         In contrast to the _pyroBind method, this one first releases the connection (if the proxy is still connected)
-        and retries making a new connection until it succeeds or the given amount of tries ran out.
+        and retries making a new connection until it succeeds, the given amount of tries ran out,
+        or the deadline (in seconds from now) has passed.
+        The delay between attempts is determined by the proxy's retry policy (exponential backoff).
         """
         self._pyroRelease()
+        end_time = time.time() + deadline if deadline is not None else None
+        attempt = 0
         while tries:
             try:
                 self.__pyroCreateConnection()
                 return
-            except errors.CommunicationError:
+            except errors.CommunicationError as x:
+                if getattr(x, "retry_after", None) is not None:
+                    # another proxy recently failed to connect there, wait for its backoff delay instead of using up a try
+                    delay = x.retry_after
+                    if end_time is not None:
+                        delay = min(delay, end_time - time.time())
+                        if delay < 0:
+                            break
+                    time.sleep(delay)
+                    continue
                 tries -= 1
                 if tries:
-                    time.sleep(2)
+                    delay = self._pyroRetryPolicy.backoff(attempt)
+                    attempt += 1
+                    if end_time is not None:
+                        delay = min(delay, end_time - time.time())
+                        if delay < 0:
+                            break
+                    time.sleep(delay)
         msg = "failed to reconnect"
         log.error(msg)
         raise errors.ConnectionClosedError(msg)
 
+    def _pyroCacheInvalidate(self, name=None):
+        """
+        Remove the results of the given cacheable method or attribute from this proxy's result cache.
+        If no name is given, the whole cache is cleared.
+        """
+        self._pyroResultCache.invalidate(name)
+
     def _pyroInvokeBatch(self, calls, oneway=False):
         flags = protocol.FLAGS_BATCH
         if oneway:
@@ -459,26 +565,192 @@ class Proxy(object):
                                    "create a new proxy in this thread or transfer ownership.")
 
 
+class _ResultCache(object):
+    """
+    LRU cache with a per-entry expiry time, for the results of methods that are marked as cacheable
+    (also used by the daemon for the serialized responses of methods marked with cache_serialized)
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.entries = collections.OrderedDict()     # key -> (expiry time, name, result)
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return False, None
+        expiry, _, result = entry
+        if expiry < time.time():
+            del self.entries[key]
+            return False, None
+        self.entries.move_to_end(key)
+        return True, result
+
+    def put(self, key, name, result, ttl):
+        if self.maxsize <= 0:
+            return
+        self.entries[key] = (time.time() + ttl, name, result)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def invalidate(self, name=None):
+        if name is None:
+            self.entries.clear()
+        else:
+            self.invalidate_where(lambda entry_name: entry_name == name)
+
+    def invalidate_where(self, predicate):
+        for key in [key for key, (_, entry_name, _) in self.entries.items() if predicate(entry_name)]:
+            del self.entries[key]
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class RetryPolicy(object):
+    """
+    Determines how a proxy retries failed calls and reconnects: the delay between attempts grows exponentially
+    (with some random jitter, to avoid all clients retrying at the same moment) up to ``max_delay``.
+    The number of retries is limited by a retry budget: every call adds ``budget_ratio`` of a token
+    (up to ``budget_max`` tokens) and every retry uses up a whole one, so retries can't multiply the load
+    on a server that is already struggling. If ``deadline`` is set, a call (including all its retries)
+    is given up when it would take longer than that many seconds.
+    You can subclass this and override :meth:`backoff` to implement a different strategy.
+    """
+    def __init__(self, initial_delay=0.01, max_delay=2.0, multiplier=2.0, jitter=0.2,
+                 budget_ratio=0.2, budget_max=10.0, deadline=None):
+        if initial_delay < 0 or max_delay < initial_delay or multiplier < 1.0 or not 0.0 <= jitter <= 1.0:
+            raise ValueError("invalid retry policy parameters")
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+        self.jitter = jitter
+        self.budget_ratio = budget_ratio
+        self.budget_max = budget_max
+        self.deadline = deadline
+        self.__tokens = budget_max
+        self.__lock = threading.Lock()
+
+    def backoff(self, attempt):
+        """the delay in seconds before the given attempt (starting at zero) is made"""
+        delay = min(self.max_delay, self.initial_delay * self.multiplier ** min(attempt, 64))
+        return delay * (1.0 - self.jitter * random.random())
+
+    def deposit(self):
+        """registers a call, which adds a fraction of a token to the retry budget"""
+        with self.__lock:
+            self.__tokens = min(self.budget_max, self.__tokens + self.budget_ratio)
+
+    def withdraw(self):
+        """tries to take a token from the retry budget for a retry. Returns False if the budget is exhausted."""
+        with self.__lock:
+            if self.__tokens < 1.0:
+                return False
+            self.__tokens -= 1.0
+            return True
+
+
+default_retry_policy = RetryPolicy()
+
+
+def _proxy_serializer(name):
+    """Returns the serializer with the given name. Proxies refuse the unsafe pickle serializer unless it is enabled."""
+    serializer = serializers.serializers[name]
+    if isinstance(serializer, serializers.PickleSerializer) and name not in config.SERIALIZERS_ACCEPTED:
+        raise errors.SecurityError("the pickle serializer is unsafe, it must be added to SERIALIZERS_ACCEPTED to use it")
+    return serializer
+
+
+class _EndpointStates(object):
+    """
+    Connection state per server location, shared by all proxies.
+    When connecting to a location fails, other proxies don't try it again until the backoff delay has passed,
+    but fail fast instead (with a CommunicationError that has a retry_after attribute).
+    Once a connection succeeds (or the daemon answers at all), the location is considered healthy again.
+    At most max_locations failing locations are remembered.
+    """
+    max_locations = 1000
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.states = {}    # location -> [number of failures, time of next allowed attempt]
+
+    def check(self, location):
+        if not self.states:
+            return
+        with self.lock:
+            state = self.states.get(location)
+            if state is None:
+                return
+            remaining = state[1] - time.time()
+            if remaining > 0:
+                error = errors.CommunicationError("cannot connect to %s: unreachable, next attempt possible in %.3f seconds"
+                                                  % (location, remaining))
+                error.retry_after = remaining
+                raise error
+
+    def failed(self, location, policy):
+        with self.lock:
+            state = self.states.get(location)
+            if state is None:
+                if len(self.states) >= self.max_locations:
+                    self._prune()
+                state = self.states[location] = [0, 0.0]
+            state[1] = time.time() + policy.backoff(state[0])
+            state[0] += 1
+
+    def _prune(self):
+        # forget the locations whose backoff delay has passed, and if that's not enough, the oldest ones
+        now = time.time()
+        for location in [location for location, state in self.states.items() if state[1] <= now]:
+            del self.states[location]
+        while len(self.states) >= self.max_locations:
+            del self.states[next(iter(self.states))]
+
+    def succeeded(self, location):
+        if self.states:
+            with self.lock:
+                self.states.pop(location, None)
+
+    def clear(self):
+        with self.lock:
+            self.states.clear()
+
+
+endpoint_states = _EndpointStates()
+
+
 class _RemoteMethod(object):
     """method call abstraction"""
 
-    def __init__(self, send, name, max_retries):
+    def __init__(self, send, name, max_retries, retry_policy=None):
         self.__send = send
         self.__name = name
         self.__max_retries = max_retries
+        self.__retry_policy = retry_policy or default_retry_policy
 
     def __getattr__(self, name):
-        return _RemoteMethod(self.__send, "%s.%s" % (self.__name, name), self.__max_retries)
+        return _RemoteMethod(self.__send, "%s.%s" % (self.__name, name), self.__max_retries, self.__retry_policy)
 
     def __call__(self, *args, **kwargs):
+        if not self.__max_retries:
+            return self.__send(self.__name, args, kwargs)
+        policy = self.__retry_policy
+        policy.deposit()
+        end_time = time.time() + policy.deadline if policy.deadline is not None else None
         for attempt in range(self.__max_retries + 1):
             try:
                 return self.__send(self.__name, args, kwargs)
             except (errors.ConnectionClosedError, errors.TimeoutError):
                 # only retry for recoverable network errors
-                if attempt >= self.__max_retries:
-                    # last attempt, raise the exception
+                if attempt >= self.__max_retries or not policy.withdraw():
+                    # last attempt or out of retry budget, raise the exception
                     raise
+                delay = policy.backoff(attempt)
+                if end_time is not None and time.time() + delay > end_time:
+                    raise
+                time.sleep(delay)
 
 
 class _StreamResultIterator(object):
@@ -534,6 +806,71 @@ class _StreamResultIterator(object):
         self.proxy = None
 
 
+class _ChunkedResultIterator(object):
+    """
+    Pyro returns this as the result of a call that returned a large list, tuple or dict, if the proxy
+    accepts chunked results. The daemon sends the elements in chunks, and this iterator produces them
+    as the chunks arrive, instead of waiting for the whole result to be received and deserialized.
+    For a dict result it produces the (key, value) pairs.
+    The proxy can't be used for other calls while the chunks are being received. If you do call it,
+    or call close(), before all elements have been read, the proxy's connection is closed
+    (it will reconnect automatically on the next call).
+    """
+    def __init__(self, proxy, serializer, first_chunk):
+        self.proxy = proxy
+        self.connection = proxy._pyroConnection
+        self.serializer = serializer
+        self.pyroseq = proxy._pyroSeq
+        self.chunk = self.__elements(first_chunk)
+        self.finished = not first_chunk
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        while True:
+            for item in self.chunk:
+                return item
+            if self.finished:
+                raise StopIteration
+            self.chunk = self.__elements(self.__receive())
+
+    @staticmethod
+    def __elements(chunk):
+        return iter(chunk.items()) if isinstance(chunk, dict) else iter(chunk)
+
+    def __receive(self):
+        if self.proxy._pyroConnection is not self.connection:
+            self.finished = True
+            raise errors.ConnectionClosedError("the connection for this chunked result has been closed")
+        try:
+            msg = protocol.recv_stub(self.connection, [protocol.MSG_RESULT])
+            if config.LOGWIRE:
+                protocol.log_wiredata(log, "proxy wiredata received", msg)
+            if msg.seq != self.pyroseq or msg.serializer_id != self.serializer.serializer_id:
+                raise errors.ProtocolError("invalid chunk received for this result")
+        except (errors.CommunicationError, KeyboardInterrupt):
+            self.finished = True
+            self.proxy._pyroRelease()
+            raise
+        data = self.serializer.loads(msg.data)
+        if msg.flags & protocol.FLAGS_EXCEPTION:
+            self.finished = True
+            raise data
+        if not data:
+            self.finished = True
+        return data
+
+    def close(self):
+        """Stops receiving the result. The proxy's connection is closed if not all chunks have been received yet."""
+        if not self.finished:
+            self.finished = True
+            self.chunk = iter(())
+            if self.proxy._pyroConnection is self.connection:
+                log.debug("closing connection because chunked result was not read completely")
+                self.proxy._pyroRelease()
+
+
 class _BatchedRemoteMethod(object):
     """method call abstraction that is used with batched calls"""
 
@@ -594,6 +931,303 @@ class BatchProxy(object):
         return self.__resultsgenerator(results)
 
 
+class _Endpoint(object):
+    """bookkeeping for one of the candidate objects of a BalancingProxy"""
+
+    def __init__(self, uri):
+        self.uri = uri
+        self.proxy = None       # created on first use
+        self.lock = threading.Lock()   # a proxy can only do one call at a time
+        self.outstanding = 0    # number of calls that are running or waiting for this endpoint
+        self.ewma = 0.0         # exponentially weighted moving average of the call latency (0 = unknown yet)
+        self.down_until = 0.0   # endpoint is considered unhealthy until this time
+
+    def __repr__(self):
+        return "<endpoint %s; outstanding=%d ewma=%.4f>" % (self.uri, self.outstanding, self.ewma)
+
+
+class BalancingProxy(object):
+    """
+    Proxy that spreads its method calls over all objects that match a ``PYROMETA:`` uri.
+    A normal Proxy resolves such an uri once and then stays with that single object.
+    This one keeps a connection to every matching registration in the name server, and routes each call
+    to the 'best' one according to the chosen strategy:
+
+    - ``"least-outstanding"``: fewest running calls, ties are broken by the lowest average latency.
+    - ``"ewma"``: lowest exponentially weighted moving average latency, penalized by the number of running calls.
+
+    Endpoints that cannot be reached are skipped for a while, and the set of candidates is refreshed
+    from the name server every ``refresh_interval`` seconds.
+    Contrary to a normal Proxy, it is okay to share a BalancingProxy among threads.
+
+    If you set ``hedge_percentile``, calls to methods that the server marked as ``@idempotent`` are hedged:
+    when the first endpoint hasn't answered within that percentile of the method's observed latencies,
+    a duplicate request is sent to a second endpoint, and whichever reply arrives first is used.
+    """
+    down_time = 5.0     # seconds an unreachable endpoint is left out of the rotation
+    ewma_decay = 0.3    # weight of a new latency sample in the moving average
+    hedge_min_samples = 10      # minimum number of latency samples of a method before calls to it are hedged
+    latency_samples = 100       # number of recent latency samples kept per method
+
+    def __init__(self, uri, refresh_interval=10.0, strategy="least-outstanding", hedge_percentile=None):
+        if isinstance(uri, str):
+            uri = core.URI(uri)
+        elif not isinstance(uri, core.URI):
+            raise TypeError("expected Pyro URI")
+        if uri.protocol != "PYROMETA":
+            raise ValueError("BalancingProxy requires a PYROMETA uri")
+        if strategy not in ("least-outstanding", "ewma"):
+            raise ValueError("invalid balancing strategy: " + strategy)
+        if hedge_percentile is not None and not 0 < hedge_percentile < 100:
+            raise ValueError("hedge_percentile must be between 0 and 100")
+        self._pyroUri = uri
+        self._pyroStrategy = strategy
+        self._pyroRefreshInterval = refresh_interval
+        self._pyroEndpoints = {}    # uri string -> _Endpoint
+        self._pyroLastRefresh = 0.0
+        self._pyroLock = threading.RLock()
+        self._pyroMethods = set()
+        self._pyroAttrs = set()
+        self._pyroOneway = set()
+        self._pyroIdempotent = set()
+        self._pyroHedgePercentile = hedge_percentile
+        self._pyroLatencies = {}    # method name -> recent latency samples
+        self._pyroHedgeStats = {"calls": 0, "hedged": 0, "hedge_wins": 0}
+        self._pyroExecutor = None
+        self._pyroTimeout = config.COMMTIMEOUT
+        self._pyroMaxRetries = config.MAX_RETRIES
+        self._pyroRetryPolicy = default_retry_policy
+        self._pyroSerializer = None
+        self._pyroHandshake = "hello"
+
+    def __getattr__(self, name):
+        if name.startswith("_pyro") or name.startswith("__"):
+            raise AttributeError(name)
+        if not self._pyroMethods and not self._pyroAttrs:
+            self._pyroGetMetadata()
+        if name in self._pyroAttrs:
+            return self._pyroInvoke("__getattr__", (name,), None)
+        if name not in self._pyroMethods:
+            raise AttributeError("remote objects '%s' have no exposed attribute or method '%s'" % (self._pyroUri, name))
+        return _RemoteMethod(self._pyroInvoke, name, self._pyroMaxRetries, self._pyroRetryPolicy)
+
+    def __setattr__(self, name, value):
+        if name.startswith("_pyro"):
+            return super(BalancingProxy, self).__setattr__(name, value)
+        raise AttributeError("can't set remote attribute '%s' through a BalancingProxy" % name)
+
+    def __repr__(self):
+        return "<%s.%s at 0x%x; for %s; %d endpoints>" % (self.__class__.__module__, self.__class__.__name__,
+                                                          id(self), self._pyroUri, len(self._pyroEndpoints))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._pyroRelease()
+
+    def __dir__(self):
+        result = dir(self.__class__) + list(self.__dict__.keys())
+        return sorted(set(result) | self._pyroMethods | self._pyroAttrs)
+
+    def _pyroRelease(self):
+        """release the connections to all endpoints"""
+        with self._pyroLock:
+            endpoints = list(self._pyroEndpoints.values())
+            executor, self._pyroExecutor = self._pyroExecutor, None
+        if executor:
+            executor.shutdown(wait=False)
+        for endpoint in endpoints:
+            self.__pyroReleaseEndpoint(endpoint)
+
+    def _pyroLookupCandidates(self):
+        """
+        Returns the uris of all objects that match the PYROMETA uri, as registered in the name server.
+        Override this if you want to obtain the candidates in a different way.
+        """
+        from . import nameserver   # doing it here to avoid circular import issues
+        with core.locate_ns(self._pyroUri.host, self._pyroUri.port) as ns:
+            return nameserver.yplookup(ns, self._pyroUri.object, None, False).values()
+
+    def _pyroRefresh(self):
+        """Refresh the set of candidate endpoints from the name server."""
+        candidates = {str(uri) for uri in self._pyroLookupCandidates()}
+        with self._pyroLock:
+            self._pyroLastRefresh = time.time()
+            for uri in candidates - set(self._pyroEndpoints):
+                self._pyroEndpoints[uri] = _Endpoint(core.URI(uri))
+            vanished = [self._pyroEndpoints.pop(uri) for uri in set(self._pyroEndpoints) - candidates]
+        for endpoint in vanished:
+            self.__pyroReleaseEndpoint(endpoint, wait=False)
+        if vanished or candidates:
+            log.debug("balancing endpoints for %s: %d active, %d removed", self._pyroUri, len(candidates), len(vanished))
+
+    def _pyroGetMetadata(self):
+        """Get the metadata (methods, attrs, oneway, ...) of the remote objects via one of the endpoints."""
+        tried = set()
+        while True:
+            endpoint = self.__pyroAcquire(tried)
+            try:
+                with endpoint.lock:
+                    try:
+                        proxy = self.__pyroConnectEndpoint(endpoint)
+                    except errors.CommunicationError:
+                        continue
+                    self._pyroMethods = set(proxy._pyroMethods)
+                    self._pyroAttrs = set(proxy._pyroAttrs)
+                    self._pyroOneway = set(proxy._pyroOneway)
+                    self._pyroIdempotent = set(proxy._pyroIdempotent)
+                    return
+            finally:
+                with self._pyroLock:
+                    endpoint.outstanding -= 1
+
+    def _pyroInvoke(self, methodname, vargs, kwargs, flags=0, objectId=None):
+        """perform the remote method call on the best endpoint that is currently available"""
+        if self._pyroHedgePercentile and methodname in self._pyroIdempotent and objectId is None:
+            delay = self.__pyroHedgeDelay(methodname)
+            if delay is not None:
+                return self.__pyroInvokeHedged(delay, methodname, vargs, kwargs, flags)
+        return self.__pyroInvokeBest(set(), methodname, vargs, kwargs, flags, objectId)
+
+    def __pyroInvokeBest(self, tried, methodname, vargs, kwargs, flags, objectId):
+        while True:
+            endpoint = self.__pyroAcquire(tried)
+            try:
+                with endpoint.lock:
+                    try:
+                        proxy = self.__pyroConnectEndpoint(endpoint)
+                    except errors.CommunicationError:
+                        continue    # the call wasn't sent yet, so it is safe to try another endpoint
+                    start = time.time()
+                    try:
+                        result = proxy._pyroInvoke(methodname, vargs, kwargs, flags, objectId)
+                    except errors.CommunicationError:
+                        self.__pyroMarkDown(endpoint)
+                        raise
+                    self.__pyroRecordLatency(endpoint, methodname, time.time() - start)
+                    return result
+            finally:
+                with self._pyroLock:
+                    endpoint.outstanding -= 1
+
+    def __pyroInvokeHedged(self, delay, methodname, vargs, kwargs, flags):
+        def call(context):
+            current_context.from_global(context)
+            result = self.__pyroInvokeBest(tried, methodname, vargs, kwargs, flags, None)
+            return result, current_context.response_annotations
+
+        tried = set()   # shared by both calls, so that the hedge request goes to another endpoint
+        context = current_context.to_global()
+        with self._pyroLock:
+            if self._pyroExecutor is None:
+                self._pyroExecutor = concurrent.futures.ThreadPoolExecutor(thread_name_prefix="pyro-hedge")
+            executor = self._pyroExecutor
+            self._pyroHedgeStats["calls"] += 1
+        primary = executor.submit(call, context)
+        futures = [primary]
+        done, _ = concurrent.futures.wait(futures, timeout=delay)
+        if not done:
+            log.debug("hedging call to %s after %.4f sec", methodname, delay)
+            with self._pyroLock:
+                self._pyroHedgeStats["hedged"] += 1
+            futures.append(executor.submit(call, context))
+        pending = futures
+        error = None
+        while pending:
+            done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                exception = future.exception()
+                if exception is None:
+                    result, current_context.response_annotations = future.result()
+                    if future is not primary:
+                        with self._pyroLock:
+                            self._pyroHedgeStats["hedge_wins"] += 1
+                    return result
+                if not isinstance(exception, errors.CommunicationError):
+                    raise exception     # the remote method itself failed, the other reply won't be any different
+                if error is None or future is primary:
+                    error = exception
+        raise error
+
+    def __pyroHedgeDelay(self, methodname):
+        with self._pyroLock:
+            samples = self._pyroLatencies.get(methodname)
+            if not samples or len(samples) < self.hedge_min_samples:
+                return None
+            samples = sorted(samples)
+        return samples[min(len(samples) - 1, int(len(samples) * self._pyroHedgePercentile / 100.0))]
+
+    def __pyroAcquire(self, exclude):
+        """select the best available endpoint (not in exclude) and register a new outstanding call on it"""
+        if time.time() - self._pyroLastRefresh > self._pyroRefreshInterval:
+            try:
+                self._pyroRefresh()
+            except errors.PyroError as x:
+                if not self._pyroEndpoints:
+                    raise
+                # keep using the endpoints that we already know about
+                self._pyroLastRefresh = time.time()
+                log.warning("cannot refresh balancing endpoints for %s: %s", self._pyroUri, x)
+        with self._pyroLock:
+            now = time.time()
+            healthy = [ep for ep in self._pyroEndpoints.values() if ep.down_until <= now and ep not in exclude]
+            if not healthy:
+                raise errors.CommunicationError("no reachable objects available for %s" % self._pyroUri)
+            if self._pyroStrategy == "ewma":
+                endpoint = min(healthy, key=lambda ep: ep.ewma * (ep.outstanding + 1))
+            else:
+                endpoint = min(healthy, key=lambda ep: (ep.outstanding, ep.ewma))
+            endpoint.outstanding += 1
+            exclude.add(endpoint)
+            return endpoint
+
+    def __pyroConnectEndpoint(self, endpoint):
+        # must be called while holding the endpoint's lock
+        if endpoint.proxy is None:
+            proxy = Proxy(endpoint.uri)
+            proxy._pyroTimeout = self._pyroTimeout
+            proxy._pyroRetryPolicy = self._pyroRetryPolicy
+            proxy._pyroMaxRetries = 0   # retries are done by the balancing proxy itself
+            proxy._pyroSerializer = self._pyroSerializer
+            proxy._pyroHandshake = self._pyroHandshake
+            endpoint.proxy = proxy
+        endpoint.proxy._pyroClaimOwnership()
+        if endpoint.proxy._pyroConnection is None:
+            try:
+                endpoint.proxy._pyroBind()
+            except errors.CommunicationError:
+                self.__pyroMarkDown(endpoint)
+                raise
+        return endpoint.proxy
+
+    def __pyroMarkDown(self, endpoint):
+        log.debug("endpoint unreachable, leaving it out for a while: %s", endpoint.uri)
+        with self._pyroLock:
+            endpoint.down_until = time.time() + self.down_time
+            endpoint.ewma = 0.0
+
+    def __pyroRecordLatency(self, endpoint, methodname, latency):
+        with self._pyroLock:
+            samples = self._pyroLatencies.get(methodname)
+            if samples is None:
+                samples = self._pyroLatencies[methodname] = collections.deque(maxlen=self.latency_samples)
+            samples.append(latency)
+            if endpoint.ewma:
+                endpoint.ewma = self.ewma_decay * latency + (1.0 - self.ewma_decay) * endpoint.ewma
+            else:
+                endpoint.ewma = latency
+
+    def __pyroReleaseEndpoint(self, endpoint, wait=True):
+        if endpoint.lock.acquire(wait):
+            try:
+                if endpoint.proxy is not None:
+                    endpoint.proxy._pyroClaimOwnership()
+                    endpoint.proxy._pyroRelease()
+            finally:
+                endpoint.lock.release()
+
+
 class SerializedBlob(object):
     """
     Used to wrap some data to make Pyro pass this object transparently (it keeps the serialized payload as-is)
@@ -16,11 +16,14 @@ class Configuration:
     # DO NOT EDIT THESE HERE IN THIS MODULE! They are the global defaults.
     # Instead, specify them later in your own code or via environment variables.
     __slots__ = [
-        "HOST", "NS_HOST", "NS_PORT", "NS_BCPORT", "NS_BCHOST", "NS_AUTOCLEAN", "NS_LOOKUP_DELAY",
+        "HOST", "NS_HOST", "NS_PORT", "NS_BCPORT", "NS_BCHOST", "NS_AUTOCLEAN", "NS_LOOKUP_DELAY", "NS_CHANGES_SIZE",
+        "NS_LOCATION_CACHE", "NS_LOCATION_CACHE_TTL",
         "NATHOST", "NATPORT", "COMPRESSION", "SERVERTYPE", "COMMTIMEOUT", "POLLTIMEOUT", "MAX_RETRIES",
         "SOCK_REUSE", "SOCK_NODELAY", "DETAILED_TRACEBACK", "THREADPOOL_SIZE", "THREADPOOL_SIZE_MIN",
-        "MAX_MESSAGE_SIZE", "BROADCAST_ADDRS", "PREFER_IP_VERSION", "SERIALIZER",
-        "ITER_STREAMING", "ITER_STREAM_LIFETIME", "ITER_STREAM_LINGER", "LOGFILE", "LOGLEVEL", "LOGWIRE",
+        "MAX_MESSAGE_SIZE", "BROADCAST_ADDRS", "PREFER_IP_VERSION", "SERIALIZER", "SERIALIZERS_ACCEPTED",
+        "SERIALIZERS_PREFERRED", "RESULT_CACHE_SIZE", "RESULT_CHUNK_SIZE", "RESPONSE_CACHE_SIZE",
+        "ITER_STREAMING", "ITER_STREAM_LIFETIME", "ITER_STREAM_LINGER",
+        "LOGFILE", "LOGLEVEL", "LOGWIRE",
         "SSL", "SSL_SERVERCERT", "SSL_SERVERKEY", "SSL_SERVERKEYPASSWD", "SSL_REQUIRECLIENTCERT",
         "SSL_CLIENTCERT", "SSL_CLIENTKEY", "SSL_CLIENTKEYPASSWD", "SSL_CACERTS"
     ]
@@ -40,6 +43,9 @@ class Configuration:
         self.NS_BCHOST = None
         self.NS_AUTOCLEAN = 0.0
         self.NS_LOOKUP_DELAY = 0.0
+        self.NS_CHANGES_SIZE = 10000
+        self.NS_LOCATION_CACHE = ""     # file to remember the located name server in, empty=disabled
+        self.NS_LOCATION_CACHE_TTL = 60.0
         self.NATHOST = None
         self.NATPORT = 0
         self.COMPRESSION = False
@@ -56,6 +62,11 @@ class Configuration:
         self.BROADCAST_ADDRS = ["<broadcast>", "0.0.0.0"]
         self.PREFER_IP_VERSION = 0  # 4, 6 or 0 (0=let OS choose according to RFC 3484)
         self.SERIALIZER = "serpent"
+        self.SERIALIZERS_ACCEPTED = {"serpent", "marshal", "json", "msgpack"}
+        self.SERIALIZERS_PREFERRED = []     # serializers to negotiate with the daemon, in order of preference
+        self.RESULT_CACHE_SIZE = 1000
+        self.RESULT_CHUNK_SIZE = 1000
+        self.RESPONSE_CACHE_SIZE = 1000
         self.LOGWIRE = False
         self.ITER_STREAMING = True
         self.ITER_STREAM_LIFETIME = 0.0
@@ -4,8 +4,13 @@ Multi purpose stuff used by both clients and servers (URI etc)
 Pyro - Python Remote Objects.  Copyright by Irmen de Jong (irmen@razorvine.net).
 """
 
+import os
 import re
+import json
+import time
+import queue
 import logging
+import threading
 import contextlib
 import ipaddress
 import socket
@@ -205,84 +210,181 @@ def resolve(uri: Union[str, URI], delay_time: float = 0.0) -> URI:
 
 def locate_ns(host: Union[str, ipaddress.IPv4Address, ipaddress.IPv6Address] = "",
               port: Optional[int] = None, broadcast: bool = True) -> "client.Proxy":
-    """Get a proxy for a name server somewhere in the network."""
-    from . import client
+    """
+    Get a proxy for a name server somewhere in the network.
+    Without a host, all candidate locations (localhost, NS_HOST and the broadcast lookup) are tried in parallel
+    and the first name server that answers is used. If NS_LOCATION_CACHE is set, the location that was found
+    is remembered in that file for NS_LOCATION_CACHE_TTL seconds, and tried first by subsequent lookups.
+    """
     if not host:
+        cache_key = "%s:%s:%s" % (config.NS_HOST, port or "", broadcast)
+        proxy = _cached_ns_location(cache_key)
+        if proxy is not None:
+            return proxy
+        uris = []
         # first try localhost if we have a good chance of finding it there
         if config.NS_HOST in ("localhost", "::1") or config.NS_HOST.startswith("127."):
-            if ":" in config.NS_HOST:  # ipv6
-                hosts = ["[%s]" % config.NS_HOST]
-            else:
+            hosts = [config.NS_HOST]
+            if ":" not in config.NS_HOST and config.NS_HOST != "127.0.1.1":
                 # Some systems (Debian Linux) have 127.0.1.1 in the hosts file assigned to the hostname,
                 # try this too for convenience sake (only if it's actually used as a valid ip address)
-                try:
+                with contextlib.suppress(socket.error):
                     socket.gethostbyaddr("127.0.1.1")
-                    hosts = [config.NS_HOST] if config.NS_HOST == "127.0.1.1" else [config.NS_HOST, "127.0.1.1"]
-                except socket.error:
-                    hosts = [config.NS_HOST]
-            for host in hosts:
-                uristring = "PYRO:%s@%s:%d" % (NAMESERVER_NAME, host, port or config.NS_PORT)
-                log.debug("locating the NS: %s", uristring)
-                proxy = client.Proxy(uristring)
-                with contextlib.suppress(errors.PyroError):
-                    proxy._pyroBind()
-                    log.debug("located NS")
-                    return proxy
+                    hosts.append("127.0.1.1")
+            uris.extend(_ns_uri(host, port or config.NS_PORT) for host in hosts)
+        # if the broadcast fails or is skipped, try PYRO directly on specific host
+        uri = _ns_uri(config.NS_HOST, config.NS_PORT)
+        if uri not in uris:
+            uris.append(uri)
+        probes = [lambda uri=uri: _locate_ns_direct(uri) for uri in uris]
         if config.PREFER_IP_VERSION == 6:
             broadcast = False   # ipv6 doesn't have broadcast. We should probably use multicast....
         if broadcast:
-            # broadcast lookup
-            if not port:
-                port = config.NS_BCPORT
-            log.debug("broadcast locate")
-            sock = socketutil.create_bc_socket(reuseaddr=config.SOCK_REUSE, timeout=0.7)
-            for _ in range(3):
-                try:
-                    for bcaddr in config.BROADCAST_ADDRS:
-                        try:
-                            sock.sendto(b"GET_NSURI", 0, (bcaddr, port))
-                        except socket.error as x:
-                            err = getattr(x, "errno", x.args[0])
-                            # handle some errno's that some platforms like to throw:
-                            if err not in socketutil.ERRNO_EADDRNOTAVAIL and err not in socketutil.ERRNO_EADDRINUSE:
-                                raise
-                    data, _ = sock.recvfrom(100)
-                    sock.close()
-                    text = data.decode("iso-8859-1")
-                    log.debug("located NS: %s", text)
-                    proxy = client.Proxy(text)
-                    return proxy
-                except socket.timeout:
-                    continue
-            with contextlib.suppress(OSError, socket.error):
-                sock.shutdown(socket.SHUT_RDWR)
-            sock.close()
-            log.debug("broadcast locate failed, try direct connection on NS_HOST")
+            probes.append(lambda: _locate_ns_broadcast(port or config.NS_BCPORT))
         else:
             log.debug("skipping broadcast lookup")
-        # broadcast failed or skipped, try PYRO directly on specific host
-        host = config.NS_HOST
-        port = config.NS_PORT
+        try:
+            proxy = _locate_ns_parallel(probes)
+        except errors.PyroError as x:
+            raise errors.NamingError("Failed to locate the nameserver") from x
+        _store_ns_location(cache_key, proxy._pyroUri)
+        return proxy
     elif not isinstance(host, str):
         host = str(host)    # take care of the occasion where host is an ipaddress.IpAddress
     # pyro direct lookup
-    port = config.NS_PORT if not port else port
+    try:
+        return _locate_ns_direct(_ns_uri(host, port or config.NS_PORT))
+    except errors.PyroError as x:
+        raise errors.NamingError("Failed to locate the nameserver") from x
+
+
+def _ns_uri(host, port):
     if URI.isUnixsockLocation(host):
-        uristring = "PYRO:%s@%s" % (NAMESERVER_NAME, host)
-    else:
-        # if not a unix socket, check for ipv6
-        if host and ":" in str(host):
-            host = "[%s]" % host
-        uristring = "PYRO:%s@%s:%d" % (NAMESERVER_NAME, host, port)
-    uri = URI(uristring)
+        return URI("PYRO:%s@%s" % (NAMESERVER_NAME, host))
+    # if not a unix socket, check for ipv6
+    if ":" in host:
+        host = "[%s]" % host
+    return URI("PYRO:%s@%s:%d" % (NAMESERVER_NAME, host, port))
+
+
+def _locate_ns_direct(uri):
+    from . import client
     log.debug("locating the NS: %s", uri)
     proxy = client.Proxy(uri)
     try:
         proxy._pyroBind()
-        log.debug("located NS")
-        return proxy
-    except errors.PyroError as x:
-        raise errors.NamingError("Failed to locate the nameserver") from x
+    except errors.PyroError:
+        proxy._pyroRelease()
+        raise
+    log.debug("located NS")
+    return proxy
+
+
+def _locate_ns_broadcast(port):
+    from . import client
+    log.debug("broadcast locate")
+    sock = socketutil.create_bc_socket(reuseaddr=config.SOCK_REUSE, timeout=0.7)
+    try:
+        for _ in range(3):
+            try:
+                for bcaddr in config.BROADCAST_ADDRS:
+                    try:
+                        sock.sendto(b"GET_NSURI", 0, (bcaddr, port))
+                    except socket.error as x:
+                        err = getattr(x, "errno", x.args[0])
+                        # handle some errno's that some platforms like to throw:
+                        if err not in socketutil.ERRNO_EADDRNOTAVAIL and err not in socketutil.ERRNO_EADDRINUSE:
+                            raise
+                data, _ = sock.recvfrom(100)
+                text = data.decode("iso-8859-1")
+                log.debug("located NS: %s", text)
+                return client.Proxy(text)
+            except socket.timeout:
+                continue
+        log.debug("broadcast locate failed")
+        raise errors.NamingError("no name server answered the broadcast")
+    except socket.error as x:
+        raise errors.CommunicationError(str(x)) from x
+    finally:
+        with contextlib.suppress(OSError, socket.error):
+            sock.shutdown(socket.SHUT_RDWR)
+        sock.close()
+
+
+def _locate_ns_parallel(probes):
+    # Runs the probes (functions that return a name server proxy or raise an error) each in their own thread.
+    # Returns the proxy of the first probe that succeeds, or raises the error of the last one if they all failed.
+    results = queue.Queue()
+    finished = threading.Event()
+    lock = threading.Lock()
+
+    def run(probe):
+        try:
+            result = probe()
+        except Exception as x:
+            result = x
+        with lock:
+            if finished.is_set():
+                if not isinstance(result, Exception):
+                    result._pyroRelease()     # someone else was faster
+            else:
+                results.put(result)
+
+    for probe in probes:
+        threading.Thread(target=run, args=(probe,), name="Pyro-locate-ns", daemon=True).start()
+    error = None
+    try:
+        for _ in probes:
+            result = results.get()
+            if isinstance(result, Exception):
+                error = result
+            else:
+                result._pyroClaimOwnership()
+                return result
+        raise error
+    finally:
+        with lock:
+            finished.set()
+            while not results.empty():
+                result = results.get()
+                if not isinstance(result, Exception):
+                    result._pyroClaimOwnership()
+                    result._pyroRelease()
+
+
+def _cached_ns_location(key):
+    # returns a proxy for the name server location in the cache file, if it is there and still valid and reachable
+    if not config.NS_LOCATION_CACHE:
+        return None
+    try:
+        with open(config.NS_LOCATION_CACHE, "r") as cachefile:
+            cached = json.load(cachefile)
+        if cached["key"] != key or not 0 <= time.time() - cached["timestamp"] < config.NS_LOCATION_CACHE_TTL:
+            return None
+        uri = URI(cached["uri"])
+    except (OSError, ValueError, KeyError, TypeError, errors.PyroError):
+        return None
+    try:
+        return _locate_ns_direct(uri)
+    except errors.PyroError:
+        log.debug("cached NS location is not valid anymore: %s", uri)
+        with contextlib.suppress(OSError):
+            os.remove(config.NS_LOCATION_CACHE)
+        return None
+
+
+def _store_ns_location(key, uri):
+    if not config.NS_LOCATION_CACHE:
+        return
+    tempname = "%s.%d.tmp" % (config.NS_LOCATION_CACHE, os.getpid())
+    try:
+        with open(tempname, "w") as cachefile:
+            json.dump({"key": key, "uri": str(uri), "timestamp": time.time()}, cachefile)
+        os.replace(tempname, config.NS_LOCATION_CACHE)
+    except OSError as x:
+        log.warning("cannot write the NS location cache: %s", x)
+        with contextlib.suppress(OSError):
+            os.remove(tempname)
 
 
 def type_meta(class_or_object, prefix="class:"):
@@ -4,19 +4,29 @@ Name Server and helper functions.
 Pyro - Python Remote Objects.  Copyright by Irmen de Jong (irmen@razorvine.net).
 """
 
+import os
+import json
 import warnings
 import re
+import errno
+import random
+import selectors
+import bisect
+import heapq
 import logging
 import socket
 import time
 import contextlib
+import concurrent.futures
+import functools
 import threading
+import collections
 from collections.abc import MutableMapping
 try:
     import sqlite3
 except ImportError:
     pass
-from . import config, core, socketutil, server, errors
+from . import config, core, socketutil, server, client, errors
 from .errors import NamingError, PyroError, ProtocolError
 
 
@@ -30,22 +40,110 @@ class MemoryStorage(dict):
     Storage implementation that is just an in-memory dict.
     (because it inherits from dict it is automatically a collections.MutableMapping)
     Stopping the nameserver will make the server instantly forget about everything.
+    A sorted list of the names and an inverted index of the metadata tags are kept up to date
+    on every change, so that prefix listings and metadata lookups don't have to scan all registrations.
     """
     def __init__(self, **kwargs):
-        super(MemoryStorage, self).__init__(**kwargs)
+        super(MemoryStorage, self).__init__()
+        self.sorted_names = []
+        self.metadata_index = {}
+        self.update(kwargs)
 
     def __setitem__(self, key, value):
         uri, metadata = value
-        super(MemoryStorage, self).__setitem__(key, (uri, metadata or frozenset()))
+        metadata = set(metadata or ())      # a plain set, because not every serializer supports frozenset
+        if key in self:
+            self._unindex_metadata(key)
+        else:
+            bisect.insort(self.sorted_names, key)
+        super(MemoryStorage, self).__setitem__(key, (uri, metadata))
+        for tag in metadata:
+            self.metadata_index.setdefault(tag, set()).add(key)
+
+    def __delitem__(self, key):
+        self._unindex_metadata(key)
+        super(MemoryStorage, self).__delitem__(key)
+        del self.sorted_names[bisect.bisect_left(self.sorted_names, key)]
+
+    def _rebuild_indexes(self):
+        self.sorted_names = sorted(self)
+        self.metadata_index = {}
+        for key, (uri, metadata) in self.items():
+            for tag in metadata:
+                self.metadata_index.setdefault(tag, set()).add(key)
+
+    def _unindex_metadata(self, key):
+        for tag in self[key][1]:
+            names = self.metadata_index[tag]
+            names.discard(key)
+            if not names:
+                del self.metadata_index[tag]
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def pop(self, key, *default):
+        if key in self:
+            value = self[key]
+            del self[key]
+            return value
+        if default:
+            return default[0]
+        raise KeyError(key)
+
+    def popitem(self):
+        if not self:
+            raise KeyError("popitem(): dictionary is empty")
+        key = self.sorted_names[-1]
+        return key, self.pop(key)
+
+    def clear(self):
+        super(MemoryStorage, self).clear()
+        self.sorted_names = []
+        self.metadata_index = {}
 
     def optimized_prefix_list(self, prefix, return_metadata=False):
-        return None
+        names = []
+        index = bisect.bisect_left(self.sorted_names, prefix)
+        while index < len(self.sorted_names) and self.sorted_names[index].startswith(prefix):
+            names.append(self.sorted_names[index])
+            index += 1
+        if return_metadata:
+            return {name: self[name] for name in names}
+        return {name: self[name][0] for name in names}
+
+    def optimized_prefix_page(self, prefix, cursor, limit, return_metadata=False):
+        names = []
+        index = bisect.bisect_left(self.sorted_names, prefix)
+        if cursor is not None:
+            index = max(index, bisect.bisect_right(self.sorted_names, cursor))
+        while index < len(self.sorted_names) and len(names) < limit and self.sorted_names[index].startswith(prefix):
+            names.append(self.sorted_names[index])
+            index += 1
+        if return_metadata:
+            return {name: self[name] for name in names}
+        return {name: self[name][0] for name in names}
 
     def optimized_regex_list(self, regex, return_metadata=False):
         return None
 
     def optimized_metadata_search(self, metadata_all=None, metadata_any=None, return_metadata=False):
-        return None
+        if metadata_any:
+            names = set()
+            for tag in metadata_any:
+                names.update(self.metadata_index.get(tag, ()))
+        else:
+            indexed = sorted((self.metadata_index.get(tag, set()) for tag in set(metadata_all)), key=len)
+            names = indexed[0].intersection(*indexed[1:]) if indexed else set()
+        if return_metadata:
+            return {name: self[name] for name in names}
+        return {name: self[name][0] for name in names}
 
     def everything(self, return_metadata=False):
         if return_metadata:
@@ -57,22 +155,270 @@ class MemoryStorage(dict):
             if item in self:
                 del self[item]
 
+    def get_items(self, items):
+        return {item: self[item] for item in items if item in self}
+
+    def set_items(self, items):
+        for key, value in items.items():
+            self[key] = value
+
+    def deferred_sync(self):
+        # the changes are in memory only, there's nothing to wait for
+        return contextlib.suppress()
+
     def close(self):
         pass
 
 
+class LogStorage(MemoryStorage):
+    """
+    Storage that serves everything from memory (like MemoryStorage, including its indexes),
+    and is made persistent by appending every change to a log file in the given directory.
+    A change is only acknowledged once the log is synced to disk (fsync). With group_commit, the fsyncs are done
+    by a background thread and every fsync covers all changes written so far, so that concurrent changes
+    share a single fsync instead of each waiting for the disk in turn. Callers that hold a lock of their own
+    while changing the storage can use deferred_sync() to wait for the fsync after they've released it.
+    When the log has grown large compared to the number of registrations, it is compacted:
+    the current registrations are written to a snapshot file and the log starts over.
+    On startup the snapshot is loaded and the log is replayed on top of it.
+    """
+    log_filename = "pyro-names.log"
+    snapshot_filename = "pyro-names.snapshot"
+    group_commit = True     # False means: every change is fsynced by its own writer
+    compact_min_entries = 10000
+
+    def __init__(self, directory):
+        super(LogStorage, self).__init__()
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.log_lock = threading.Lock()
+        self.sync_needed = threading.Condition(self.log_lock)   # signals the sync thread
+        self.synced = threading.Condition(self.log_lock)        # signals the writers waiting for their fsync
+        self.log_entries = 0
+        self.written_batches = 0   # sequence number of the last batch written to the log
+        self.synced_batches = 0    # sequence number of the last batch that is on disk
+        self.sync_error = None     # (batch, exception) of the last failed fsync
+        self.stop_syncing = False
+        self.sync_thread = None
+        self.deferred = threading.local()
+        self._replay(os.path.join(directory, self.snapshot_filename))
+        self.log_entries = self._replay(os.path.join(directory, self.log_filename))
+        self._rebuild_indexes()
+        self.logfile = open(os.path.join(directory, self.log_filename), "a", encoding="utf-8")
+        if self.group_commit:
+            self.sync_thread = threading.Thread(target=self._sync_loop, name="Pyro-NS-LogStorage-sync", daemon=True)
+            self.sync_thread.start()
+        self._compact_if_needed()
+
+    def _replay(self, filename):
+        entries = 0
+        try:
+            with open(filename, "r", encoding="utf-8") as file:
+                for line in file:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        log.warning("ignored corrupt entry in %s: %r", filename, line)   # a torn write at the end
+                        continue
+                    # the indexes are rebuilt afterwards, in one go
+                    if entry[0] == "set":
+                        dict.__setitem__(self, entry[1], (entry[2], set(entry[3])))
+                    elif entry[0] == "del":
+                        dict.pop(self, entry[1], None)
+                    elif entry[0] == "clear":
+                        dict.clear(self)
+                    entries += 1
+        except FileNotFoundError:
+            pass
+        return entries
+
+    def _set_entry(self, key):
+        uri, metadata = self[key]
+        return ["set", key, uri, sorted(metadata)]
+
+    def _write(self, entries):
+        if not entries:
+            return
+        with self.log_lock:
+            if self.logfile.closed:
+                # used again after close, continue the log (but without the sync thread)
+                self.logfile = open(os.path.join(self.directory, self.log_filename), "a", encoding="utf-8")
+            for entry in entries:
+                self.logfile.write(json.dumps(entry) + "\n")
+            self.logfile.flush()
+            self.log_entries += len(entries)
+            self.written_batches += 1
+            batch = self.written_batches
+            if self.sync_thread:
+                self.sync_needed.notify()
+            else:
+                self._fsync()
+        if getattr(self.deferred, "active", False):
+            self.deferred.batch = batch     # waited for at the end of deferred_sync
+        else:
+            self._wait_synced(batch)
+        self._compact_if_needed()
+
+    @contextlib.contextmanager
+    def deferred_sync(self):
+        """
+        The changes this thread makes within this context don't wait for their fsync one by one:
+        it is waited for once, at the end. Use it around your own lock, so that other threads can continue
+        (and their changes can be synced together with yours) while you're waiting for the disk.
+        """
+        if getattr(self.deferred, "active", False):
+            yield     # nested, the outermost one waits
+            return
+        self.deferred.active = True
+        self.deferred.batch = 0
+        try:
+            yield
+        finally:
+            self.deferred.active = False
+            if self.deferred.batch:
+                self._wait_synced(self.deferred.batch)
+
+    def _wait_synced(self, batch):
+        with self.log_lock:
+            while self.synced_batches < batch:
+                if self.sync_error and self.sync_error[0] >= batch:
+                    raise self.sync_error[1]
+                if self.stop_syncing or not self.sync_thread:
+                    self._fsync()
+                    break
+                self.synced.wait()
+
+    def _fsync(self):
+        # must be called with the log_lock held
+        batch = self.written_batches
+        os.fsync(self.logfile.fileno())
+        self.synced_batches = batch
+        self.synced.notify_all()
+
+    def _sync_loop(self):
+        while True:
+            with self.log_lock:
+                # (after a failed fsync, the next attempt waits for a new change)
+                done = max(self.synced_batches, self.sync_error[0] if self.sync_error else 0)
+                while not self.stop_syncing and (done >= self.written_batches or self.logfile.closed):
+                    self.sync_needed.wait()
+                if self.stop_syncing:
+                    return
+                # every batch that was written while the previous fsync was busy, is synced in one go
+                batch = self.written_batches
+                fd = os.dup(self.logfile.fileno())    # stays valid if the log is compacted meanwhile
+            try:
+                # the lock is not held during the fsync, so that writers can add the next batch meanwhile
+                os.fsync(fd)
+            except OSError as x:
+                log.error("log storage fsync failed: %s", x)
+                with self.log_lock:
+                    self.sync_error = batch, x
+                    self.synced.notify_all()
+                continue
+            finally:
+                os.close(fd)
+            with self.log_lock:
+                self.synced_batches = max(self.synced_batches, batch)
+                self.synced.notify_all()
+
+    def sync(self):
+        """Makes sure all changes so far have been written to disk."""
+        with self.log_lock:
+            if self.synced_batches < self.written_batches and not self.logfile.closed:
+                self._fsync()
+
+    def _compact_if_needed(self):
+        if self.log_entries > max(self.compact_min_entries, 2 * len(self)):
+            self.compact()
+
+    def compact(self):
+        """Writes all registrations to a new snapshot file, and starts a new empty log."""
+        snapshot = os.path.join(self.directory, self.snapshot_filename)
+        with self.log_lock:
+            with open(snapshot + ".tmp", "w", encoding="utf-8") as file:
+                for key in self.sorted_names:
+                    file.write(json.dumps(self._set_entry(key)) + "\n")
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(snapshot + ".tmp", snapshot)
+            self._fsync_directory()
+            # if we crash before the log is truncated, replaying the old log on top of the new snapshot does no harm
+            self.logfile.close()
+            self.logfile = open(os.path.join(self.directory, self.log_filename), "w", encoding="utf-8")
+            os.fsync(self.logfile.fileno())
+            self.log_entries = 0
+            # everything that was written so far, is in the snapshot on disk now
+            self.synced_batches = self.written_batches
+            self.synced.notify_all()
+        log.debug("log storage compacted, %d registrations", len(self))
+
+    def _fsync_directory(self):
+        # makes the rename of the snapshot file durable
+        try:
+            fd = os.open(self.directory, os.O_RDONLY)
+        except OSError:
+            return   # directories can't be opened on Windows, where the rename is durable already
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def __setitem__(self, key, value):
+        super(LogStorage, self).__setitem__(key, value)
+        self._write([self._set_entry(key)])
+
+    def __delitem__(self, key):
+        super(LogStorage, self).__delitem__(key)
+        self._write([["del", key]])
+
+    def clear(self):
+        super(LogStorage, self).clear()
+        self._write([["clear"]])
+
+    def set_items(self, items):
+        for key, value in items.items():
+            MemoryStorage.__setitem__(self, key, value)
+        self._write([self._set_entry(key) for key in items])
+
+    def remove_items(self, items):
+        removed = [item for item in items if item in self]
+        for item in removed:
+            MemoryStorage.__delitem__(self, item)
+        self._write([["del", item] for item in removed])
+
+    def close(self):
+        with self.log_lock:
+            self.stop_syncing = True
+            self.sync_needed.notify()
+            self.synced.notify_all()
+        if self.sync_thread:
+            self.sync_thread.join()
+            self.sync_thread = None
+        with self.log_lock:
+            if not self.logfile.closed:
+                self.logfile.flush()
+                self._fsync()
+                self.logfile.close()
+
+
 class SqlStorage(MutableMapping):
     """
     Sqlite-based storage.
     It is just a single (name,uri) table for the names and another table for the metadata.
-    Sqlite db connection objects aren't thread-safe, so a new connection is created in every method.
+    Sqlite db connection objects aren't thread-safe, so every thread gets its own connection,
+    which is kept open and reused until the storage is closed. The database uses WAL journaling
+    so that readers don't block the writer.
     """
+    max_query_params = 500    # sqlite can have a rather low limit on the number of parameters in a single query
+
     def __init__(self, dbfile):
         if dbfile == ":memory:":
             raise ValueError("We don't support the sqlite :memory: database type. Just use the default volatile in-memory store.")
         self.dbfile = dbfile
-        with sqlite3.connect(dbfile) as db:
-            db.execute("PRAGMA foreign_keys=ON")
+        self.connections = {}
+        self.connections_lock = threading.Lock()
+        with self._connection() as db:
             try:
                 db.execute("SELECT COUNT(*) FROM pyro_names").fetchone()
             except sqlite3.OperationalError:
@@ -88,7 +434,7 @@ class SqlStorage(MutableMapping):
                     self._create_schema(db)
                     db.execute("INSERT INTO pyro_names(name, uri) SELECT name, uri FROM pyro_names_old")
                     db.execute("DROP TABLE pyro_names_old")
-            db.commit()
+            self._create_indexes(db)
 
     def _create_schema(self, db):
         db.execute("""CREATE TABLE pyro_names
@@ -104,17 +450,71 @@ class SqlStorage(MutableMapping):
                 FOREIGN KEY(object) REFERENCES pyro_names(id)
             );""")
 
+    def _create_indexes(self, db):
+        # also done for existing databases, that were created without these indexes
+        db.execute("CREATE INDEX IF NOT EXISTS pyro_metadata_object ON pyro_metadata(object)")
+        db.execute("CREATE INDEX IF NOT EXISTS pyro_metadata_metadata ON pyro_metadata(metadata)")
+
+    def _connection(self):
+        """Returns the db connection of the current thread, it is created when needed."""
+        ident = threading.get_ident()
+        db = self.connections.get(ident)
+        if db is None:
+            db = sqlite3.connect(self.dbfile, check_same_thread=False)
+            db.execute("PRAGMA foreign_keys=ON")
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            with self.connections_lock:
+                # forget the connections of threads that have ended (their idents may be reused)
+                alive = {thread.ident for thread in threading.enumerate()}
+                for dead in [i for i in self.connections if i not in alive]:
+                    self.connections.pop(dead).close()
+                self.connections[ident] = db
+        return db
+
+    @staticmethod
+    def _prefix_range(prefix):
+        """
+        Returns the (lower, upper) bounds of the names that start with the given prefix,
+        so that it can be looked up as a range in the index instead of with a LIKE over all names.
+        The upper bound is None if there is none.
+        """
+        for index in range(len(prefix) - 1, -1, -1):
+            code = ord(prefix[index]) + 1
+            if code == 0xd800:
+                code = 0xe000   # skip the surrogates, they can't be stored
+            if code <= 0x10ffff:
+                return prefix, prefix[:index] + chr(code)
+        return prefix, None
+
+    @staticmethod
+    def _group_metadata(rows):
+        """Groups the (name, uri, metadata) rows of a names-metadata join into a dict name->(uri, metadata)."""
+        names = {}
+        for name, uri, metadata in rows:
+            entry = names.get(name)
+            if entry is None:
+                entry = names[name] = uri, set()
+            if metadata is not None:
+                entry[1].add(metadata)
+        return names
+
+    def _select_names(self, db, condition="", params=(), return_metadata=False):
+        if return_metadata:
+            sql = "SELECT n.name, n.uri, m.metadata FROM pyro_names n LEFT JOIN pyro_metadata m ON m.object=n.id " + condition
+            return self._group_metadata(db.execute(sql, params))
+        sql = "SELECT n.name, n.uri FROM pyro_names n " + condition
+        return dict(db.execute(sql, params).fetchall())
+
     def __getattr__(self, item):
         raise NotImplementedError("SqlStorage doesn't implement method/attribute '" + item + "'")
 
     def __getitem__(self, item):
         try:
-            with sqlite3.connect(self.dbfile) as db:
-                result = db.execute("SELECT id, uri FROM pyro_names WHERE name=?", (item,)).fetchone()
+            with self._connection() as db:
+                result = self._select_names(db, "WHERE n.name=?", (item,), return_metadata=True)
                 if result:
-                    dbid, uri = result
-                    metadata = {m[0] for m in db.execute("SELECT metadata FROM pyro_metadata WHERE object=?", (dbid,)).fetchall()}
-                    return uri, metadata
+                    return result[item]
                 else:
                     raise KeyError(item)
         except sqlite3.DatabaseError as e:
@@ -123,54 +523,40 @@ class SqlStorage(MutableMapping):
     def __setitem__(self, key, value):
         uri, metadata = value
         try:
-            with sqlite3.connect(self.dbfile) as db:
-                cursor = db.cursor()
-                cursor.execute("PRAGMA foreign_keys=ON")
-                dbid = cursor.execute("SELECT id FROM pyro_names WHERE name=?", (key,)).fetchone()
-                if dbid:
-                    dbid = dbid[0]
-                    cursor.execute("DELETE FROM pyro_metadata WHERE object=?", (dbid,))
-                    cursor.execute("DELETE FROM pyro_names WHERE id=?", (dbid,))
-                cursor.execute("INSERT INTO pyro_names(name, uri) VALUES(?,?)", (key, uri))
+            with self._connection() as db:
+                db.execute("DELETE FROM pyro_metadata WHERE object IN (SELECT id FROM pyro_names WHERE name=?)", (key,))
+                db.execute("DELETE FROM pyro_names WHERE name=?", (key,))
+                object_id = db.execute("INSERT INTO pyro_names(name, uri) VALUES(?,?)", (key, uri)).lastrowid
                 if metadata:
-                    object_id = cursor.lastrowid
-                    for m in metadata:
-                        cursor.execute("INSERT INTO pyro_metadata(object, metadata) VALUES (?,?)", (object_id, m))
-                cursor.close()
-                db.commit()
+                    db.executemany("INSERT INTO pyro_metadata(object, metadata) VALUES (?,?)", [(object_id, m) for m in metadata])
         except sqlite3.DatabaseError as e:
             raise NamingError("sqlite error in setitem: " + str(e))
 
     def __len__(self):
         try:
-            with sqlite3.connect(self.dbfile) as db:
+            with self._connection() as db:
                 return db.execute("SELECT count(*) FROM pyro_names").fetchone()[0]
         except sqlite3.DatabaseError as e:
             raise NamingError("sqlite error in len: " + str(e))
 
     def __contains__(self, item):
         try:
-            with sqlite3.connect(self.dbfile) as db:
+            with self._connection() as db:
                 return db.execute("SELECT EXISTS(SELECT 1 FROM pyro_names WHERE name=? LIMIT 1)", (item,)).fetchone()[0]
         except sqlite3.DatabaseError as e:
             raise NamingError("sqlite error in contains: " + str(e))
 
     def __delitem__(self, key):
         try:
-            with sqlite3.connect(self.dbfile) as db:
-                db.execute("PRAGMA foreign_keys=ON")
-                dbid = db.execute("SELECT id FROM pyro_names WHERE name=?", (key,)).fetchone()
-                if dbid:
-                    dbid = dbid[0]
-                    db.execute("DELETE FROM pyro_metadata WHERE object=?", (dbid,))
-                    db.execute("DELETE FROM pyro_names WHERE id=?", (dbid,))
-                db.commit()
+            with self._connection() as db:
+                db.execute("DELETE FROM pyro_metadata WHERE object IN (SELECT id FROM pyro_names WHERE name=?)", (key,))
+                db.execute("DELETE FROM pyro_names WHERE name=?", (key,))
         except sqlite3.DatabaseError as e:
             raise NamingError("sqlite error in delitem: " + str(e))
 
     def __iter__(self):
         try:
-            with sqlite3.connect(self.dbfile) as db:
+            with self._connection() as db:
                 result = db.execute("SELECT name FROM pyro_names")
                 return iter([n[0] for n in result.fetchall()])
         except sqlite3.DatabaseError as e:
@@ -178,92 +564,197 @@ class SqlStorage(MutableMapping):
 
     def clear(self):
         try:
-            with sqlite3.connect(self.dbfile) as db:
-                db.execute("PRAGMA foreign_keys=ON")
+            with self._connection() as db:
                 db.execute("DELETE FROM pyro_metadata")
                 db.execute("DELETE FROM pyro_names")
-                db.commit()
-            with sqlite3.connect(self.dbfile, isolation_level=None) as db:
-                db.execute("VACUUM")  # this cannot run inside a transaction.
+            self._connection().execute("VACUUM")  # this cannot run inside a transaction.
         except sqlite3.DatabaseError as e:
             raise NamingError("sqlite error in clear: " + str(e))
 
     def optimized_prefix_list(self, prefix, return_metadata=False):
+        lower, upper = self._prefix_range(prefix)
+        if upper is None:
+            condition, params = "WHERE n.name>=?", (lower,)
+        else:
+            condition, params = "WHERE n.name>=? AND n.name<?", (lower, upper)
         try:
-            with sqlite3.connect(self.dbfile) as db:
-                names = {}
-                if return_metadata:
-                    for dbid, name, uri in db.execute("SELECT id, name, uri FROM pyro_names WHERE name LIKE ?", (prefix + '%',)).fetchall():
-                        metadata = {m[0] for m in db.execute("SELECT metadata FROM pyro_metadata WHERE object=?", (dbid,)).fetchall()}
-                        names[name] = uri, metadata
-                else:
-                    for name, uri in db.execute("SELECT name, uri FROM pyro_names WHERE name LIKE ?", (prefix + '%',)).fetchall():
-                        names[name] = uri
-                return names
+            with self._connection() as db:
+                return self._select_names(db, condition, params, return_metadata)
         except sqlite3.DatabaseError as e:
             raise NamingError("sqlite error in optimized_prefix_list: " + str(e))
 
+    def optimized_prefix_page(self, prefix, cursor, limit, return_metadata=False):
+        lower, upper = self._prefix_range(prefix)
+        conditions, params = ["name>=?"], [lower]
+        if upper is not None:
+            conditions.append("name<?")
+            params.append(upper)
+        if cursor is not None:
+            conditions.append("name>?")
+            params.append(cursor)
+        params.append(limit)
+        # the limit is applied in a subquery because the metadata join returns multiple rows per name
+        condition = "WHERE n.id IN (SELECT id FROM pyro_names WHERE {conditions} ORDER BY name LIMIT ?) ORDER BY n.name" \
+                    .format(conditions=" AND ".join(conditions))
+        try:
+            with self._connection() as db:
+                return self._select_names(db, condition, params, return_metadata)
+        except sqlite3.DatabaseError as e:
+            raise NamingError("sqlite error in optimized_prefix_page: " + str(e))
+
     def optimized_regex_list(self, regex, return_metadata=False):
         # defining a regex function isn't much better than simply regexing ourselves over the full table.
         return None
 
     def optimized_metadata_search(self, metadata_all=None, metadata_any=None, return_metadata=False):
         try:
-            with sqlite3.connect(self.dbfile) as db:
+            with self._connection() as db:
                 if metadata_any:
                     # any of the given metadata
                     params = list(metadata_any)
-                    sql = "SELECT id, name, uri FROM pyro_names WHERE id IN (SELECT object FROM pyro_metadata WHERE metadata IN ({seq}))" \
-                          .format(seq=",".join(['?'] * len(metadata_any)))
+                    condition = "WHERE n.id IN (SELECT object FROM pyro_metadata WHERE metadata IN ({seq}))" \
+                                .format(seq=",".join(['?'] * len(params)))
                 else:
                     # all of the given metadata
-                    params = list(metadata_all)
-                    params.append(len(metadata_all))
-                    sql = "SELECT id, name, uri FROM pyro_names WHERE id IN (SELECT object FROM pyro_metadata WHERE metadata IN ({seq}) " \
-                          "GROUP BY object HAVING COUNT(metadata)=?)".format(seq=",".join(['?'] * len(metadata_all)))
-                result = db.execute(sql, params).fetchall()
-                if return_metadata:
-                    names = {}
-                    for dbid, name, uri in result:
-                        metadata = {m[0] for m in db.execute("SELECT metadata FROM pyro_metadata WHERE object=?", (dbid,)).fetchall()}
-                        names[name] = uri, metadata
-                else:
-                    names = {name: uri for (dbid, name, uri) in result}
-                return names
+                    params = list(set(metadata_all))
+                    params.append(len(params))
+                    condition = "WHERE n.id IN (SELECT object FROM pyro_metadata WHERE metadata IN ({seq}) " \
+                                "GROUP BY object HAVING COUNT(metadata)=?)".format(seq=",".join(['?'] * (len(params) - 1)))
+                return self._select_names(db, condition, params, return_metadata)
         except sqlite3.DatabaseError as e:
             raise NamingError("sqlite error in optimized_metadata_search: " + str(e))
 
     def remove_items(self, items):
         try:
-            with sqlite3.connect(self.dbfile) as db:
-                db.execute("PRAGMA foreign_keys=ON")
-                for item in items:
-                    dbid = db.execute("SELECT id FROM pyro_names WHERE name=?", (item,)).fetchone()
-                    if dbid:
-                        dbid = dbid[0]
-                        db.execute("DELETE FROM pyro_metadata WHERE object=?", (dbid,))
-                        db.execute("DELETE FROM pyro_names WHERE id=?", (dbid,))
-                db.commit()
+            with self._connection() as db:
+                items = [(item,) for item in items]
+                db.executemany("DELETE FROM pyro_metadata WHERE object IN (SELECT id FROM pyro_names WHERE name=?)", items)
+                db.executemany("DELETE FROM pyro_names WHERE name=?", items)
         except sqlite3.DatabaseError as e:
             raise NamingError("sqlite error in remove_items: " + str(e))
 
+    def get_items(self, items):
+        try:
+            with self._connection() as db:
+                result = {}
+                items = list(items)
+                for start in range(0, len(items), self.max_query_params):
+                    chunk = items[start:start + self.max_query_params]
+                    condition = "WHERE n.name IN ({seq})".format(seq=",".join(['?'] * len(chunk)))
+                    result.update(self._select_names(db, condition, chunk, return_metadata=True))
+                return result
+        except sqlite3.DatabaseError as e:
+            raise NamingError("sqlite error in get_items: " + str(e))
+
+    def set_items(self, items):
+        try:
+            with self._connection() as db:
+                names = [(key,) for key in items]
+                db.executemany("DELETE FROM pyro_metadata WHERE object IN (SELECT id FROM pyro_names WHERE name=?)", names)
+                db.executemany("DELETE FROM pyro_names WHERE name=?", names)
+                metadata_rows = []
+                for key, (uri, metadata) in items.items():
+                    object_id = db.execute("INSERT INTO pyro_names(name, uri) VALUES(?,?)", (key, uri)).lastrowid
+                    metadata_rows.extend((object_id, m) for m in metadata or ())
+                db.executemany("INSERT INTO pyro_metadata(object, metadata) VALUES (?,?)", metadata_rows)
+        except sqlite3.DatabaseError as e:
+            raise NamingError("sqlite error in set_items: " + str(e))
+
     def everything(self, return_metadata=False):
         try:
-            with sqlite3.connect(self.dbfile) as db:
-                names = {}
-                if return_metadata:
-                    for dbid, name, uri in db.execute("SELECT id, name, uri FROM pyro_names").fetchall():
-                        metadata = {m[0] for m in db.execute("SELECT metadata FROM pyro_metadata WHERE object=?", (dbid,)).fetchall()}
-                        names[name] = uri, metadata
-                else:
-                    for name, uri in db.execute("SELECT name, uri FROM pyro_names").fetchall():
-                        names[name] = uri
-                return names
+            with self._connection() as db:
+                return self._select_names(db, return_metadata=return_metadata)
         except sqlite3.DatabaseError as e:
             raise NamingError("sqlite error in everything: " + str(e))
 
+    def deferred_sync(self):
+        # every change is committed (and synced by sqlite) before it returns
+        return contextlib.suppress()
+
     def close(self):
-        pass
+        with self.connections_lock:
+            for db in self.connections.values():
+                db.close()
+            self.connections.clear()
+
+
+class ReadWriteLock(object):
+    """
+    Lock that can be held by many readers at the same time, or by a single writer.
+    Waiting writers go before new readers, so they can't be starved by a continuous stream of readers.
+    It is reentrant, and the writer can also acquire it for reading (but a reader can't upgrade to writing).
+    Using the lock itself in a with statement acquires it for writing, use read() to acquire it for reading.
+    """
+    def __init__(self):
+        self._condition = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = None
+        self._writer_depth = 0
+        self._writers_waiting = 0
+        self._local = threading.local()
+
+    @contextlib.contextmanager
+    def read(self):
+        self.acquire_read()
+        try:
+            yield
+        finally:
+            self.release_read()
+
+    def acquire_read(self):
+        depth = getattr(self._local, "reads", 0)
+        if depth == 0 and self._writer != threading.get_ident():
+            with self._condition:
+                while self._writer is not None or self._writers_waiting:
+                    self._condition.wait()
+                self._readers += 1
+            self._local.counted = True
+        self._local.reads = depth + 1
+
+    def release_read(self):
+        self._local.reads -= 1
+        if self._local.reads == 0 and getattr(self._local, "counted", False):
+            self._local.counted = False
+            with self._condition:
+                self._readers -= 1
+                if self._readers == 0:
+                    self._condition.notify_all()
+
+    def acquire_write(self):
+        me = threading.get_ident()
+        if self._writer == me:
+            self._writer_depth += 1
+            return
+        if getattr(self._local, "reads", 0):
+            raise RuntimeError("cannot upgrade a read lock to a write lock")
+        with self._condition:
+            self._writers_waiting += 1
+            try:
+                while self._writer is not None or self._readers:
+                    self._condition.wait()
+            finally:
+                self._writers_waiting -= 1
+            self._writer = me
+            self._writer_depth = 1
+
+    def release_write(self):
+        with self._condition:
+            self._writer_depth -= 1
+            if self._writer_depth == 0:
+                self._writer = None
+                self._condition.notify_all()
+
+    def __enter__(self):
+        self.acquire_write()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release_write()
+
+
+@functools.lru_cache(maxsize=256)
+def _compile_regex(pattern):
+    return re.compile(pattern)
 
 
 @server.expose
@@ -271,13 +762,43 @@ class NameServer(object):
     """
     Pyro name server. Provides a simple flat name space to map logical object names to Pyro URIs.
     Default storage is done in an in-memory dictionary. You can provide custom storage types.
+    Every change increases the revision number of the name server. The names that changed in the
+    most recent revisions can be obtained with changes_since() or watch(). The revision numbers of every
+    name server instance start at a random epoch, so that the revisions of an earlier instance (before a restart)
+    aren't mistaken for revisions of this one.
+    Lookups and listings only take the lock for reading, so they can run at the same time. Listings that have to scan
+    all registrations (regex, or metadata searches the storage can't do itself) take a snapshot and scan that
+    without holding the lock.
     """
+    max_watch_timeout = 60.0
+
     def __init__(self, storageProvider=None):
         self.storage = storageProvider
         if storageProvider is None:
             self.storage = MemoryStorage()
             log.debug("using volatile in-memory dict storage")
-        self.lock = threading.RLock()
+        self.lock = ReadWriteLock()
+        self.changed = threading.Condition()     # protects the revision and changes, and signals watchers
+        self.revision = self._initial_revision()
+        self.changes = collections.deque(maxlen=config.NS_CHANGES_SIZE)    # (revision, name)
+        self.changes_floor = self.revision    # changes up to and including this revision may have been dropped
+
+    @staticmethod
+    def _initial_revision():
+        # a random epoch in the upper bits: changes_since() doesn't know the revisions outside of its own range
+        return random.randrange(1, 1 << 30) << 32
+
+    @contextlib.contextmanager
+    def _writing(self):
+        """
+        Takes the write lock to make changes. If the storage syncs the changes to disk in the background (the
+        LogStorage does), the changes are only waited for after the lock has been released, so that meanwhile
+        other requests can proceed and their changes can be synced together with these.
+        """
+        deferred_sync = getattr(self.storage, "deferred_sync", None)    # custom storages may not have it
+        with deferred_sync() if deferred_sync else contextlib.suppress():
+            with self.lock:
+                yield
 
     def count(self):
         """Returns the number of name registrations."""
@@ -297,9 +818,25 @@ class NameServer(object):
         except KeyError:
             raise NamingError("unknown name: " + name)
 
-    def register(self, name, uri, safe=False, metadata=None):
-        """Register a name with an URI. If safe is true, name cannot be registered twice.
-        The uri can be a string or an URI object. Metadata must be None, or a collection of strings."""
+    def lookup_many(self, names, return_metadata=False):
+        """
+        Lookup all of the given names at once. Returns a dict with the URI for each name
+        (or tuple (uri, metadata) if return_metadata is True), or a NamingError if the name is unknown.
+        """
+        with self.lock.read():
+            found = self.storage.get_items(names)
+        result = {}
+        for name in names:
+            if name in found:
+                uri, metadata = found[name]
+                result[name] = (core.URI(uri), set(metadata or [])) if return_metadata else core.URI(uri)
+            else:
+                result[name] = NamingError("unknown name: " + str(name))
+        return result
+
+    @staticmethod
+    def _check_registration(name, uri, metadata):
+        """Validates the arguments of a registration, returns the uri as a string."""
         if isinstance(uri, core.URI):
             uri = str(uri)
         elif not isinstance(uri, str):
@@ -308,48 +845,120 @@ class NameServer(object):
             core.URI(uri)  # check if uri is valid
         if not isinstance(name, str):
             raise TypeError("name must be a str")
+        NameServer._check_metadata(metadata)
+        return uri
+
+    @staticmethod
+    def _check_metadata(metadata):
         if isinstance(metadata, str):
             raise TypeError("metadata should not be a str, but another iterable (set, list, etc)")
         metadata and iter(metadata)  # validate that metadata is iterable
-        with self.lock:
+
+    def register(self, name, uri, safe=False, metadata=None):
+        """Register a name with an URI. If safe is true, name cannot be registered twice.
+        The uri can be a string or an URI object. Metadata must be None, or a collection of strings."""
+        uri = self._check_registration(name, uri, metadata)
+        with self._writing():
             if safe and name in self.storage:
                 raise NamingError("name already registered: " + name)
             self.storage[name] = uri, set(metadata) if metadata else None
+            self._record_changes([name])
+
+    def register_many(self, registrations, safe=False):
+        """
+        Register multiple names at once, in a single storage transaction.
+        Registrations is a dict that maps the names to either an URI, or a tuple (uri, metadata).
+        If safe is true, names that are already registered are not registered again.
+        Returns a dict with None for each name that was registered, or the exception for each name that wasn't.
+        """
+        result = {}
+        items = {}
+        for name, registration in registrations.items():
+            try:
+                uri, metadata = registration if isinstance(registration, (tuple, list)) else (registration, None)
+                items[name] = self._check_registration(name, uri, metadata), set(metadata) if metadata else None
+                result[name] = None
+            except (TypeError, ValueError, PyroError) as x:
+                result[name] = x
+        with self._writing():
+            if safe:
+                for name in self.storage.get_items(items):
+                    del items[name]
+                    result[name] = NamingError("name already registered: " + name)
+            self.storage.set_items(items)
+            self._record_changes(items)
+        return result
 
     def set_metadata(self, name, metadata):
         """update the metadata for an existing registration"""
         if not isinstance(name, str):
             raise TypeError("name must be a str")
-        if isinstance(metadata, str):
-            raise TypeError("metadata should not be a str, but another iterable (set, list, etc)")
-        metadata and iter(metadata)  # validate that metadata is iterable
-        with self.lock:
+        self._check_metadata(metadata)
+        with self._writing():
             try:
                 uri, old_meta = self.storage[name]
                 self.storage[name] = uri, set(metadata) if metadata else None
             except KeyError:
                 raise NamingError("unknown name: " + name)
+            self._record_changes([name])
+
+    def set_metadata_many(self, metadata):
+        """
+        Update the metadata for multiple existing registrations at once, in a single storage transaction.
+        Metadata is a dict that maps the names to their new metadata.
+        Returns a dict with None for each name that was updated, or the exception for each name that wasn't.
+        """
+        result = {}
+        items = {}
+        for name, meta in metadata.items():
+            try:
+                if not isinstance(name, str):
+                    raise TypeError("name must be a str")
+                self._check_metadata(meta)
+                items[name] = set(meta) if meta else None
+                result[name] = None
+            except TypeError as x:
+                result[name] = x
+        with self._writing():
+            existing = self.storage.get_items(items)
+            for name in items:
+                if name not in existing:
+                    result[name] = NamingError("unknown name: " + name)
+            self.storage.set_items({name: (uri, items[name]) for name, (uri, old_meta) in existing.items()})
+            self._record_changes(existing)
+        return result
 
     def remove(self, name=None, prefix=None, regex=None):
         """Remove a registration. returns the number of items removed."""
-        if name and name in self.storage and name != core.NAMESERVER_NAME:
-            with self.lock:
-                del self.storage[name]
-            return 1
-        if prefix:
-            items = list(self.list(prefix=prefix).keys())
-            if core.NAMESERVER_NAME in items:
-                items.remove(core.NAMESERVER_NAME)
-            self.storage.remove_items(items)
-            return len(items)
-        if regex:
-            items = list(self.list(regex=regex).keys())
-            if core.NAMESERVER_NAME in items:
-                items.remove(core.NAMESERVER_NAME)
-            self.storage.remove_items(items)
+        if name and name != core.NAMESERVER_NAME:
+            with self._writing():
+                if name in self.storage:
+                    del self.storage[name]
+                    self._record_changes([name])
+                    return 1
+        if prefix or regex:
+            if regex:
+                regex = self._compile(regex)
+            with self._writing():
+                if prefix:
+                    items = self.storage.optimized_prefix_list(prefix)
+                    items = list(items) if items is not None else [item for item in self.storage if item.startswith(prefix)]
+                else:
+                    items = [item for item in self.storage if regex.match(item)]
+                if core.NAMESERVER_NAME in items:
+                    items.remove(core.NAMESERVER_NAME)
+                self.storage.remove_items(items)
+                self._record_changes(items)
             return len(items)
         return 0
 
+    @staticmethod
+    def _compile(regex):
+        try:
+            return _compile_regex(regex)
+        except re.error as x:
+            raise errors.NamingError("invalid regex: " + str(x))
+
     # noinspection PyNoneFunctionAssignment
     def list(self, prefix=None, regex=None, return_metadata=False):
         """
@@ -358,7 +967,16 @@ class NameServer(object):
         """
         if prefix and regex:
             raise ValueError("you can only filter on one thing at a time")
-        with self.lock:
+        if regex:
+            compiled = self._compile(regex)
+            with self.lock.read():
+                result = self.storage.optimized_regex_list(regex, return_metadata)
+                if result is not None:
+                    return result
+                snapshot = self.storage.everything(return_metadata)
+            # match the names without holding the lock
+            return {name: value for name, value in snapshot.items() if compiled.match(name)}
+        with self.lock.read():
             if prefix:
                 result = self.storage.optimized_prefix_list(prefix, return_metadata)
                 if result is not None:
@@ -368,20 +986,6 @@ class NameServer(object):
                     if name.startswith(prefix):
                         result[name] = self.storage[name] if return_metadata else self.storage[name][0]
                 return result
-            elif regex:
-                result = self.storage.optimized_regex_list(regex, return_metadata)
-                if result is not None:
-                    return result
-                result = {}
-                try:
-                    regex = re.compile(regex)
-                except re.error as x:
-                    raise errors.NamingError("invalid regex: " + str(x))
-                else:
-                    for name in self.storage:
-                        if regex.match(name):
-                            result[name] = self.storage[name] if return_metadata else self.storage[name][0]
-                    return result
             else:
                 # just return (a copy of) everything
                 return self.storage.everything(return_metadata)
@@ -394,47 +998,298 @@ class NameServer(object):
         """
         if meta_all and meta_any:
             raise ValueError("you can't use meta_all or meta_any at the same time")
-        with self.lock:
-            if meta_all:
-                # return the entries which have all of the given metadata as (a subset of) their metadata
-                if isinstance(meta_all, str):
-                    raise TypeError("metadata_all should not be a str, but another iterable (set, list, etc)")
-                meta_all and iter(meta_all)   # validate that metadata is iterable
+        if meta_all:
+            # return the entries which have all of the given metadata as (a subset of) their metadata
+            if isinstance(meta_all, str):
+                raise TypeError("metadata_all should not be a str, but another iterable (set, list, etc)")
+            meta_all and iter(meta_all)   # validate that metadata is iterable
+            with self.lock.read():
                 result = self.storage.optimized_metadata_search(metadata_all=meta_all, return_metadata=return_metadata)
                 if result is not None:
                     return result
-                meta_all = frozenset(meta_all)
-                result = {}
-                for name, (uri, meta) in self.storage.everything(return_metadata=True).items():
-                    if meta_all.issubset(meta):
-                        result[name] = (uri, meta) if return_metadata else uri
-                return result
-            elif meta_any:
-                # return the entries which have any of the given metadata as part of their metadata
-                if isinstance(meta_any, str):
-                    raise TypeError("metadata_any should not be a str, but another iterable (set, list, etc)")
-                meta_any and iter(meta_any)   # validate that metadata is iterable
+                snapshot = self.storage.everything(return_metadata=True)
+            meta_all = frozenset(meta_all)
+            result = {}
+            for name, (uri, meta) in snapshot.items():
+                if meta_all.issubset(meta):
+                    result[name] = (uri, meta) if return_metadata else uri
+            return result
+        elif meta_any:
+            # return the entries which have any of the given metadata as part of their metadata
+            if isinstance(meta_any, str):
+                raise TypeError("metadata_any should not be a str, but another iterable (set, list, etc)")
+            meta_any and iter(meta_any)   # validate that metadata is iterable
+            with self.lock.read():
                 result = self.storage.optimized_metadata_search(metadata_any=meta_any, return_metadata=return_metadata)
                 if result is not None:
                     return result
-                meta_any = frozenset(meta_any)
-                result = {}
-                for name, (uri, meta) in self.storage.everything(return_metadata=True).items():
-                    if meta_any & meta:
-                        result[name] = (uri, meta) if return_metadata else uri
-                return result
+                snapshot = self.storage.everything(return_metadata=True)
+            meta_any = frozenset(meta_any)
+            result = {}
+            for name, (uri, meta) in snapshot.items():
+                if meta_any & meta:
+                    result[name] = (uri, meta) if return_metadata else uri
+            return result
+        else:
+            return {}
+
+    def list_page(self, prefix=None, regex=None, return_metadata=False, cursor=None, limit=1000):
+        """
+        Like list, but returns a single page of at most limit registrations (sorted by name),
+        as a tuple (registrations, cursor). Pass the cursor to the next call to get the next page.
+        The cursor is None when there are no more registrations.
+        """
+        if prefix and regex:
+            raise ValueError("you can only filter on one thing at a time")
+        self._check_limit(limit)
+        optimized_prefix_page = getattr(self.storage, "optimized_prefix_page", None)
+        if regex or optimized_prefix_page is None:
+            return self._page(self.list(prefix, regex, return_metadata), cursor, limit)
+        with self.lock.read():
+            return self._cut_page(optimized_prefix_page(prefix or "", cursor, limit + 1, return_metadata), limit)
+
+    def yplookup_page(self, meta_all=None, meta_any=None, return_metadata=True, cursor=None, limit=1000):
+        """
+        Like yplookup, but returns a single page of at most limit registrations (sorted by name),
+        as a tuple (registrations, cursor). Pass the cursor to the next call to get the next page.
+        The cursor is None when there are no more registrations.
+        """
+        self._check_limit(limit)
+        return self._page(self.yplookup(meta_all, meta_any, return_metadata), cursor, limit)
+
+    def list_iter(self, prefix=None, regex=None, return_metadata=False, page_size=1000):
+        """
+        Generator variant of list: yields (name, uri) tuples (or (name, (uri, metadata)) if return_metadata is True),
+        sorted by name. If the storage can page through its names (the built-in storages can), the registrations are
+        obtained a page at a time (and matched against the regex, if given), so the result is streamed to the client
+        (if item streaming is enabled) without building it all at once. Otherwise the whole result is collected first.
+        """
+        if prefix and regex:
+            raise ValueError("you can only filter on one thing at a time")
+        self._check_limit(page_size)
+        optimized_prefix_page = getattr(self.storage, "optimized_prefix_page", None)
+        if optimized_prefix_page is None:
+            # the storage can't page: collect the whole result, and sort it once instead of again for every page
+            yield from self._sorted_items(self.list(prefix, regex, return_metadata))
+            return
+        compiled = self._compile(regex) if regex else None
+        cursor = None
+        while True:
+            with self.lock.read():
+                page, cursor = self._cut_page(optimized_prefix_page(prefix or "", cursor, page_size + 1, return_metadata), page_size)
+            if compiled:
+                yield from ((name, value) for name, value in page.items() if compiled.match(name))
             else:
-                return {}
+                yield from page.items()
+            if cursor is None:
+                return
+
+    def yplookup_iter(self, meta_all=None, meta_any=None, return_metadata=True, page_size=1000):
+        """
+        Generator variant of yplookup: yields (name, (uri, metadata)) tuples (or (name, uri) if return_metadata is False),
+        sorted by name. The search is done once (using the storage's metadata index if it has one): all matching
+        registrations are collected in memory first, and then streamed to the client.
+        """
+        self._check_limit(page_size)
+        yield from self._sorted_items(self.yplookup(meta_all, meta_any, return_metadata))
+
+    @staticmethod
+    def _check_limit(limit):
+        if not isinstance(limit, int) or limit < 1:
+            raise ValueError("limit must be a positive integer")
+
+    @staticmethod
+    def _sorted_items(result):
+        for name in sorted(result):
+            yield name, result[name]
+
+    @staticmethod
+    def _page(result, cursor, limit):
+        # only the names of the page itself are sorted
+        names = heapq.nsmallest(limit + 1, (name for name in result if cursor is None or name > cursor))
+        return NameServer._cut_page({name: result[name] for name in names}, limit)
+
+    @staticmethod
+    def _cut_page(page, limit):
+        # the page contains up to limit+1 items, sorted by name: if there are more than limit, there is a next page
+        if len(page) <= limit:
+            return page, None
+        names = list(page)[:limit]
+        return {name: page[name] for name in names}, names[-1]
 
     def ping(self):
         """A simple test method to check if the name server is running correctly."""
         pass
 
+    def current_revision(self):
+        """
+        Returns the current revision number of the name server.
+        (Get this before listing the registrations, then use it in changes_since or watch to learn what changed after that)
+        """
+        return self.revision
+
+    def changes_since(self, revision, prefix=None):
+        """
+        Returns tuple (current revision, names) where names is a sorted list of the names
+        that were registered, changed or removed after the given revision (optionally only those starting with prefix).
+        Names is None if these changes are not known anymore (or the revision is unknown),
+        in that case you'll have to list all registrations again.
+        """
+        with self.changed:
+            return self._changes_since(revision, prefix)
+
+    def watch(self, prefix=None, revision=0, timeout=10.0):
+        """
+        Like changes_since, but waits until there actually are changes (for names starting with prefix), or until the
+        timeout expires (it is limited to max_watch_timeout seconds). Returns tuple (current revision, names).
+        Note that a waiting call occupies a worker thread in the name server.
+        """
+        with self.changed:
+            return self._wait_for_changes(prefix, revision, timeout)
+
+    def replication_changes(self, revision, timeout=10.0):
+        """
+        Used by replica name servers to follow this name server. Waits like watch() for changes after the given revision,
+        and returns tuple (revision, registrations, snapshot) where registrations is a dict of the changed names
+        to their (uri, metadata), or to None if the name was removed.
+        If the changes since the given revision are not known anymore, registrations contains all registrations
+        instead and snapshot is True: they replace everything the replica had.
+        """
+        with self.changed:
+            self._wait_for_changes(None, revision, timeout)
+        with self.lock.read():
+            # no changes can be made now, so the revision and the registrations are consistent
+            with self.changed:
+                current_revision, names = self._changes_since(revision, None)
+            if names is None:
+                return current_revision, self.storage.everything(return_metadata=True), True
+            found = self.storage.get_items(names)
+            return current_revision, {name: found.get(name) for name in names}, False
+
+    def replication_status(self):
+        """
+        Returns a dict with the role of this name server ('primary' or 'replica'),
+        the uri of its primary name server (None for a primary) and its current revision.
+        """
+        return {"role": "primary", "primary": None, "revision": self.revision}
+
+    def _remove_unchanged(self, registrations):
+        # removes the given names, but only if they are still registered with the given uri (used by the AutoCleaner)
+        with self._writing():
+            current = self.storage.get_items(registrations)
+            names = [name for name, (uri, metadata) in current.items()
+                     if uri == registrations[name] and name != core.NAMESERVER_NAME]
+            self.storage.remove_items(names)
+            self._record_changes(names)
+
+    def _wait_for_changes(self, prefix, revision, timeout):
+        # must be called with the changed condition held
+        timeout = self.max_watch_timeout if timeout is None else min(timeout, self.max_watch_timeout)
+        deadline = time.time() + timeout
+        while True:
+            current_revision, names = self._changes_since(revision, prefix)
+            remaining = deadline - time.time()
+            if names is None or names or remaining <= 0:
+                return current_revision, names
+            self.changed.wait(remaining)
+
+    def _changes_since(self, revision, prefix):
+        if revision < self.changes_floor or revision > self.revision:
+            return self.revision, None
+        names = set()
+        for change_revision, name in reversed(self.changes):
+            if change_revision <= revision:
+                break
+            if not prefix or name.startswith(prefix):
+                names.add(name)
+        return self.revision, sorted(names)
+
+    def _record_changes(self, names, revision=None):
+        # must be called with the (write) lock held
+        if not names:
+            return
+        with self.changed:
+            self.revision = self.revision + 1 if revision is None else revision
+            for name in names:
+                if len(self.changes) == self.changes.maxlen:
+                    self.changes_floor = self.changes[0][0] if self.changes else self.revision
+                self.changes.append((self.revision, name))
+            self.changed.notify_all()
+
+
+@server.expose
+class NameServerReplica(NameServer):
+    """
+    Read-only name server that follows a primary name server: a Replicator thread applies the changes
+    of the primary (using its replication_changes method) so that the replica has the same registrations
+    and the same revision numbers. It can serve lookups, listings and watches, but changes must be done on the primary.
+    If the primary is lost, the replica with the highest revision is the best one to promote() to be the new primary.
+    """
+    def __init__(self, primary, storageProvider=None):
+        super(NameServerReplica, self).__init__(storageProvider)
+        self.primary = str(primary)
+        self.revision = self.changes_floor = 0     # until the first snapshot of the primary has been applied
+
+    def register(self, name, uri, safe=False, metadata=None):
+        self._check_writable()
+        return super(NameServerReplica, self).register(name, uri, safe, metadata)
+
+    def register_many(self, registrations, safe=False):
+        self._check_writable()
+        return super(NameServerReplica, self).register_many(registrations, safe)
+
+    def set_metadata(self, name, metadata):
+        self._check_writable()
+        return super(NameServerReplica, self).set_metadata(name, metadata)
+
+    def set_metadata_many(self, metadata):
+        self._check_writable()
+        return super(NameServerReplica, self).set_metadata_many(metadata)
+
+    def remove(self, name=None, prefix=None, regex=None):
+        self._check_writable()
+        return super(NameServerReplica, self).remove(name, prefix, regex)
+
+    def replication_status(self):
+        return {"role": "replica" if self.primary else "primary", "primary": self.primary, "revision": self.revision}
+
+    def promote(self):
+        """Stop following the primary, and accept changes from now on (for instance when the primary is lost)."""
+        with self.lock:
+            log.info("replica promoted to primary, stopped following %s", self.primary)
+            self.primary = None
+            if not self.revision:
+                with self.changed:
+                    # it never got anything from the primary, so it starts with an epoch of its own
+                    self.revision = self.changes_floor = self._initial_revision()
+
+    def _check_writable(self):
+        primary = self.primary
+        if primary:
+            raise NamingError("this is a read-only replica name server, make changes on the primary: " + primary)
+
+    def _apply_replication(self, revision, registrations, snapshot):
+        with self._writing():
+            removed = [name for name, registration in registrations.items() if registration is None]
+            if snapshot:
+                removed.extend(name for name in list(self.storage) if name not in registrations)
+            self.storage.remove_items(removed)
+            self.storage.set_items({name: (registration[0], set(registration[1]) if registration[1] else None)
+                                    for name, registration in registrations.items() if registration is not None})
+            if snapshot:
+                # the changes that led to this state aren't known, so the watchers have to start over
+                with self.changed:
+                    self.changes.clear()
+                    self.changes_floor = self.revision = revision
+                    self.changed.notify_all()
+            else:
+                self._record_changes(registrations, revision)
+
 
 class NameServerDaemon(server.Daemon):
     """Daemon that contains the Name Server."""
 
-    def __init__(self, host=None, port=None, unixsocket=None, nathost=None, natport=None, storage=None):
+    def __init__(self, host=None, port=None, unixsocket=None, nathost=None, natport=None, storage=None, primary=None):
         if host is None:
             host = config.HOST
         elif not isinstance(host, str):
@@ -450,18 +1305,34 @@ class NameServerDaemon(server.Daemon):
         storage = storage or "memory"
         if storage == "memory":
             log.debug("using volatile in-memory dict storage")
-            self.nameserver = NameServer(MemoryStorage())
+            storage = MemoryStorage()
         elif storage.startswith("sql:") and len(storage) > 4:
             sqlfile = storage[4:]
             log.debug("using persistent sql storage in file %s", sqlfile)
-            self.nameserver = NameServer(SqlStorage(sqlfile))
+            storage = SqlStorage(sqlfile)
+        elif storage.startswith("log:") and len(storage) > 4:
+            directory = storage[4:]
+            log.debug("using persistent log storage in directory %s", directory)
+            storage = LogStorage(directory)
         else:
             raise ValueError("invalid storage type '%s'" % storage)
+        if primary:
+            log.debug("replica of primary name server %s", primary)
+            self.nameserver = NameServerReplica(primary, storage)
+        else:
+            self.nameserver = NameServer(storage)
         existing_count = self.nameserver.count()
         if existing_count > 0:
             log.debug("number of existing entries in storage: %d", existing_count)
         super(NameServerDaemon, self).__init__(host, port, unixsocket, nathost=nathost, natport=natport)
         self.register(self.nameserver, core.NAMESERVER_NAME)
+        self.cleaner_thread = self.replicator_thread = None
+        if primary:
+            # a replica gets all registrations from the primary (including the primary's own name server registration)
+            self.replicator_thread = Replicator(self.nameserver)
+            self.replicator_thread.start()
+            log.info("nameserver replica daemon created")
+            return
         metadata = {"class:Pyro5.nameserver.NameServer"}
         self.nameserver.register(core.NAMESERVER_NAME, self.uriFor(self.nameserver), metadata=metadata)
         if config.NS_AUTOCLEAN > 0:
@@ -472,7 +1343,6 @@ class NameServerDaemon(server.Daemon):
             self.cleaner_thread.start()
         else:
             log.debug("autoclean not enabled")
-            self.cleaner_thread = None
         log.info("nameserver daemon created")
 
     def close(self):
@@ -484,6 +1354,10 @@ class NameServerDaemon(server.Daemon):
             self.cleaner_thread.stop = True
             self.cleaner_thread.join()
             self.cleaner_thread = None
+        if self.replicator_thread:
+            self.replicator_thread.stop = True
+            self.replicator_thread.join()
+            self.replicator_thread = None
 
     def __enter__(self):
         if not self.nameserver:
@@ -498,6 +1372,10 @@ class NameServerDaemon(server.Daemon):
             self.cleaner_thread.stop = True
             self.cleaner_thread.join()
             self.cleaner_thread = None
+        if self.replicator_thread:
+            self.replicator_thread.stop = True
+            self.replicator_thread.join()
+            self.replicator_thread = None
         return super(NameServerDaemon, self).__exit__(exc_type, exc_value, traceback)
 
     def handleRequest(self, conn):
@@ -515,10 +1393,15 @@ class AutoCleaner(threading.Thread):
     """
     Takes care of checking every registration in the name server.
     If it cannot be contacted anymore, it will be removed after ~20 seconds.
+    The registered locations are probed concurrently with non-blocking connects (at most max_probes at a time),
+    and every location is probed only once, no matter how many names are registered for it.
+    Host names are resolved concurrently too, so a host that cannot be resolved doesn't stall the other probes.
     """
     min_autoclean_value = 3
     max_unreachable_time = 20.0
     loop_delay = 2.0
+    max_probes = 100
+    max_resolvers = 8
     override_autoclean_min = False   # only for unit test purposes
 
     def __init__(self, nameserver):
@@ -538,31 +1421,169 @@ class AutoCleaner(threading.Thread):
             time_since_last_autoclean = time.time() - self.last_cleaned
             if time_since_last_autoclean < config.NS_AUTOCLEAN:
                 continue
-            for name, uri in self.nameserver.list().items():
-                if name in (core.DAEMON_NAME, core.NAMESERVER_NAME):
-                    continue
-                try:
-                    uri_obj = core.URI(uri)
-                    timeout = config.COMMTIMEOUT or 5
-                    sock = socketutil.create_socket(connect=(uri_obj.host, uri_obj.port), timeout=timeout)
-                    sock.close()
-                    # if we get here, the listed server is still answering on its port
-                    if name in self.unreachable:
-                        del self.unreachable[name]
-                except socket.error:
-                    if name not in self.unreachable:
-                        self.unreachable[name] = time.time()
-                    if time.time() - self.unreachable[name] >= self.max_unreachable_time:
-                        log.info("autoclean: unregistering %s; cannot connect uri %s for %d sec", name, uri, self.max_unreachable_time)
-                        self.nameserver.remove(name)
-                        del self.unreachable[name]
-                        continue
+            self.clean()
             self.last_cleaned = time.time()
             if self.unreachable:
                 log.debug("autoclean: %d/%d names currently unreachable", len(self.unreachable), self.nameserver.count())
 
+    def clean(self):
+        """Probes all registrations once, and removes the ones that have been unreachable for too long."""
+        registrations = self.nameserver.list()
+        locations = {}   # location -> names
+        for name, uri in registrations.items():
+            if name in (core.DAEMON_NAME, core.NAMESERVER_NAME):
+                continue
+            try:
+                uri_obj = core.URI(uri)
+            except PyroError:
+                continue
+            if uri_obj.protocol == "PYRO":
+                locations.setdefault(uri_obj.sockname or (uri_obj.host, uri_obj.port), []).append(name)
+        unreachable_locations = self.probe(locations)
+        now = time.time()
+        remove = {}
+        for location, names in locations.items():
+            for name in names:
+                if location in unreachable_locations:
+                    if now - self.unreachable.setdefault(name, now) >= self.max_unreachable_time:
+                        log.info("autoclean: unregistering %s; cannot connect uri %s for %d sec",
+                                 name, registrations[name], self.max_unreachable_time)
+                        remove[name] = registrations[name]
+                else:
+                    self.unreachable.pop(name, None)
+        self.unreachable = {name: since for name, since in self.unreachable.items()
+                            if name in registrations and name not in remove}
+        if remove:
+            self.nameserver._remove_unchanged(remove)
+
+    def probe(self, locations):
+        """
+        Tries to connect to all of the given locations ((host, port) tuples or unix socket names).
+        Returns the set of locations that could not be connected to.
+        """
+        timeout = config.COMMTIMEOUT or 5
+        addresses, unreachable = self._resolve(locations, timeout)
+        pending = list(addresses.items())
+        with selectors.DefaultSelector() as selector:
+            while pending or selector.get_map():
+                while pending and len(selector.get_map()) < self.max_probes:
+                    location, address = pending.pop()
+                    try:
+                        sock = self._connect_nonblocking(address)
+                    except (OSError, ValueError):
+                        unreachable.add(location)
+                    else:
+                        selector.register(sock, selectors.EVENT_WRITE, (location, time.time() + timeout))
+                if not selector.get_map():
+                    continue
+                first_deadline = min(key.data[1] for key in selector.get_map().values())
+                for key, events in selector.select(max(0.0, first_deadline - time.time())):
+                    selector.unregister(key.fileobj)
+                    if key.fileobj.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR):
+                        unreachable.add(key.data[0])
+                    key.fileobj.close()
+                now = time.time()
+                for key in list(selector.get_map().values()):
+                    if key.data[1] <= now:
+                        selector.unregister(key.fileobj)
+                        key.fileobj.close()
+                        unreachable.add(key.data[0])
+        return unreachable
+
+    def _resolve(self, locations, timeout):
+        """
+        Resolves the locations to socket addresses. Numeric addresses and unix socket names are used directly,
+        host names are looked up concurrently (at most max_resolvers at a time) so that a host that cannot be
+        resolved, or only slowly, doesn't hold up the others. A lookup that isn't done within the timeout
+        counts as unreachable. Returns a (location->address dict, set of unresolved locations) tuple.
+        """
+        addresses = {}
+        unresolved = set()
+        lookups = []
+        for location in set(locations):
+            if isinstance(location, str):
+                addresses[location] = (socket.AF_UNIX, socket.SOCK_STREAM, 0, location)
+                continue
+            try:
+                addresses[location] = self._getaddrinfo(location, socket.AI_NUMERICHOST)
+            except (OSError, ValueError, UnicodeError):
+                lookups.append(location)
+        if lookups:
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers=min(self.max_resolvers, len(lookups)),
+                                                             thread_name_prefix="pyro-autoclean-resolve")
+            try:
+                futures = {executor.submit(self._getaddrinfo, location): location for location in lookups}
+                done, not_done = concurrent.futures.wait(futures, timeout=timeout)
+                for future in done:
+                    try:
+                        addresses[futures[future]] = future.result()
+                    except (OSError, ValueError, UnicodeError):
+                        unresolved.add(futures[future])
+                for future in not_done:
+                    future.cancel()
+                    unresolved.add(futures[future])
+            finally:
+                executor.shutdown(wait=False)   # don't wait for lookups that are still hanging
+        return addresses, unresolved
+
+    @staticmethod
+    def _getaddrinfo(location, flags=0):
+        family, socktype, proto, _, address = socket.getaddrinfo(location[0], location[1], 0, socket.SOCK_STREAM, 0, flags)[0]
+        return family, socktype, proto, address
+
+    @staticmethod
+    def _connect_nonblocking(address):
+        family, socktype, proto, address = address
+        sock = socket.socket(family, socktype, proto)
+        sock.setblocking(False)
+        error = sock.connect_ex(address)
+        if error not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EAGAIN, getattr(errno, "WSAEWOULDBLOCK", None)):
+            sock.close()
+            raise OSError(error, os.strerror(error))
+        return sock
+
+
+class Replicator(threading.Thread):
+    """
+    Keeps a replica name server up to date: fetches the changes from the primary name server with
+    long-polling calls to its replication_changes method, and applies them to the replica.
+    After the connection to the primary was lost, it starts over with a full snapshot:
+    the primary may have been restarted, and then its changes don't follow on from what the replica has.
+    """
+    poll_timeout = 10.0
+    retry_delay = 2.0
+
+    def __init__(self, replica):
+        super(Replicator, self).__init__()
+        self.replica = replica
+        self.stop = False
+        self.daemon = True
+        self.revision = -1     # nothing applied yet, so the first call returns a snapshot
+
+    def run(self):
+        while not self.stop and self.replica.primary:
+            try:
+                with client.Proxy(self.replica.primary) as primary:
+                    primary._pyroTimeout = self.poll_timeout + (config.COMMTIMEOUT or 10.0)
+                    while not self.stop and self.replica.primary:
+                        revision, registrations, snapshot = primary.replication_changes(self.revision, self.poll_timeout)
+                        if self.stop or not self.replica.primary:
+                            break
+                        if snapshot or registrations:
+                            self.replica._apply_replication(revision, registrations, snapshot)
+                            log.debug("replicated revision %d from %s", revision, self.replica.primary)
+                        self.revision = revision
+            except errors.PyroError as x:
+                log.warning("replication from %s failed, will retry: %s", self.replica.primary, x)
+                self.revision = -1
+                deadline = time.time() + self.retry_delay
+                while not self.stop and time.time() < deadline:
+                    time.sleep(0.1)
+
 
 class BroadcastServer(object):
+    max_cached_responses = 1000
+
     class TransportServerAdapter(object):
         # this adapter is used to be able to pass the BroadcastServer to Daemon.combine() to integrate the event loops.
         def __init__(self, bcserver):
@@ -575,6 +1596,7 @@ class BroadcastServer(object):
     def __init__(self, nsUri, bchost=None, bcport=None, ipv6=False):
         self.transportServer = self.TransportServerAdapter(self)
         self.nsUri = nsUri
+        self.responses = {}     # client ip -> response data
         if bcport is None:
             bcport = config.NS_BCPORT
         if bchost is None:
@@ -626,15 +1648,24 @@ class BroadcastServer(object):
         with contextlib.suppress(socket.error):
             data, addr = self.sock.recvfrom(100)
             if data == b"GET_NSURI":
-                responsedata = core.URI(self.nsUri)
-                if responsedata.host == "0.0.0.0":
-                    # replace INADDR_ANY address by the interface IP address that connects to the requesting client
-                    with contextlib.suppress(socket.error):
-                        interface_ip = socketutil.get_interface(addr[0]).ip
-                        responsedata.host = str(interface_ip)
-                log.debug("responding to broadcast request from %s: interface %s", addr[0], responsedata.host)
-                responsedata = str(responsedata).encode("iso-8859-1")
-                self.sock.sendto(responsedata, 0, addr)
+                self.sock.sendto(self.response(addr[0]), 0, addr)
+
+    def response(self, client_ip):
+        """The answer to a broadcast request from the given client. These are cached per client address."""
+        responsedata = self.responses.get(client_ip)
+        if responsedata is None:
+            responsedata = core.URI(self.nsUri)
+            if responsedata.host == "0.0.0.0":
+                # replace INADDR_ANY address by the interface IP address that connects to the requesting client
+                with contextlib.suppress(socket.error):
+                    interface_ip = socketutil.get_interface(client_ip).ip
+                    responsedata.host = str(interface_ip)
+            responsedata = str(responsedata).encode("iso-8859-1")
+            if len(self.responses) >= self.max_cached_responses:
+                self.responses.clear()
+            self.responses[client_ip] = responsedata
+        log.debug("responding to broadcast request from %s: %s", client_ip, responsedata)
+        return responsedata
 
     def __enter__(self):
         return self
@@ -644,9 +1675,10 @@ class BroadcastServer(object):
 
 
 def start_ns_loop(host=None, port=None, enableBroadcast=True, bchost=None, bcport=None,
-                  unixsocket=None, nathost=None, natport=None, storage=None):
-    """utility function that starts a new Name server and enters its requestloop."""
-    daemon = NameServerDaemon(host, port, unixsocket, nathost=nathost, natport=natport, storage=storage)
+                  unixsocket=None, nathost=None, natport=None, storage=None, primary=None):
+    """utility function that starts a new Name server and enters its requestloop.
+    If primary is given (the uri of another name server), it is started as a read-only replica of that name server."""
+    daemon = NameServerDaemon(host, port, unixsocket, nathost=nathost, natport=natport, storage=storage, primary=primary)
     nsUri = daemon.uriFor(daemon.nameserver)
     internalUri = daemon.uriFor(daemon.nameserver, nat=False)
     bcserver = None
@@ -672,6 +1704,8 @@ def start_ns_loop(host=None, port=None, enableBroadcast=True, bchost=None, bcpor
     existing = daemon.nameserver.count()
     if existing > 1:   # don't count our own nameserver registration
         print("Persistent store contains %d existing registrations." % existing)
+    if primary:
+        print("NS is a read-only replica of %s" % primary)
     print("NS running on %s (%s)" % (daemon.locationStr, hostip))
     if daemon.natLocationStr:
         print("internal URI = %s" % internalUri)
@@ -688,10 +1722,11 @@ def start_ns_loop(host=None, port=None, enableBroadcast=True, bchost=None, bcpor
 
 
 def start_ns(host=None, port=None, enableBroadcast=True, bchost=None, bcport=None,
-             unixsocket=None, nathost=None, natport=None, storage=None):
+             unixsocket=None, nathost=None, natport=None, storage=None, primary=None):
     """utility fuction to quickly get a Name server daemon to be used in your own event loops.
+    If primary is given (the uri of another name server), it is started as a read-only replica of that name server.
     Returns (nameserverUri, nameserverDaemon, broadcastServer)."""
-    daemon = NameServerDaemon(host, port, unixsocket, nathost=nathost, natport=natport, storage=storage)
+    daemon = NameServerDaemon(host, port, unixsocket, nathost=nathost, natport=natport, storage=storage, primary=primary)
     bcserver = None
     nsUri = daemon.uriFor(daemon.nameserver)
     if not unixsocket:
@@ -749,17 +1784,18 @@ def main(args=None):
     parser.add_argument("-n", "--host", dest="host", help="hostname to bind server on")
     parser.add_argument("-p", "--port", dest="port", type=int, help="port to bind server on (0=random)")
     parser.add_argument("-u", "--unixsocket", help="Unix domain socket name to bind server on")
-    parser.add_argument("-s", "--storage", help="Storage system to use (memory, sql:file)", default="memory")
+    parser.add_argument("-s", "--storage", help="Storage system to use (memory, sql:file, log:directory)", default="memory")
     parser.add_argument("--bchost", dest="bchost", help="hostname to bind broadcast server on (default is \"\")")
     parser.add_argument("--bcport", dest="bcport", type=int, help="port to bind broadcast server on (0=random)")
     parser.add_argument("--nathost", dest="nathost", help="external hostname in case of NAT")
     parser.add_argument("--natport", dest="natport", type=int, help="external port in case of NAT")
     parser.add_argument("-x", "--nobc", dest="enablebc", action="store_false", default=True,
                         help="don't start a broadcast server")
+    parser.add_argument("--primary", help="uri of the primary name server to run as a read-only replica of")
     options = parser.parse_args(args)
     start_ns_loop(options.host, options.port, enableBroadcast=options.enablebc,
                   bchost=options.bchost, bcport=options.bcport, unixsocket=options.unixsocket,
-                  nathost=options.nathost, natport=options.natport, storage=options.storage)
+                  nathost=options.nathost, natport=options.natport, storage=options.storage, primary=options.primary)
 
 
 if __name__ == "__main__":
@@ -8,42 +8,71 @@ from . import errors, core
 
 
 def handle_command(namesrv, cmd, args):
-    def print_list_result(resultdict, title=""):
+    def print_list_result(items, title=""):
+        # the items are (name, (uri, metadata)) tuples, sorted by name. They're printed as they arrive.
         print("--------START LIST %s" % title)
-        for name, (uri, metadata) in sorted(resultdict.items()):
+        for name, (uri, metadata) in items:
             print("%s --> %s" % (name, uri))
             if metadata:
                 print("    metadata:", metadata)
         print("--------END LIST %s" % title)
 
+    def stream_or_list(iter_method, list_method, **kwargs):
+        # streaming the items needs ITER_STREAMING on the name server, and a name server that has the *_iter methods
+        # (older ones don't). Otherwise get the whole result at once.
+        try:
+            return getattr(namesrv, iter_method)(**kwargs)
+        except (errors.ProtocolError, AttributeError):
+            return sorted(getattr(namesrv, list_method)(**kwargs).items())
+
     def cmd_ping():
         namesrv.ping()
         print("Name server ping ok.")
 
     def cmd_listprefix():
         if len(args) == 0:
-            print_list_result(namesrv.list(return_metadata=True))
+            print_list_result(stream_or_list("list_iter", "list", return_metadata=True))
         else:
-            print_list_result(namesrv.list(prefix=args[0], return_metadata=True), "- prefix '%s'" % args[0])
+            print_list_result(stream_or_list("list_iter", "list", prefix=args[0], return_metadata=True),
+                              "- prefix '%s'" % args[0])
 
     def cmd_listregex():
         if len(args) != 1:
             raise SystemExit("requires one argument: pattern")
-        print_list_result(namesrv.list(regex=args[0], return_metadata=True), "- regex '%s'" % args[0])
+        print_list_result(stream_or_list("list_iter", "list", regex=args[0], return_metadata=True),
+                          "- regex '%s'" % args[0])
 
     def cmd_lookup():
-        if len(args) != 1:
-            raise SystemExit("requires one argument: name")
-        uri, metadata = namesrv.lookup(args[0], return_metadata=True)
-        print(uri)
-        if metadata:
-            print("metadata:", metadata)
+        if len(args) < 1:
+            raise SystemExit("requires at least one argument: name")
+        if len(args) == 1:
+            uri, metadata = namesrv.lookup(args[0], return_metadata=True)
+            print(uri)
+            if metadata:
+                print("metadata:", metadata)
+            return
+        for name, result in namesrv.lookup_many(args, return_metadata=True).items():
+            if isinstance(result, Exception):
+                print("%s --> Error: %s" % (name, result))
+            else:
+                uri, metadata = result
+                print("%s --> %s" % (name, uri))
+                if metadata:
+                    print("    metadata:", metadata)
 
     def cmd_register():
-        if len(args) != 2:
-            raise SystemExit("requires two arguments: name uri")
-        namesrv.register(args[0], args[1], safe=True)
-        print("Registered %s" % args[0])
+        if len(args) < 2 or len(args) % 2:
+            raise SystemExit("requires pairs of arguments: name uri [name uri...]")
+        if len(args) == 2:
+            namesrv.register(args[0], args[1], safe=True)
+            print("Registered %s" % args[0])
+            return
+        registrations = dict(zip(args[::2], args[1::2]))
+        for name, error in namesrv.register_many(registrations, safe=True).items():
+            if error:
+                print("Not registered %s: %s" % (name, error))
+            else:
+                print("Registered %s" % name)
 
     def cmd_remove():
         if len(args) != 1:
@@ -75,12 +104,14 @@ def handle_command(namesrv, cmd, args):
     def cmd_yplookup_all():
         if len(args) < 1:
             raise SystemExit("requires at least one metadata tag argument")
-        print_list_result(namesrv.yplookup(meta_all=args, return_metadata=True), " - searched by metadata")
+        print_list_result(stream_or_list("yplookup_iter", "yplookup", meta_all=args, return_metadata=True),
+                          " - searched by metadata")
 
     def cmd_yplookup_any():
         if len(args) < 1:
             raise SystemExit("requires at least one metadata tag argument")
-        print_list_result(namesrv.yplookup(meta_any=args, return_metadata=True), " - searched by metadata")
+        print_list_result(stream_or_list("yplookup_iter", "yplookup", meta_any=args, return_metadata=True),
+                          " - searched by metadata")
 
     commands = {
         "ping": cmd_ping,
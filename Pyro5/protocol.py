@@ -56,6 +56,7 @@ FLAGS_BATCH = 1 << 3
 FLAGS_ITEMSTREAMRESULT = 1 << 4
 FLAGS_KEEPSERIALIZED = 1 << 5
 FLAGS_CORR_ID = 1 << 6
+FLAGS_CHUNKED = 1 << 7     # request: client accepts a chunked result. response: data is one chunk of the result elements
 
 # wire protocol version. Note that if this gets updated, Pyrolite might need an update too.
 PROTOCOL_VERSION = 502
@@ -5,6 +5,7 @@ Pyro - Python Remote Objects.  Copyright by Irmen de Jong (irmen@razorvine.net).
 """
 
 import array
+import base64
 import builtins
 import uuid
 import logging
@@ -14,9 +15,15 @@ import decimal
 import numbers
 import inspect
 import marshal
+import pickle
+import io
 import json
+import re
+import sys
 import serpent
 import contextlib
+import dataclasses
+import operator
 try:
     import msgpack
 except ImportError:
@@ -24,7 +31,7 @@ except ImportError:
 from . import errors
 
 __all__ = ["SerializerBase", "SerpentSerializer", "JsonSerializer", "MarshalSerializer", "MsgpackSerializer",
-           "serializers", "serializers_by_id"]
+           "PickleSerializer", "serializers", "serializers_by_id"]
 
 log = logging.getLogger("Pyro5.serializers")
 
@@ -46,6 +53,166 @@ def pyro_class_serpent_serializer(obj, serializer, stream, level):
     serializer.ser_builtins_dict(d, stream, level)
 
 
+def _decode_binary(value):
+    """bytes in a class dict arrive as bytes, as a base-64 encoded string (json), or as a base-64 dict (serpent)"""
+    if isinstance(value, dict):
+        return serpent.tobytes(value)
+    if isinstance(value, str):
+        return base64.b64decode(value)
+    return value
+
+
+def array_to_dict(arr, binary=True):
+    """
+    Converts an array.array into a class dict containing its typecode and its raw data (in native byte order).
+    The data is stored as a memoryview on the array (bytes for the serializers), or as a base-64 encoded string
+    if binary is False (for serializers that don't support bytes).
+    """
+    data = memoryview(arr).cast("B")
+    return {
+        "__class__": "array.array",
+        "typecode": arr.typecode,
+        "itemsize": arr.itemsize,
+        "byteorder": sys.byteorder,
+        "data": data if binary else base64.b64encode(data).decode("ascii")
+    }
+
+
+def _make_array(typecode, itemsize, byteorder, buffer):
+    if typecode not in array.typecodes:
+        raise errors.SerializeError("invalid array typecode: " + str(typecode))
+    arr = array.array(typecode)
+    if arr.itemsize != itemsize:
+        # some typecodes have a platform dependent size
+        raise errors.SerializeError("array typecode %s has a different item size on this platform" % typecode)
+    arr.frombytes(buffer)
+    if byteorder != sys.byteorder:
+        arr.byteswap()
+    return arr
+
+
+def dict_to_array(data):
+    """Recreates an array.array from its class dict (see array_to_dict)."""
+    return _make_array(data["typecode"], data["itemsize"], data["byteorder"], _decode_binary(data["data"]))
+
+
+def serpent_array_serializer(arr, serializer, stream, level):
+    if arr.typecode == 'u':
+        serializer._serialize(arr.tounicode(), stream, level)
+    else:
+        serializer.ser_builtins_dict(array_to_dict(arr), stream, level)
+
+
+def _is_ndarray(obj):
+    # numpy is not imported here: if the program hasn't imported it itself, there can't be any numpy arrays
+    numpy = sys.modules.get("numpy")
+    return numpy is not None and type(obj) is getattr(numpy, "ndarray", None)
+
+
+def _import_numpy():
+    # numpy is only imported when an array has to be recreated, to not slow down importing Pyro
+    try:
+        import numpy
+        import numpy.lib.format
+    except ImportError:
+        raise errors.SerializeError("cannot deserialize numpy array: numpy is not available") from None
+    return numpy
+
+
+def _ndarray_parts(array):
+    """
+    Returns the metadata (dtype description, shape, memory order) of a numpy array,
+    and its raw data as a flat buffer of bytes. The data is not copied unless the array isn't contiguous.
+    """
+    numpy = _import_numpy()
+    if array.dtype.hasobject:
+        raise errors.SerializeError("cannot serialize numpy arrays containing python objects")
+    if array.flags.c_contiguous:
+        order, contiguous = "C", array
+    elif array.flags.f_contiguous:
+        order, contiguous = "F", array.T
+    else:
+        order, contiguous = "C", numpy.ascontiguousarray(array)
+    buffer = memoryview(contiguous.reshape(-1).view(numpy.uint8))
+    return numpy.lib.format.dtype_to_descr(array.dtype), list(array.shape), order, buffer
+
+
+def ndarray_to_dict(array, binary=True):
+    """
+    Converts a numpy array into a class dict. The array data is stored as bytes,
+    or as a base-64 encoded string if binary is False (for serializers that don't support bytes).
+    """
+    dtype, shape, order, buffer = _ndarray_parts(array)
+    return {
+        "__class__": "numpy.ndarray",
+        "dtype": dtype,
+        "shape": shape,
+        "order": order,
+        "data": bytes(buffer) if binary else base64.b64encode(buffer).decode("ascii")
+    }
+
+
+def _make_ndarray(dtype, shape, order, buffer):
+    numpy = _import_numpy()
+    dtype = numpy.lib.format.descr_to_dtype(dtype if isinstance(dtype, str) else [tuple(f) for f in dtype])
+    if dtype.hasobject:
+        raise errors.SerializeError("refused to deserialize numpy array containing python objects")
+    # numpy.frombuffer doesn't copy the data; the resulting array is read-only
+    return numpy.frombuffer(buffer, dtype=dtype).reshape(shape, order=order)
+
+
+def dict_to_ndarray(data):
+    """Recreates a numpy array from its class dict (see ndarray_to_dict)."""
+    return _make_ndarray(data["dtype"], data["shape"], data["order"], _decode_binary(data["data"]))
+
+
+class _Schema(object):
+    """
+    Precomputed (de)serialization plan for a class registered with SerializerBase.register_schema.
+    Objects are encoded as a type tag plus a tuple of their field values, in a fixed order.
+    """
+    __slots__ = ("clazz", "tag", "fields", "values", "construct")
+
+    def __init__(self, clazz, tag, fields):
+        self.clazz = clazz
+        self.tag = tag
+        self.fields = fields
+        if not fields:
+            self.values = lambda obj: ()
+        elif len(fields) == 1:
+            getter = operator.attrgetter(fields[0])
+            self.values = lambda obj: (getter(obj),)
+        else:
+            self.values = operator.attrgetter(*fields)
+        if dataclasses.is_dataclass(clazz) and all(f.init for f in dataclasses.fields(clazz)) \
+                and tuple(f.name for f in dataclasses.fields(clazz)) == fields:
+            self.construct = lambda values: clazz(*values)
+        else:
+            def construct(values):
+                obj = clazz.__new__(clazz)
+                for field, value in zip(fields, values):
+                    object.__setattr__(obj, field, value)
+                return obj
+            self.construct = construct
+
+    def to_dict(self, obj):
+        return {"__class__": self.tag, "values": self.values(obj)}
+
+    @staticmethod
+    def fields_of(clazz):
+        if dataclasses.is_dataclass(clazz):
+            return tuple(f.name for f in dataclasses.fields(clazz))
+        fields = []
+        for base in reversed(clazz.__mro__):
+            slots = vars(base).get("__slots__", ())
+            if isinstance(slots, str):
+                slots = (slots,)
+            fields.extend(slot for slot in slots if slot not in ("__dict__", "__weakref__") and slot not in fields)
+        if not fields:
+            raise ValueError("can't determine the fields of class " + str(clazz) + ", specify them explicitly")
+        return tuple(fields)
+
+
 def serialize_pyro_object_to_dict(obj):
     return {
         "__class__": "{:s}.{:s}".format(obj.__module__, obj.__class__.__name__),
@@ -58,6 +225,10 @@ class SerializerBase(object):
     serializer_id = 0  # define uniquely in subclass
     __custom_class_to_dict_registry = {}
     __custom_dict_to_class_registry = {}
+    __class_to_dict_cache = {}      # type -> converter (or None), derived from the class-to-dict registry
+    __builtin_dict_to_class = {}    # classname -> converter for Pyro's own types, filled on first use
+    __schemas_by_class = {}
+    __schemas_by_tag = {}
 
     def loads(self, data):
         raise NotImplementedError("implement in subclass")
@@ -87,6 +258,7 @@ class SerializerBase(object):
         """Registers a custom function that returns a dict representation of objects of the given class.
         The function is called with a single parameter; the object to be converted to a dict."""
         cls.__custom_class_to_dict_registry[clazz] = converter
+        cls.__class_to_dict_cache.clear()
         if serpent_too:
             with contextlib.suppress(errors.ProtocolError):
                 def serpent_converter(obj, serializer, stream, level):
@@ -101,6 +273,7 @@ class SerializerBase(object):
         will be serialized by the default mechanism again."""
         if clazz in cls.__custom_class_to_dict_registry:
             del cls.__custom_class_to_dict_registry[clazz]
+            cls.__class_to_dict_cache.clear()
         with contextlib.suppress(errors.ProtocolError):
             serpent.unregister_class(clazz)
 
@@ -121,14 +294,82 @@ class SerializerBase(object):
         if classname in cls.__custom_dict_to_class_registry:
             del cls.__custom_dict_to_class_registry[classname]
 
+    @classmethod
+    def register_schema(cls, clazz, fields=None, tag=None):
+        """
+        Registers a fixed schema for the given class, usually a dataclass or a class with __slots__.
+        Its objects are then serialized as a type tag plus a tuple of the field values, instead of as a dict
+        that repeats all attribute names for every object. The field accessors and the constructor are
+        determined once, here. Both sides of the connection have to register the same schema.
+        The fields default to the dataclass fields or the __slots__ of the class,
+        and the tag defaults to the fully qualified class name. Use a short tag to save more space.
+        """
+        if not inspect.isclass(clazz):
+            raise TypeError("can only register a schema for a class")
+        fields = tuple(fields) if fields is not None else _Schema.fields_of(clazz)
+        schema = _Schema(clazz, tag or clazz.__module__ + "." + clazz.__qualname__, fields)
+        cls.unregister_schema(clazz)
+        cls.__schemas_by_class[clazz] = schema
+        cls.__schemas_by_tag[schema.tag] = schema
+        with contextlib.suppress(errors.ProtocolError):
+            def serpent_converter(obj, serializer, stream, level):
+                serializer.ser_builtins_dict(schema.to_dict(obj), stream, level)
+
+            serpent.register_class(clazz, serpent_converter)
+
+    @classmethod
+    def unregister_schema(cls, clazz):
+        """Removes the schema registered for the given class."""
+        schema = cls.__schemas_by_class.pop(clazz, None)
+        if schema:
+            cls.__schemas_by_tag.pop(schema.tag, None)
+            with contextlib.suppress(errors.ProtocolError):
+                serpent.unregister_class(clazz)
+
+    @classmethod
+    def _find_schema(cls, clazz):
+        return cls.__schemas_by_class.get(clazz)
+
+    @classmethod
+    def _find_class_to_dict_converter(cls, clazz):
+        """
+        Finds the registered class-to-dict converter for the given type (or None).
+        The most specific registered class in the type's mro wins. The result is cached per type.
+        """
+        try:
+            return cls.__class_to_dict_cache[clazz]
+        except KeyError:
+            pass
+        registry = cls.__custom_class_to_dict_registry
+        converter = None
+        for base in clazz.__mro__:
+            if base in registry:
+                converter = registry[base]
+                break
+        else:
+            # virtual subclasses (of abstract base classes) don't appear in the mro
+            for registered_class, registered_converter in list(registry.items()):
+                if issubclass(clazz, registered_class):
+                    converter = registered_converter
+                    break
+        cls.__class_to_dict_cache[clazz] = converter
+        return converter
+
     @classmethod
     def class_to_dict(cls, obj):
         """
         Convert a non-serializable object to a dict. Partly borrowed from serpent.
         """
-        for clazz in cls.__custom_class_to_dict_registry:
-            if isinstance(obj, clazz):
-                return cls.__custom_class_to_dict_registry[clazz](obj)
+        if cls.__schemas_by_class:
+            schema = cls.__schemas_by_class.get(type(obj))
+            if schema:
+                return schema.to_dict(obj)
+        if cls.__custom_class_to_dict_registry:
+            converter = cls._find_class_to_dict_converter(type(obj))
+            if converter:
+                return converter(obj)
+        if _is_ndarray(obj):
+            return ndarray_to_dict(obj)
         if type(obj) in (set, dict, tuple, list):
             # we use a ValueError to mirror the exception type returned by serpent and other serializers
             raise ValueError("can't serialize type " + str(obj.__class__) + " into a dict")
@@ -172,50 +413,23 @@ class SerializerBase(object):
         Recreate an object out of a dict containing the class name and the attributes.
         Only a fixed set of classes are recognized.
         """
-        from . import core, client, server  # circular imports...
         classname = data.get("__class__", "<unknown>")
         if isinstance(classname, bytes):
             classname = classname.decode("utf-8")
+        if classname in cls.__schemas_by_tag:
+            return cls.__schemas_by_tag[classname].construct(data["values"])
         if classname in cls.__custom_dict_to_class_registry:
             converter = cls.__custom_dict_to_class_registry[classname]
             return converter(classname, data)
         if "__" in classname:
             raise errors.SecurityError("refused to deserialize types with double underscores in their name: " + classname)
-        # for performance reasons, the constructors below are hardcoded here
-        # instead of added on a per-class basis to the dict-to-class registry
-        if classname == "Pyro5.core.URI":
-            uri = core.URI.__new__(core.URI)
-            uri.__setstate__(data["state"])
-            return uri
-        elif classname == "Pyro5.client.Proxy":
-            proxy = client.Proxy.__new__(client.Proxy)
-            proxy.__setstate__(data["state"])
-            return proxy
-        elif classname == "Pyro5.server.Daemon":
-            daemon = server.Daemon.__new__(server.Daemon)
-            daemon.__setstate__(data["state"])
-            return daemon
-        elif classname.startswith("Pyro5.util."):
-            if classname == "Pyro5.util.SerpentSerializer":
-                return SerpentSerializer()
-            elif classname == "Pyro5.util.MarshalSerializer":
-                return MarshalSerializer()
-            elif classname == "Pyro5.util.JsonSerializer":
-                return JsonSerializer()
-            elif classname == "Pyro5.util.MsgpackSerializer":
-                return MsgpackSerializer()
-        elif classname.startswith("Pyro5.errors."):
-            errortype = getattr(errors, classname.split('.', 2)[2])
-            if issubclass(errortype, errors.PyroError):
-                return SerializerBase.make_exception(errortype, data)
-        elif classname == "struct.error":
-            return SerializerBase.make_exception(struct.error, data)
-        elif classname == "Pyro5.core._ExceptionWrapper":
-            ex = data["exception"]
-            if isinstance(ex, dict) and "__class__" in ex:
-                ex = SerializerBase.dict_to_class(ex)
-            return core._ExceptionWrapper(ex)
-        elif data.get("__exception__", False):
+        # for performance reasons, the constructors for Pyro's own types are looked up in a fixed
+        # dispatch table instead of being added on a per-class basis to the dict-to-class registry
+        builtin_converters = SerializerBase.__builtin_dict_to_class or SerializerBase._init_builtin_dict_to_class()
+        converter = builtin_converters.get(classname)
+        if converter:
+            return converter(data)
+        if data.get("__exception__", False):
             if classname in all_exceptions:
                 return SerializerBase.make_exception(all_exceptions[classname], data)
             # translate to the appropriate namespace...
@@ -232,6 +446,53 @@ class SerializerBase(object):
         log.warning("unsupported serialized class: " + classname)
         raise errors.SerializeError("unsupported serialized class: " + classname)
 
+    @staticmethod
+    def _init_builtin_dict_to_class():
+        from . import core, client, server  # circular imports...
+
+        def make_uri(data):
+            uri = core.URI.__new__(core.URI)
+            uri.__setstate__(data["state"])
+            return uri
+
+        def make_proxy(data):
+            proxy = client.Proxy.__new__(client.Proxy)
+            proxy.__setstate__(data["state"])
+            return proxy
+
+        def make_daemon(data):
+            daemon = server.Daemon.__new__(server.Daemon)
+            daemon.__setstate__(data["state"])
+            return daemon
+
+        def make_exceptionwrapper(data):
+            ex = data["exception"]
+            if isinstance(ex, dict) and "__class__" in ex:
+                ex = SerializerBase.dict_to_class(ex)
+            return core._ExceptionWrapper(ex)
+
+        def exception_maker(exceptiontype):
+            return lambda data: SerializerBase.make_exception(exceptiontype, data)
+
+        converters = {
+            "Pyro5.core.URI": make_uri,
+            "Pyro5.client.Proxy": make_proxy,
+            "Pyro5.server.Daemon": make_daemon,
+            "Pyro5.core._ExceptionWrapper": make_exceptionwrapper,
+            "Pyro5.util.SerpentSerializer": lambda data: SerpentSerializer(),
+            "Pyro5.util.MarshalSerializer": lambda data: MarshalSerializer(),
+            "Pyro5.util.JsonSerializer": lambda data: JsonSerializer(),
+            "Pyro5.util.MsgpackSerializer": lambda data: MsgpackSerializer(),
+            "struct.error": exception_maker(struct.error),
+            "array.array": dict_to_array,
+            "numpy.ndarray": dict_to_ndarray,
+        }
+        for name, errortype in vars(errors).items():
+            if inspect.isclass(errortype) and issubclass(errortype, errors.PyroError):
+                converters["Pyro5.errors." + name] = exception_maker(errortype)
+        SerializerBase.__builtin_dict_to_class.update(converters)
+        return SerializerBase.__builtin_dict_to_class
+
     @staticmethod
     def make_exception(exceptiontype, data):
         ex = exceptiontype(*data["args"])
@@ -241,6 +502,23 @@ class SerializerBase(object):
                 setattr(ex, attr, value)
         return ex
 
+    _class_marker = re.compile(b"__class__")
+
+    @classmethod
+    def _may_contain_classes(cls, data):
+        """
+        Quick scan of the serialized data for the class marker. If it doesn't occur anywhere,
+        the serialized data can't contain class dicts and the recreate_classes walk can be skipped.
+        """
+        if isinstance(data, str):
+            return "__class__" in data
+        return cls._class_marker.search(data) is not None
+
+    def object_hook(self, obj):
+        if "__class__" in obj:
+            return self.dict_to_class(obj)
+        return obj
+
     def recreate_classes(self, literal):
         t = type(literal)
         if t is set:
@@ -251,6 +529,9 @@ class SerializerBase(object):
             return tuple(self.recreate_classes(x) for x in literal)
         if t is dict:
             if "__class__" in literal:
+                schema = self.__schemas_by_tag.get(literal["__class__"])
+                if schema:
+                    return schema.construct(self.recreate_classes(literal["values"]))
                 return self.dict_to_class(literal)
             result = {}
             for key, value in literal.items():
@@ -273,19 +554,25 @@ class SerpentSerializer(SerializerBase):
     serializer_id = 1  # never change this
 
     def dumpsCall(self, obj, method, vargs, kwargs):
+        _register_serpent_ndarray()
         return serpent.dumps((obj, method, vargs, kwargs), module_in_classname=True)
 
     def dumps(self, data):
+        _register_serpent_ndarray()
         return serpent.dumps(data, module_in_classname=True)
 
     def loadsCall(self, data):
         obj, method, vargs, kwargs = serpent.loads(data)
-        vargs = self.recreate_classes(vargs)
-        kwargs = self.recreate_classes(kwargs)
+        if self._may_contain_classes(data):
+            vargs = self.recreate_classes(vargs)
+            kwargs = self.recreate_classes(kwargs)
         return obj, method, vargs, kwargs
 
     def loads(self, data):
-        return self.recreate_classes(serpent.loads(data))
+        result = serpent.loads(data)
+        if self._may_contain_classes(data):
+            return self.recreate_classes(result)
+        return result
 
     @classmethod
     def register_type_replacement(cls, object_type, replacement_function):
@@ -322,25 +609,34 @@ class MarshalSerializer(SerializerBase):
     def loadsCall(self, data):
         data = self._convertToBytes(data)
         obj, method, vargs, kwargs = marshal.loads(data)
-        vargs = self.recreate_classes(vargs)
-        kwargs = self.recreate_classes(kwargs)
+        if self._may_contain_classes(data):
+            vargs = self.recreate_classes(vargs)
+            kwargs = self.recreate_classes(kwargs)
         return obj, method, vargs, kwargs
 
     def loads(self, data):
         data = self._convertToBytes(data)
-        return self.recreate_classes(marshal.loads(data))
+        result = marshal.loads(data)
+        if self._may_contain_classes(data):
+            return self.recreate_classes(result)
+        return result
 
     def convert_obj_into_marshallable(self, obj):
+        """
+        Converts a result or method argument into something marshal can encode. Only the value itself is converted,
+        not the values nested inside it: marshal sends nested arrays as plain bytes, and fails on other nested objects.
+        """
         marshalable_types = (str, int, float, type(None), bool, complex, bytes, bytearray,
                              tuple, set, frozenset, list, dict)
         if isinstance(obj, array.array):
-            if obj.typecode == 'c':
-                return obj.tostring()
             if obj.typecode == 'u':
                 return obj.tounicode()
-            return obj.tolist()
+            return array_to_dict(obj)
         if isinstance(obj, marshalable_types):
             return obj
+        schema = self._find_schema(type(obj))
+        if schema:
+            return {"__class__": schema.tag, "values": [self.convert_obj_into_marshallable(v) for v in schema.values(obj)]}
         return self.class_to_dict(obj)
 
     @classmethod
@@ -371,14 +667,12 @@ class JsonSerializer(SerializerBase):
 
     def loadsCall(self, data):
         data = self._convertToBytes(data).decode("utf-8")
-        data = json.loads(data)
-        vargs = self.recreate_classes(data["params"])
-        kwargs = self.recreate_classes(data["kwargs"])
-        return data["object"], data["method"], vargs, kwargs
+        data = json.loads(data, object_hook=self.object_hook)
+        return data["object"], data["method"], data["params"], data["kwargs"]
 
     def loads(self, data):
         data = self._convertToBytes(data).decode("utf-8")
-        return self.recreate_classes(json.loads(data))
+        return json.loads(data, object_hook=self.object_hook)
 
     def default(self, obj):
         replacer = self.__type_replacements.get(type(obj), None)
@@ -393,11 +687,11 @@ class JsonSerializer(SerializerBase):
         if isinstance(obj, decimal.Decimal):
             return str(obj)
         if isinstance(obj, array.array):
-            if obj.typecode == 'c':
-                return obj.tostring()
             if obj.typecode == 'u':
                 return obj.tounicode()
-            return obj.tolist()
+            return array_to_dict(obj, binary=False)   # json can't do bytes
+        if _is_ndarray(obj):
+            return ndarray_to_dict(obj, binary=False)
         return self.class_to_dict(obj)
 
     @classmethod
@@ -420,7 +714,7 @@ class MsgpackSerializer(SerializerBase):
         return msgpack.packb(data, use_bin_type=True, default=self.default)
 
     def loadsCall(self, data):
-        return msgpack.unpackb(self._convertToBytes(data), raw=False, object_hook=self.object_hook)
+        return msgpack.unpackb(self._convertToBytes(data), raw=False, object_hook=self.object_hook, ext_hook=self.ext_hook)
 
     def loads(self, data):
         return msgpack.unpackb(self._convertToBytes(data), raw=False, object_hook=self.object_hook, ext_hook=self.ext_hook)
@@ -445,19 +739,17 @@ class MsgpackSerializer(SerializerBase):
             return str(obj)
         if isinstance(obj, numbers.Number):
             return msgpack.ExtType(0x31, str(obj).encode("ascii"))     # long
+        if _is_ndarray(obj):
+            dtype, shape, order, buffer = _ndarray_parts(obj)
+            header = msgpack.packb((dtype, shape, order), use_bin_type=True)
+            return msgpack.ExtType(0x34, b"".join((struct.pack("<I", len(header)), header, buffer)))
         if isinstance(obj, array.array):
-            if obj.typecode == 'c':
-                return obj.tostring()
             if obj.typecode == 'u':
                 return obj.tounicode()
-            return obj.tolist()
+            header = struct.pack("ccB", obj.typecode.encode("ascii"), sys.byteorder[:1].encode("ascii"), obj.itemsize)
+            return msgpack.ExtType(0x35, b"".join((header, memoryview(obj).cast("B"))))
         return self.class_to_dict(obj)
 
-    def object_hook(self, obj):
-        if "__class__" in obj:
-            return self.dict_to_class(obj)
-        return obj
-
     def ext_hook(self, code, data):
         if code == 0x30:
             real, imag = struct.unpack("dd", data)
@@ -468,6 +760,14 @@ class MsgpackSerializer(SerializerBase):
             return datetime.datetime.fromtimestamp(struct.unpack("d", data)[0])
         if code == 0x33:
             return datetime.date.fromordinal(struct.unpack("l", data)[0])
+        if code == 0x34:
+            header_size = struct.unpack_from("<I", data)[0]
+            dtype, shape, order = msgpack.unpackb(data[4:4 + header_size], raw=False)
+            return _make_ndarray(dtype, shape, order, memoryview(data)[4 + header_size:])
+        if code == 0x35:
+            typecode, byteorder, itemsize = struct.unpack_from("ccB", data)
+            byteorder = "little" if byteorder == b"l" else "big"
+            return _make_array(typecode.decode("ascii"), itemsize, byteorder, memoryview(data)[3:])
         raise errors.SerializeError("invalid ext code for msgpack: " + str(code))
 
     @classmethod
@@ -477,16 +777,101 @@ class MsgpackSerializer(SerializerBase):
         cls.__type_replacements[object_type] = replacement_function
 
 
+class PickleSerializer(SerializerBase):
+    """
+    (de)serializer that wraps the pickle serialization protocol (protocol 5).
+    Large buffers (numpy arrays, PickleBuffer objects) are transferred out-of-band: they are appended
+    to the message as-is instead of being copied into the pickle data stream.
+
+    Pickle can execute arbitrary code when deserializing, so only use this between parties that fully trust each other.
+    Daemons refuse it unless it has been added to their accepted serializers.
+    """
+    serializer_id = 5  # never change this
+    protocol = 5
+
+    __type_replacements = {}
+
+    class _Pickler(pickle.Pickler):
+        def __init__(self, file, type_replacements, **kwargs):
+            super().__init__(file, **kwargs)
+            self.type_replacements = type_replacements
+
+        def reducer_override(self, obj):
+            replacer = self.type_replacements.get(type(obj), None)
+            if replacer:
+                replaced = replacer(obj)
+                if replaced is not obj:
+                    return replaced.__reduce_ex__(PickleSerializer.protocol)
+            return NotImplemented
+
+    def dumpsCall(self, obj, method, vargs, kwargs):
+        return self.dumps((obj, method, vargs, kwargs))
+
+    def dumps(self, data):
+        # message layout: number of out-of-band buffers, size of the pickle data, size of each buffer,
+        # then the pickle data, followed by the buffers themselves.
+        buffers = []
+
+        def buffer_callback(picklebuffer):
+            try:
+                buffers.append(picklebuffer.raw())
+                return False
+            except BufferError:
+                return True    # not contiguous, serialize it in-band instead
+
+        stream = io.BytesIO()
+        self._Pickler(stream, self.__type_replacements, protocol=self.protocol, buffer_callback=buffer_callback).dump(data)
+        pickled = stream.getbuffer()
+        header = struct.pack("<IQ%dQ" % len(buffers), len(buffers), len(pickled), *(b.nbytes for b in buffers))
+        return b"".join([header, pickled] + buffers)
+
+    def loadsCall(self, data):
+        return self.loads(data)
+
+    def loads(self, data):
+        data = memoryview(data)
+        num_buffers, pickle_size = struct.unpack_from("<IQ", data)
+        buffer_sizes = struct.unpack_from("<%dQ" % num_buffers, data, 12)
+        offset = 12 + 8 * num_buffers
+        pickled = data[offset:offset + pickle_size]
+        offset += pickle_size
+        buffers = []
+        for size in buffer_sizes:
+            buffers.append(data[offset:offset + size])
+            offset += size
+        return pickle.loads(pickled, buffers=buffers)
+
+    @classmethod
+    def register_type_replacement(cls, object_type, replacement_function):
+        if object_type is type or not inspect.isclass(object_type):
+            raise ValueError("refusing to register replacement for a non-type or the type 'type' itself")
+        cls.__type_replacements[object_type] = replacement_function
+
+
 """The various serializers that are supported"""
 serializers = {
     "serpent": SerpentSerializer(),
     "marshal": MarshalSerializer(),
-    "json": JsonSerializer()
+    "json": JsonSerializer(),
+    "pickle": PickleSerializer()
 }
 
 if msgpack:
     serializers["msgpack"] = MsgpackSerializer()
 
+serpent.register_class(array.array, serpent_array_serializer)
+_serpent_ndarray_registered = False
+
+
+def _register_serpent_ndarray():
+    # registers numpy arrays with serpent once numpy has been imported (by the program, not by Pyro)
+    global _serpent_ndarray_registered
+    if not _serpent_ndarray_registered and "numpy" in sys.modules:
+        numpy = sys.modules["numpy"]
+        if hasattr(numpy, "ndarray"):
+            serpent.register_class(numpy.ndarray, pyro_class_serpent_serializer)
+            _serpent_ndarray_registered = True
+
 
 """The available serializers by their internal id"""
 serializers_by_id = {ser.serializer_id: ser for ser in serializers.values()}
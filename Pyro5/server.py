@@ -13,6 +13,7 @@ import collections
 import threading
 import logging
 import inspect
+import itertools
 import warnings
 import serpent
 import ipaddress
@@ -20,7 +21,7 @@ from typing import Callable, Tuple, Union, Optional, Dict, Any, Sequence, Set
 from . import config, core, errors, serializers, socketutil, protocol, client
 from .callcontext import current_context
 
-__all__ = ["Daemon", "DaemonObject", "callback", "expose", "behavior", "oneway", "serve"]
+__all__ = ["Daemon", "DaemonObject", "callback", "expose", "behavior", "oneway", "idempotent", "cacheable", "serve"]
 
 log = logging.getLogger("Pyro5.server")
 
@@ -68,6 +69,48 @@ def oneway(method: Callable) -> Callable:
     return method
 
 
+def idempotent(method: Callable) -> Callable:
+    """
+    decorator to mark a method to be idempotent (calling it multiple times has the same effect as calling it once).
+    Clients may use this to safely send a duplicate request to another server (see BalancingProxy hedging).
+    """
+    method._pyroIdempotent = True       # type: ignore
+    return method
+
+
+def cacheable(ttl: float = 60.0) -> Callable:
+    """
+    decorator to mark a method (or property) as cacheable: the proxy may keep its results in a local cache
+    for ttl seconds, and return those for repeated calls with the same arguments instead of calling the server.
+    """
+    if not isinstance(ttl, (int, float)) or ttl <= 0:
+        raise SyntaxError("cacheable decorator requires a positive ttl argument")
+
+    def _cacheable(method):
+        if inspect.isdatadescriptor(method):
+            method.fget._pyroCacheable = ttl     # type: ignore
+        else:
+            method._pyroCacheable = ttl
+        return method
+    return _cacheable
+
+
+def cache_serialized(ttl: float = 0.0) -> Callable:
+    """
+    decorator to mark a method that returns the same result every time it's called with the same arguments.
+    The daemon then keeps the serialized response (per serializer) and sends it again for repeated calls,
+    without calling the method or serializing the result again. The cached responses expire after ttl seconds
+    (0 means never), or when you invalidate them via the daemon's invalidate_cached_responses method.
+    """
+    if not isinstance(ttl, (int, float)) or ttl < 0:
+        raise SyntaxError("cache_serialized decorator requires a ttl argument >= 0")
+
+    def _cache_serialized(method):
+        method._pyroCacheSerialized = ttl
+        return method
+    return _cache_serialized
+
+
 def expose(method_or_class: Union[Callable, type]) -> Union[Callable, type]:
     """
     Decorator to mark a method or class to be exposed for remote calls.
@@ -154,6 +197,7 @@ class DaemonObject(object):
             core.DAEMON_NAME, self.daemon.locationStr, self.daemon.natLocationStr,
             len(self.daemon.objectsById), self.daemon.transportServer)
 
+    @cache_serialized()
     def get_metadata(self, objectId):
         """
         Get metadata for the given object (exposed methods, oneways, attributes).
@@ -250,9 +294,58 @@ class Daemon(object):
         self.streaming_responses = {}   # stream_id -> (client, creation_timestamp, linger_timestamp, stream)
         self.housekeeper_lock = threading.Lock()
         self.create_single_instance_lock = threading.Lock()
+        self.serializers_accepted = config.SERIALIZERS_ACCEPTED
+        self.__cachedResponses = client._ResultCache(config.RESPONSE_CACHE_SIZE)
+        self.__cachedResponsesLock = threading.Lock()
         self.__mustshutdown.clear()
         self.methodcall_error_handler = _default_methodcall_error_handler
 
+    @property
+    def serializers_accepted(self):
+        """the names of the serializers that this daemon accepts from clients"""
+        return self.__serializersAccepted
+
+    @serializers_accepted.setter
+    def serializers_accepted(self, names):
+        self.__serializersAccepted = frozenset(names)
+        self.__acceptedSerializerIds = {serializers.serializers[name].serializer_id
+                                        for name in self.__serializersAccepted if name in serializers.serializers}
+
+    def __checkSerializer(self, serializer_id):
+        if serializer_id not in self.__acceptedSerializerIds:
+            raise errors.SecurityError("serializer not accepted by this daemon: %d" % serializer_id)
+
+    def __negotiateSerializer(self, names):
+        """Picks the first serializer from the client's list of preferred serializers that this daemon accepts."""
+        for name in names:
+            serializer = serializers.serializers.get(name)
+            if serializer and serializer.serializer_id in self.__acceptedSerializerIds:
+                return name
+        return None
+
+    def invalidate_cached_responses(self, objectOrId=None, method=None):
+        """
+        Discards the cached serialized responses of methods marked with @cache_serialized:
+        all of them, only those of the given object (or object id), or only those of a single method of that object.
+        """
+        if objectOrId is not None and not isinstance(objectOrId, str):
+            objectOrId = getattr(objectOrId, "_pyroId", None)
+        with self.__cachedResponsesLock:
+            if objectOrId is None:
+                self.__cachedResponses.invalidate()
+            elif method is None:
+                self.__cachedResponses.invalidate_where(lambda name: name[0] == objectOrId)
+            else:
+                self.__cachedResponses.invalidate((objectOrId, method))
+
+    def __getCachedResponse(self, key):
+        with self.__cachedResponsesLock:
+            return self.__cachedResponses.get(key)
+
+    def __putCachedResponse(self, key, name, data, ttl):
+        with self.__cachedResponsesLock:
+            self.__cachedResponses.put(key, name, data, ttl or float("inf"))
+
     @property
     def sock(self):
         """the server socket used by the daemon"""
@@ -326,6 +419,8 @@ class Daemon(object):
         try:
             msg = protocol.recv_stub(conn, [protocol.MSG_CONNECT])
             msg_seq = msg.seq
+            if msg.serializer_id in serializers.serializers_by_id:
+                serializer_id = msg.serializer_id   # the client only accepts a response in its own serializer
             if denied_reason:
                 raise Exception(denied_reason)
             if config.LOGWIRE:
@@ -336,13 +431,33 @@ class Daemon(object):
                 current_context.correlation_id = uuid.uuid4()
             serializer_id = msg.serializer_id
             serializer = serializers.serializers_by_id[serializer_id]
+            self.__checkSerializer(serializer_id)
             data = serializer.loads(msg.data)
             handshake_response = self.validateHandshake(conn, data["handshake"])
-            handshake_response = {
-                "handshake": handshake_response,
-                "meta": self.objectsById[core.DAEMON_NAME].get_metadata(data["object"])
-            }
-            data = serializer.dumps(handshake_response)
+            negotiated = self.__negotiateSerializer(data["serializers"]) if data.get("serializers") else None
+            # The serialized response is cached, it's the same for every client that connects to the same object.
+            # Unless validateHandshake is overridden: that can respond differently to every client.
+            cache_key = None
+            found = False
+            if type(self).validateHandshake is Daemon.validateHandshake:
+                try:
+                    cache_key = ("handshake", serializer_id, data["object"], negotiated)
+                    found, cached = self.__getCachedResponse(cache_key)
+                except TypeError:
+                    cache_key = None    # unhashable object id
+            if found:
+                data = cached
+            else:
+                objectId = data["object"]
+                handshake_response = {
+                    "handshake": handshake_response,
+                    "meta": self.objectsById[core.DAEMON_NAME].get_metadata(objectId)
+                }
+                if negotiated:
+                    handshake_response["serializer"] = negotiated
+                data = serializer.dumps(handshake_response)
+                if cache_key:
+                    self.__putCachedResponse(cache_key, (objectId, None), data, 0)
             msgtype = protocol.MSG_CONNECTOK
         except errors.ConnectionClosedError:
             log.debug("handshake failed, connection closed early")
@@ -386,6 +501,7 @@ class Daemon(object):
         request_serializer_id = serializers.MarshalSerializer.serializer_id
         wasBatched = False
         isCallback = False
+        cache_key = cache_ttl = None
         try:
             msg = protocol.recv_stub(conn, [protocol.MSG_INVOKE, protocol.MSG_PING])
         except errors.CommunicationError as x:
@@ -410,6 +526,7 @@ class Daemon(object):
                 conn.send(msg.data)
                 return
             serializer = serializers.serializers_by_id[msg.serializer_id]
+            self.__checkSerializer(msg.serializer_id)
             if request_flags & protocol.FLAGS_KEEPSERIALIZED:
                 # pass on the wire protocol message blob unchanged
                 objId, method, vargs, kwargs = self.__deserializeBlobArgs(msg)
@@ -426,6 +543,7 @@ class Daemon(object):
             current_context.annotations = msg.annotations
             current_context.msg_flags = msg.flags
             current_context.serializer_id = msg.serializer_id
+            request_data = msg.data    # the serialized call, this is the key for cached responses
             del msg  # invite GC to collect the object, don't wait for out-of-scope
             obj = self.objectsById.get(objId)
             if obj is not None:
@@ -462,6 +580,15 @@ class Daemon(object):
                             _OnewayCallThread(method, vargs, kwargs, self, current_context.client_sock_addr).start()
                         else:
                             isCallback = getattr(method, "_pyroCallback", False)
+                            cache_ttl = getattr(method, "_pyroCacheSerialized", None)
+                            if cache_ttl is not None and not request_flags & protocol.FLAGS_KEEPSERIALIZED:
+                                # the key contains the serialized arguments rather than the argument values,
+                                # because values such as 1, 1.0 and True are equal but must not share a response
+                                cache_key = (objId, method.__name__, serializer.serializer_id, bytes(request_data))
+                                found, serialized_data = self.__getCachedResponse(cache_key)
+                                if found:
+                                    self.__sendResponse(conn, request_seq, serializer.serializer_id, serialized_data, 0)
+                                    return
                             try:
                                 data = method(*vargs, **kwargs)  # this is the actual method call to the Pyro object
                             except Exception as xv:
@@ -482,17 +609,15 @@ class Daemon(object):
                 raise errors.DaemonError("unknown object")
             if request_flags & protocol.FLAGS_ONEWAY:
                 return  # oneway call, don't send a response
+            elif request_flags & protocol.FLAGS_CHUNKED and not wasBatched and \
+                    type(data) in (list, tuple, dict) and len(data) > config.RESULT_CHUNK_SIZE:
+                self._sendChunkedResponse(conn, request_seq, serializer, data)
             else:
                 data = serializer.dumps(data)
-                response_flags = 0
-                if wasBatched:
-                    response_flags |= protocol.FLAGS_BATCH
-                msg = protocol.SendingMessage(protocol.MSG_RESULT, response_flags, request_seq, serializer.serializer_id, data,
-                                              annotations=self.__annotations())
-                current_context.response_annotations = {}
-                if config.LOGWIRE:
-                    protocol.log_wiredata(log, "daemon wiredata sending", msg)
-                conn.send(msg.data)
+                if cache_key:
+                    self.__putCachedResponse(cache_key, (objId, cache_key[1]), data, cache_ttl)
+                self.__sendResponse(conn, request_seq, serializer.serializer_id, data,
+                                    protocol.FLAGS_BATCH if wasBatched else 0)
         except Exception as xv:
             msg = getattr(xv, "pyroMsg", None)
             if msg:
@@ -508,6 +633,44 @@ class Daemon(object):
             if isCallback or isinstance(xv, (errors.CommunicationError, errors.SecurityError)):
                 raise  # re-raise if flagged as callback, communication or security error.
 
+    def __sendResponse(self, conn, seq, serializer_id, data, flags):
+        msg = protocol.SendingMessage(protocol.MSG_RESULT, flags, seq, serializer_id, data, annotations=self.__annotations())
+        current_context.response_annotations = {}
+        if config.LOGWIRE:
+            protocol.log_wiredata(log, "daemon wiredata sending", msg)
+        conn.send(msg.data)
+
+    def _sendChunkedResponse(self, conn, seq, serializer, data):
+        """
+        Sends a large list, tuple or dict result as a series of messages that each contain a chunk of its elements
+        (a dict is sent as smaller dicts), so that the full result never has to be serialized in one go.
+        An empty chunk marks the end.
+        """
+        annotations = self.__annotations()
+        current_context.response_annotations = {}
+        chunk_size = max(1, config.RESULT_CHUNK_SIZE)
+        for chunk in self._chunks(data, chunk_size):
+            chunk = serializer.dumps(chunk)
+            msg = protocol.SendingMessage(protocol.MSG_RESULT, protocol.FLAGS_CHUNKED, seq, serializer.serializer_id, chunk,
+                                          annotations=annotations)
+            if config.LOGWIRE:
+                protocol.log_wiredata(log, "daemon wiredata sending", msg)
+            conn.send(msg.data)
+            annotations = None
+
+    @staticmethod
+    def _chunks(data, chunk_size):
+        if type(data) is dict:
+            items = iter(data.items())
+            while True:
+                chunk = dict(itertools.islice(items, chunk_size))
+                yield chunk
+                if not chunk:
+                    return
+        else:
+            for start in range(0, len(data) + chunk_size, chunk_size):
+                yield data[start:start + chunk_size]
+
     def _clientDisconnect(self, conn):
         if config.ITER_STREAM_LINGER > 0:
             # client goes away, keep streams around for a bit longer (allow reconnect)
@@ -657,6 +820,8 @@ class Daemon(object):
                 ser.register_type_replacement(type(obj_or_class), _pyro_obj_to_auto_proxy)
         # register the object/class in the mapping
         self.objectsById[obj_or_class._pyroId] = obj_or_class
+        self.invalidate_cached_responses(objectId)
+        self.invalidate_cached_responses(core.DAEMON_NAME, "get_metadata")
         return self.uriFor(objectId)
 
     def unregister(self, objectOrId):
@@ -677,6 +842,8 @@ class Daemon(object):
             return
         if objectId in self.objectsById:
             del self.objectsById[objectId]
+            self.invalidate_cached_responses(objectId)
+            self.invalidate_cached_responses(core.DAEMON_NAME, "get_metadata")
             if objectOrId is not None:
                 del objectOrId._pyroId
                 del objectOrId._pyroDaemon
@@ -891,7 +1058,7 @@ def _get_exposed_members(obj: Any, only_exposed: bool = True) -> Dict[str, Set[s
     If only_exposed is True, only members tagged with the @expose decorator are
     returned. If it is False, all public members are returned.
     The return value consists of the exposed methods, exposed attributes, and methods
-    tagged as @oneway.
+    tagged as @oneway (and @idempotent and @cacheable, if there are any).
     (All this is used as meta data that Pyro sends to the proxy if it asks for it)
     """
     if not inspect.isclass(obj):
@@ -903,6 +1070,8 @@ def _get_exposed_members(obj: Any, only_exposed: bool = True) -> Dict[str, Set[s
 
     methods = set()  # all methods
     oneway = set()  # oneway methods
+    idempotent = set()  # idempotent methods
+    cacheable = {}  # cacheable methods and attributes, with their ttl
     attrs = set()  # attributes
     for m in dir(obj):      # also lists names inherited from super classes
         if is_private_attribute(m):
@@ -914,10 +1083,16 @@ def _get_exposed_members(obj: Any, only_exposed: bool = True) -> Dict[str, Set[s
                 # check if the method is marked with the 'oneway' decorator:
                 if getattr(v, "_pyroOneway", False):
                     oneway.add(m)
+                if getattr(v, "_pyroIdempotent", False):
+                    idempotent.add(m)
+                if getattr(v, "_pyroCacheable", None):
+                    cacheable[m] = v._pyroCacheable
         elif inspect.isdatadescriptor(v):
             func = getattr(v, "fget", None) or getattr(v, "fset", None) or getattr(v, "fdel", None)
             if func is not None and getattr(func, "_pyroExposed", not only_exposed):
                 attrs.add(m)
+                if getattr(v.fget, "_pyroCacheable", None):
+                    cacheable[m] = v.fget._pyroCacheable
         # Note that we don't expose plain class attributes no matter what.
         # it is a syntax error to add a decorator on them, and it is not possible
         # to give them a _pyroExposed tag either.
@@ -930,6 +1105,11 @@ def _get_exposed_members(obj: Any, only_exposed: bool = True) -> Dict[str, Set[s
         "oneway": oneway,
         "attrs": attrs
     }
+    # the following are only added when used, to keep the metadata small and unchanged for clients that don't know about them
+    if idempotent:
+        result["idempotent"] = idempotent
+    if cacheable:
+        result["cacheable"] = cacheable
     __exposed_member_cache[cache_key] = result
     return result
 
@@ -13,6 +13,8 @@ import select
 import ipaddress
 import weakref
 import contextlib
+import threading
+import collections
 from typing import Union, Optional, Tuple, Dict, Type, Any
 try:
     import ssl
@@ -205,13 +207,15 @@ def create_socket(bind: Union[Tuple, str] = None,
                   connect: Union[Tuple, str] = None,
                   reuseaddr: bool = False, keepalive: bool = True,
                   timeout: Optional[float] = -1, noinherit: bool = False,
-                  ipv6: bool = False, nodelay: bool = True, sslContext: ssl.SSLContext = None) -> socket.socket:
+                  ipv6: bool = False, nodelay: bool = True, sslContext: ssl.SSLContext = None,
+                  sslSession: ssl.SSLSession = None) -> socket.socket:
     """
     Create a socket. Default socket options are keepalive and IPv4 family, and nodelay (nagle disabled).
     If 'bind' or 'connect' is a string, it is assumed a Unix domain socket is requested.
     Otherwise, a normal tcp/ip socket tuple (addr, port, ...) is used.
     Set ipv6=True to create an IPv6 socket rather than IPv4.
     Set ipv6=None to use the PREFER_IP_VERSION config setting.
+    For a client ssl socket, sslSession can be a previous session to resume (see get_ssl_session).
     """
     if bind and connect:
         raise ValueError("bind and connect cannot both be specified at the same time")
@@ -257,9 +261,9 @@ def create_socket(bind: Union[Tuple, str] = None,
         if bind:
             sock = sslContext.wrap_socket(sock, server_side=True)
         elif connect:
-            sock = sslContext.wrap_socket(sock, server_side=False, server_hostname=connect[0])
+            sock = sslContext.wrap_socket(sock, server_side=False, server_hostname=connect[0], session=sslSession)
         else:
-            sock = sslContext.wrap_socket(sock, server_side=False)
+            sock = sslContext.wrap_socket(sock, server_side=False, session=sslSession)
     if nodelay:
         set_nodelay(sock)
     if reuseaddr:
@@ -521,48 +525,114 @@ def interrupt_socket(address: Tuple[str, int]) -> None:
         sock.close()
 
 
-__ssl_server_context = None
-__ssl_client_context = None
+__ssl_contexts = {}     # type: Dict[Tuple, ssl.SSLContext]
+__ssl_sessions = collections.OrderedDict()      # type: collections.OrderedDict[Tuple, ssl.SSLSession]
+__ssl_session_stats = {"new": 0, "reused": 0}
+__ssl_lock = threading.Lock()
+SSL_SESSION_CACHE_SIZE = 256
 
 
 def get_ssl_context(servercert: str = "", serverkey: str = "", clientcert: str = "", clientkey: str = "",
                     cacerts: str = "", keypassword: str = "") -> ssl.SSLContext:
-    """creates an SSL context and caches it, so you have to set the parameters correctly before doing anything"""
-    global __ssl_client_context, __ssl_server_context
-    if servercert:
-        if clientcert:
-            raise ValueError("can't have both server cert and client cert")
-        # server context
-        if __ssl_server_context:
-            return __ssl_server_context
-        if not os.path.isfile(servercert):
-            raise IOError("server cert file not found")
-        if serverkey and not os.path.isfile(serverkey):
-            raise IOError("server key file not found")
-        __ssl_server_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
-        __ssl_server_context.load_cert_chain(servercert, serverkey or None, keypassword or None)    # type: ignore
-        if cacerts:
-            if os.path.isdir(cacerts):
-                __ssl_server_context.load_verify_locations(capath=cacerts)
+    """
+    Creates an SSL context and caches it, so that subsequent connections with the same parameters
+    don't have to load the certificate files again. Contexts are cached per unique set of parameters
+    (including the SSL_REQUIRECLIENTCERT config item for server contexts).
+    """
+    if servercert and clientcert:
+        raise ValueError("can't have both server cert and client cert")
+    key = (servercert, serverkey, clientcert, clientkey, cacerts, keypassword,
+           bool(servercert and config.SSL_REQUIRECLIENTCERT))
+    with __ssl_lock:
+        context = __ssl_contexts.get(key)
+        if context is None:
+            if servercert:
+                context = __create_ssl_server_context(servercert, serverkey, cacerts, keypassword)
             else:
-                __ssl_server_context.load_verify_locations(cafile=cacerts)
-        if config.SSL_REQUIRECLIENTCERT:
-            __ssl_server_context.verify_mode = ssl.CERT_REQUIRED   # 2-way ssl, server+client certs
+                context = __create_ssl_client_context(clientcert, clientkey, cacerts, keypassword)
+            __ssl_contexts[key] = context
+        return context
+
+
+def __create_ssl_server_context(servercert: str, serverkey: str, cacerts: str, keypassword: str) -> ssl.SSLContext:
+    if not os.path.isfile(servercert):
+        raise IOError("server cert file not found")
+    if serverkey and not os.path.isfile(serverkey):
+        raise IOError("server key file not found")
+    context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    context.load_cert_chain(servercert, serverkey or None, keypassword or None)    # type: ignore
+    if cacerts:
+        if os.path.isdir(cacerts):
+            context.load_verify_locations(capath=cacerts)
         else:
-            __ssl_server_context.verify_mode = ssl.CERT_NONE   # 1-way ssl, server cert only
-        return __ssl_server_context
+            context.load_verify_locations(cafile=cacerts)
+    if config.SSL_REQUIRECLIENTCERT:
+        context.verify_mode = ssl.CERT_REQUIRED   # 2-way ssl, server+client certs
     else:
-        # client context
-        if __ssl_client_context:
-            return __ssl_client_context
-        __ssl_client_context = ssl.create_default_context(ssl.Purpose.SERVER_AUTH)
-        if clientcert:
-            if not os.path.isfile(clientcert):
-                raise IOError("client cert file not found")
-            __ssl_client_context.load_cert_chain(clientcert, clientkey or None, keypassword or None)    # type: ignore
-        if cacerts:
-            if os.path.isdir(cacerts):
-                __ssl_client_context.load_verify_locations(capath=cacerts)
-            else:
-                __ssl_client_context.load_verify_locations(cafile=cacerts)
-        return __ssl_client_context
+        context.verify_mode = ssl.CERT_NONE   # 1-way ssl, server cert only
+    return context
+
+
+def __create_ssl_client_context(clientcert: str, clientkey: str, cacerts: str, keypassword: str) -> ssl.SSLContext:
+    context = ssl.create_default_context(ssl.Purpose.SERVER_AUTH)
+    if clientcert:
+        if not os.path.isfile(clientcert):
+            raise IOError("client cert file not found")
+        context.load_cert_chain(clientcert, clientkey or None, keypassword or None)    # type: ignore
+    if cacerts:
+        if os.path.isdir(cacerts):
+            context.load_verify_locations(capath=cacerts)
+        else:
+            context.load_verify_locations(cafile=cacerts)
+    return context
+
+
+def get_ssl_session(context: ssl.SSLContext, location: Union[Tuple, str]) -> Optional[ssl.SSLSession]:
+    """Returns the stored TLS session for the given client context and server location, if any."""
+    with __ssl_lock:
+        session = __ssl_sessions.get((context, location))
+        if session is not None:
+            __ssl_sessions.move_to_end((context, location))
+        return session
+
+
+def store_ssl_session(context: ssl.SSLContext, location: Union[Tuple, str], sock: socket.socket) -> None:
+    """
+    Remembers the TLS session of a connected client ssl socket, so that the next connection to the
+    same location can resume it. Also updates the session statistics.
+    Call this after some data has been received from the server: with TLS 1.3 the session ticket
+    is only sent by the server after the handshake has completed.
+    """
+    session = getattr(sock, "session", None)
+    if session is None:
+        return
+    with __ssl_lock:
+        if sock.session_reused:     # type: ignore
+            __ssl_session_stats["reused"] += 1
+        else:
+            __ssl_session_stats["new"] += 1
+        __ssl_sessions[(context, location)] = session
+        __ssl_sessions.move_to_end((context, location))
+        while len(__ssl_sessions) > SSL_SESSION_CACHE_SIZE:
+            __ssl_sessions.popitem(last=False)
+
+
+def ssl_session_stats() -> Dict[str, Any]:
+    """
+    Returns the client side TLS session counters: the number of connections that had to do
+    a full handshake ('new'), the number that resumed a previous session ('reused'),
+    and the resulting 'hit_rate'.
+    """
+    with __ssl_lock:
+        stats = dict(__ssl_session_stats)    # type: Dict[str, Any]
+    total = stats["new"] + stats["reused"]
+    stats["hit_rate"] = stats["reused"] / total if total else 0.0
+    return stats
+
+
+def clear_ssl_cache() -> None:
+    """Forgets all cached ssl contexts and sessions (for instance after the certificate files have been replaced)"""
+    with __ssl_lock:
+        __ssl_contexts.clear()
+        __ssl_sessions.clear()
+        __ssl_session_stats["new"] = __ssl_session_stats["reused"] = 0
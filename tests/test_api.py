@@ -13,10 +13,15 @@ def test_api():
     assert Pyro5.api.config.SERIALIZER == "serpent"
     assert Pyro5.api.URI is Pyro5.core.URI
     assert Pyro5.api.Proxy is Pyro5.client.Proxy
+    assert Pyro5.api.BalancingProxy is Pyro5.client.BalancingProxy
+    assert Pyro5.api.RetryPolicy is Pyro5.client.RetryPolicy
     assert Pyro5.api.Daemon is Pyro5.server.Daemon
+    assert Pyro5.api.cache_serialized is Pyro5.server.cache_serialized
     assert Pyro5.api.start_ns is Pyro5.nameserver.start_ns
     assert Pyro5.api.current_context is Pyro5.callcontext.current_context
     assert Pyro5.api.register_dict_to_class == SerializerBase.register_dict_to_class
     assert Pyro5.api.register_class_to_dict == SerializerBase.register_class_to_dict
     assert Pyro5.api.unregister_dict_to_class == SerializerBase.unregister_dict_to_class
     assert Pyro5.api.unregister_class_to_dict == SerializerBase.unregister_class_to_dict
+    assert Pyro5.api.register_schema == SerializerBase.register_schema
+    assert Pyro5.api.unregister_schema == SerializerBase.unregister_schema
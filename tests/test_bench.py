@@ -0,0 +1,48 @@
+"""
+Tests for the benchmark suite.
+
+Pyro - Python Remote Objects.  Copyright by Irmen de Jong (irmen@razorvine.net).
+"""
+
+import json
+import Pyro5.bench
+from Pyro5 import config
+
+
+class TestBench:
+    def testMeasure(self):
+        calls = []
+        usec = Pyro5.bench.measure(lambda: calls.append(1), 0.001)
+        assert usec > 0
+        assert len(calls) > 1
+
+    def testSerializers(self):
+        results = Pyro5.bench.bench_serializers(0.0001, ["serpent", "marshal"])
+        assert set(results) == {"serpent", "marshal"}
+        assert set(results["serpent"]) == set(Pyro5.bench.payloads())
+        small = results["serpent"]["small"]
+        assert set(small) == {"size", "dumps", "loads", "dumpsCall", "loadsCall"}
+        assert small["size"] > 0
+
+    def testProtocol(self):
+        compression = config.COMPRESSION
+        results = Pyro5.bench.bench_protocol(0.0001)
+        assert config.COMPRESSION == compression
+        assert len(results) == 8
+        assert results["100000_compressed"]["size"] < results["100000"]["size"]
+        assert results["100_annotations"]["size"] > results["100"]["size"]
+
+    def testRoundtrips(self):
+        servertype = config.SERVERTYPE
+        results = Pyro5.bench.bench_roundtrips(0.0001, ["json"], servertypes=["multiplex"])
+        assert config.SERVERTYPE == servertype
+        assert set(results["multiplex"]["json"]) == {"connect", "echo_small", "echo_records", "oneway"}
+
+    def testMainOutputsJson(self, capsys):
+        Pyro5.bench.main(["-t", "0.0001", "-s", "marshal", "-g", "serializers", "-g", "protocol"])
+        results = json.loads(capsys.readouterr().out)
+        assert results["pyro_version"] == Pyro5.__version__
+        assert results["unit"] == "usec"
+        assert set(results["serializers"]) == {"marshal"}
+        assert "protocol" in results
+        assert "roundtrips" not in results
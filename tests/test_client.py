@@ -316,3 +316,156 @@ class TestRemoteMethod:
         assert list(results) == ['INVOKED foo args=(3,) kwargs={}', 'INVOKED foo args=(4,) kwargs={}']
         results = batch()
         assert len(list(results)) == 0
+
+    def testRetriesWithBackoff(self):
+        calls = []
+
+        def send(name, args, kwargs):
+            calls.append(time.time())
+            if len(calls) < 3:
+                raise Pyro5.errors.ConnectionClosedError("closed")
+            return "ok"
+
+        policy = Pyro5.client.RetryPolicy(initial_delay=0.05, max_delay=1.0, jitter=0.0)
+        method = Pyro5.client._RemoteMethod(send, "method", 5, policy)
+        assert method() == "ok"
+        assert len(calls) == 3
+        assert calls[1] - calls[0] >= 0.05
+        assert calls[2] - calls[1] >= 0.1
+        calls.clear()
+        method = Pyro5.client._RemoteMethod(send, "method", 1, policy)
+        with pytest.raises(Pyro5.errors.ConnectionClosedError):
+            method()
+        assert len(calls) == 2
+
+    def testRetryBudget(self):
+        calls = []
+
+        def send(name, args, kwargs):
+            calls.append(name)
+            raise Pyro5.errors.TimeoutError("timeout")
+
+        policy = Pyro5.client.RetryPolicy(initial_delay=0.0, max_delay=0.0, budget_ratio=0.5, budget_max=2)
+        method = Pyro5.client._RemoteMethod(send, "method", 10, policy)
+        with pytest.raises(Pyro5.errors.TimeoutError):
+            method()
+        assert len(calls) == 3    # first call + 2 retries from the budget
+        calls.clear()
+        with pytest.raises(Pyro5.errors.TimeoutError):
+            method()
+        assert len(calls) == 1    # budget is exhausted: no retries
+        calls.clear()
+        with pytest.raises(Pyro5.errors.TimeoutError):
+            method()
+        assert len(calls) == 2    # two calls replenished one token
+
+    def testRetryDeadline(self):
+        calls = []
+
+        def send(name, args, kwargs):
+            calls.append(name)
+            raise Pyro5.errors.ConnectionClosedError("closed")
+
+        policy = Pyro5.client.RetryPolicy(initial_delay=0.2, max_delay=0.2, jitter=0.0, deadline=0.3)
+        method = Pyro5.client._RemoteMethod(send, "method", 10, policy)
+        start = time.time()
+        with pytest.raises(Pyro5.errors.ConnectionClosedError):
+            method()
+        assert len(calls) == 2
+        assert time.time() - start < 0.4
+
+
+class TestRetryPolicy:
+    def testBackoff(self):
+        policy = Pyro5.client.RetryPolicy(initial_delay=0.1, max_delay=1.0, multiplier=2.0, jitter=0.0)
+        assert [policy.backoff(attempt) for attempt in range(6)] == pytest.approx([0.1, 0.2, 0.4, 0.8, 1.0, 1.0])
+        assert policy.backoff(1000) == 1.0
+        policy = Pyro5.client.RetryPolicy(initial_delay=0.1, max_delay=1.0, jitter=0.5)
+        for _ in range(100):
+            assert 0.1 <= policy.backoff(1) <= 0.2
+
+    def testInvalid(self):
+        with pytest.raises(ValueError):
+            Pyro5.client.RetryPolicy(initial_delay=-1)
+        with pytest.raises(ValueError):
+            Pyro5.client.RetryPolicy(initial_delay=2, max_delay=1)
+        with pytest.raises(ValueError):
+            Pyro5.client.RetryPolicy(jitter=2)
+
+    def testBudget(self):
+        policy = Pyro5.client.RetryPolicy(budget_ratio=0.5, budget_max=1)
+        assert policy.withdraw()
+        assert not policy.withdraw()
+        policy.deposit()
+        assert not policy.withdraw()
+        policy.deposit()
+        assert policy.withdraw()
+
+    def testProxyPolicy(self):
+        with Pyro5.client.Proxy("PYRO:obj@localhost:5555") as p:
+            assert p._pyroRetryPolicy is Pyro5.client.default_retry_policy
+            policy = Pyro5.client.RetryPolicy()
+            p._pyroRetryPolicy = policy
+            assert copy.copy(p)._pyroRetryPolicy is policy
+
+    def testEndpointFailFast(self):
+        policy = Pyro5.client.RetryPolicy(initial_delay=0.5, max_delay=0.5, jitter=0.0)
+        states = Pyro5.client._EndpointStates()
+        location = ("localhost", 5555)
+        states.check(location)
+        states.failed(location, policy)
+        with pytest.raises(Pyro5.errors.CommunicationError) as x:
+            states.check(location)
+        assert "unreachable" in str(x.value)
+        assert 0.4 < x.value.retry_after <= 0.5
+        states.check(("localhost", 5556))
+        states.states[location][1] = 0.0    # backoff delay has passed
+        states.check(location)
+        states.check(location)              # checking doesn't postpone the next attempt
+        states.succeeded(location)
+        states.check(location)
+
+    def testEndpointStatesBounded(self):
+        policy = Pyro5.client.RetryPolicy(initial_delay=10, max_delay=10)
+        states = Pyro5.client._EndpointStates()
+        states.max_locations = 5
+        for port in range(10):
+            states.failed(("localhost", port), policy)
+        assert len(states.states) == 5
+        assert ("localhost", 9) in states.states
+        assert ("localhost", 0) not in states.states
+        states.states[("localhost", 9)][1] = 0.0   # expired entries are removed first
+        states.failed(("localhost", 10), policy)
+        assert ("localhost", 9) not in states.states
+        assert ("localhost", 5) in states.states
+
+    def testProxyFailFast(self):
+        with Pyro5.client.Proxy("PYRO:obj@localhost:1") as p:
+            p._pyroRetryPolicy = Pyro5.client.RetryPolicy(initial_delay=10, max_delay=10)
+            try:
+                with pytest.raises(Pyro5.errors.CommunicationError) as x:
+                    p._pyroBind()
+                assert "unreachable" not in str(x.value)
+                with Pyro5.client.Proxy("PYRO:other@localhost:1") as p2:
+                    p2._pyroRetryPolicy = p._pyroRetryPolicy
+                    with pytest.raises(Pyro5.errors.CommunicationError) as x:
+                        p2._pyroBind()
+                    assert "unreachable" in str(x.value)
+                    assert Pyro5.client.endpoint_states.states[("localhost", 1)][0] == 1   # fail fast isn't a failure
+            finally:
+                Pyro5.client.endpoint_states.clear()
+
+    def testReconnectWaitsForBackoff(self):
+        location = ("localhost", 1)
+        Pyro5.client.endpoint_states.failed(location, Pyro5.client.RetryPolicy(initial_delay=0.3, max_delay=0.3, jitter=0.0))
+        try:
+            with Pyro5.client.Proxy("PYRO:obj@localhost:1") as p:
+                p._pyroRetryPolicy = Pyro5.client.RetryPolicy(initial_delay=0.01, max_delay=0.01)
+                start = time.time()
+                with pytest.raises(Pyro5.errors.ConnectionClosedError):
+                    p._pyroReconnect(tries=1)
+                # waited for the backoff delay and then made one real connection attempt
+                assert time.time() - start >= 0.25
+                assert Pyro5.client.endpoint_states.states[location][0] == 2
+        finally:
+            Pyro5.client.endpoint_states.clear()
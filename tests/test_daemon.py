@@ -423,6 +423,23 @@ class TestDaemon:
             data = ser.loads(msg.data)
             assert data["handshake"] == ["sure", "have", "fun"]
 
+    def testCustomHandshakeNotCached(self):
+        responses = [1, 1.0, True, "client4"]
+
+        class CustomHandshakeDaemon(Pyro5.server.Daemon):
+            def validateHandshake(self, conn, data):
+                return responses.pop(0)
+        with CustomHandshakeDaemon(port=0) as d:
+            for expected in [1, 1.0, True, "client4"]:
+                conn = ConnectionMock()
+                self.sendHandshakeMessage(conn)
+                assert d._handshake(conn)
+                msg = Pyro5.protocol.recv_stub(conn)
+                data = Pyro5.serializers.serializers_by_id[msg.serializer_id].loads(msg.data)
+                assert data["handshake"] == expected
+                assert type(data["handshake"]) is type(expected)
+            assert not any(key[0] == "handshake" for key in d._Daemon__cachedResponses.entries)
+
     def testNAT(self):
         with Pyro5.server.Daemon() as d:
             assert d.natLocationStr is None
@@ -7,15 +7,23 @@ Pyro - Python Remote Objects.  Copyright by Irmen de Jong (irmen@razorvine.net).
 import time
 import pytest
 import threading
+import collections
 import os
+import socket
+import stat
+import subprocess
 import sys
+import json
+import shutil
+import tempfile
 from io import StringIO
 import Pyro5.core
 import Pyro5.client
 import Pyro5.nsc
+import Pyro5.serializers
 import Pyro5.nameserver
 import Pyro5.socketutil
-from Pyro5.errors import CommunicationError, NamingError, PyroError
+from Pyro5.errors import CommunicationError, NamingError, PyroError, ProtocolError
 from Pyro5 import config
 
 
@@ -107,6 +115,158 @@ class TestNameServer:
         assert ns.lookup("unittest.object3") == Pyro5.core.URI("PYRO:66666@host.com:4444")
         ns._pyroRelease()
 
+    def testLocateCache(self):
+        cachedir = tempfile.mkdtemp()
+        cachefile = os.path.join(cachedir, "ns-location.json")
+        config.NS_LOCATION_CACHE = cachefile
+        original_parallel = Pyro5.core._locate_ns_parallel
+
+        def fail(probes):
+            raise CommunicationError("no probes allowed")
+
+        try:
+            with Pyro5.core.locate_ns() as ns:
+                uri = str(ns._pyroUri)
+            with open(cachefile) as f:
+                assert json.load(f)["uri"] == uri
+            Pyro5.core._locate_ns_parallel = fail
+            with Pyro5.core.locate_ns() as ns:
+                assert str(ns._pyroUri) == uri      # came from the cache
+            with pytest.raises(NamingError):
+                Pyro5.core.locate_ns(broadcast=False)     # other lookup parameters, not cached
+            config.NS_LOCATION_CACHE_TTL = 0
+            with pytest.raises(NamingError):
+                Pyro5.core.locate_ns()
+            config.NS_LOCATION_CACHE_TTL = 60.0
+            # a cached location where the name server isn't running anymore is discarded
+            with open(cachefile) as f:
+                cached = json.load(f)
+            cached["uri"] = "PYRO:Pyro.NameServer@%s:1" % self.nsUri.host
+            with open(cachefile, "w") as f:
+                json.dump(cached, f)
+            with pytest.raises(NamingError):
+                Pyro5.core.locate_ns()
+            assert not os.path.exists(cachefile)
+            Pyro5.core._locate_ns_parallel = original_parallel
+            with Pyro5.core.locate_ns() as ns:
+                assert str(ns._pyroUri) == uri
+            assert os.path.exists(cachefile)
+        finally:
+            Pyro5.core._locate_ns_parallel = original_parallel
+            config.NS_LOCATION_CACHE = ""
+            config.NS_LOCATION_CACHE_TTL = 60.0
+            shutil.rmtree(cachedir)
+
+    def testLocateParallel(self):
+        def slow():
+            time.sleep(0.5)
+            return Pyro5.client.Proxy("PYRO:slow@localhost:9999")
+
+        def fail():
+            raise CommunicationError("failed")
+
+        start = time.time()
+        proxy = Pyro5.core._locate_ns_parallel([slow, fail, lambda: Pyro5.client.Proxy("PYRO:fast@localhost:9999"), fail])
+        assert proxy._pyroUri.object == "fast"
+        assert time.time() - start < 0.4
+        proxy._pyroRelease()     # must not complain that another thread owns it
+        with pytest.raises(CommunicationError):
+            Pyro5.core._locate_ns_parallel([fail, fail])
+
+    def testBroadcastResponses(self):
+        response = self.bcserver.response("127.0.0.1")
+        assert Pyro5.core.URI(response.decode("iso-8859-1")) == self.nsUri
+        assert self.bcserver.response("127.0.0.1") is response
+        assert self.bcserver.responses == {"127.0.0.1": response}
+
+    def testBulkRemote(self):
+        with Pyro5.core.locate_ns(self.nsUri.host, config.NS_PORT) as ns:
+            result = ns.register_many({"unittest.bulk1": "PYRO:bulk1@host.com:4444",
+                                       "unittest.bulk2": ("PYRO:bulk2@host.com:4444", ["tag"]),
+                                       "unittest.bulk3": 5555})
+            assert result["unittest.bulk1"] is None
+            assert result["unittest.bulk2"] is None
+            assert isinstance(result["unittest.bulk3"], TypeError)
+            result = ns.lookup_many(["unittest.bulk1", "unittest.bulk2", "unittest.bulk3"], return_metadata=True)
+            uri, metadata = result["unittest.bulk1"]
+            assert uri == Pyro5.core.URI("PYRO:bulk1@host.com:4444")
+            assert not metadata
+            uri, metadata = result["unittest.bulk2"]
+            assert uri == Pyro5.core.URI("PYRO:bulk2@host.com:4444")
+            assert set(metadata) == {"tag"}
+            assert isinstance(result["unittest.bulk3"], NamingError)
+
+    def testListIterRemote(self):
+        with Pyro5.core.locate_ns(self.nsUri.host, config.NS_PORT) as ns:
+            ns.register_many({"unittest.iter%02d" % i: "PYRO:iter@host.com:4444" for i in range(30)})
+            result = ns.list_iter(prefix="unittest.iter", page_size=7)
+            assert not isinstance(result, list)
+            assert [name for name, uri in result] == ["unittest.iter%02d" % i for i in range(30)]
+            page, cursor = ns.list_page(prefix="unittest.iter", limit=20)
+            assert len(page) == 20
+            assert cursor == "unittest.iter19"
+
+    def testNSCWithoutStreaming(self):
+        oldstdout = sys.stdout
+        config.ITER_STREAMING = False
+        try:
+            with Pyro5.core.locate_ns(self.nsUri.host, config.NS_PORT) as ns:
+                ns.register("unittest.nsc1", "PYRO:nsc1@host.com:4444", metadata={"nsctag"})
+                ns.register("unittest.nsc2", "PYRO:nsc2@host.com:4444")
+                with pytest.raises(ProtocolError):
+                    ns.list_iter(prefix="unittest.nsc")
+                sys.stdout = StringIO()
+                Pyro5.nsc.handle_command(ns, "list", ["unittest.nsc"])
+                Pyro5.nsc.handle_command(ns, "listmatching", ["unittest.nsc.$"])
+                Pyro5.nsc.handle_command(ns, "yplookup_any", ["nsctag"])
+                output = sys.stdout.getvalue()
+        finally:
+            sys.stdout = oldstdout
+            config.ITER_STREAMING = True
+        assert output.count("unittest.nsc1 --> PYRO:nsc1@host.com:4444") == 3
+        assert output.count("unittest.nsc2 --> PYRO:nsc2@host.com:4444") == 2
+        assert output.index("unittest.nsc1") < output.index("unittest.nsc2")
+
+    def testNSCOlderNameServer(self):
+        class OlderNameServer(Pyro5.nameserver.NameServer):
+            list_iter = None        # older name servers don't have these methods
+            yplookup_iter = None
+        oldstdout = sys.stdout
+        older_ns = OlderNameServer()
+        older_ns.register("unittest.old1", "PYRO:old1@host.com:4444", metadata={"oldtag"})
+        older_ns.register("unittest.old2", "PYRO:old2@host.com:4444")
+        uri = self.nameserver.register(older_ns, "unittest.older_ns")
+        try:
+            with Pyro5.client.Proxy(uri) as ns:
+                sys.stdout = StringIO()
+                Pyro5.nsc.handle_command(ns, "list", ["unittest.old"])
+                Pyro5.nsc.handle_command(ns, "listmatching", ["unittest.old.$"])
+                Pyro5.nsc.handle_command(ns, "yplookup_all", ["oldtag"])
+                output = sys.stdout.getvalue()
+        finally:
+            sys.stdout = oldstdout
+            self.nameserver.unregister(older_ns)
+            older_ns.storage.close()
+        assert output.count("unittest.old1 --> PYRO:old1@host.com:4444") == 3
+        assert output.count("unittest.old2 --> PYRO:old2@host.com:4444") == 2
+
+    @pytest.mark.parametrize("serializer", ["json", "msgpack"])
+    def testMetadataOtherSerializers(self, serializer):
+        if serializer not in Pyro5.serializers.serializers:
+            pytest.skip(serializer + " is not available")
+        with Pyro5.core.locate_ns(self.nsUri.host, config.NS_PORT) as ns:
+            ns._pyroSerializer = serializer
+            ns.register("unittest.meta1", "PYRO:meta1@host.com:4444", metadata={"tag1", "tag2"})
+            ns.register("unittest.meta2", "PYRO:meta2@host.com:4444")
+            uri, metadata = ns.lookup("unittest.meta1", return_metadata=True)
+            assert set(metadata) == {"tag1", "tag2"}
+            result = ns.list(prefix="unittest.meta", return_metadata=True)
+            assert set(result["unittest.meta1"][1]) == {"tag1", "tag2"}
+            assert not result["unittest.meta2"][1]
+            assert set(ns.yplookup(meta_all={"tag1"})) == {"unittest.meta1"}
+            assert [name for name, _ in ns.list_iter(prefix="unittest.meta", return_metadata=True)] == ["unittest.meta1", "unittest.meta2"]
+            assert ns.replication_changes(-1, 0)[2]
+
     def testDaemonPyroObj(self):
         uri = self.nsUri
         uri.object = Pyro5.core.DAEMON_NAME
@@ -464,6 +624,15 @@ class TestOfflineNameServer:
             assert sys.stdout.getvalue().endswith("Nothing removed\n")
             Pyro5.nsc.handle_command(ns, "listmatching", ["name.$"])
             assert "name1 --> PYRO:obj1@hostname:9999" in sys.stdout.getvalue()
+            Pyro5.nsc.handle_command(ns, "register", ["name1", "PYRO:obj1@hostname:9999", "name2", "PYRO:obj2@hostname:9999"])
+            assert "Not registered name1: name already registered: name1\n" in sys.stdout.getvalue()
+            assert sys.stdout.getvalue().endswith("Registered name2\n")
+            Pyro5.nsc.handle_command(ns, "lookup", ["name1", "name2", "name3"])
+            output = sys.stdout.getvalue()
+            assert "name1 --> PYRO:obj1@hostname:9999\nname2 --> PYRO:obj2@hostname:9999\n" in output
+            assert output.endswith("name3 --> Error: unknown name: name3\n")
+            with pytest.raises(SystemExit):
+                Pyro5.nsc.handle_command(ns, "register", ["name1", "PYRO:obj1@hostname:9999", "name2"])
             # Pyro5.nsc.handle_command(ns, None, ["removematching", "name.?"])  #  can't be tested, required user input
         finally:
             sys.stdout = oldstdout
@@ -596,6 +765,211 @@ class TestOfflineNameServer:
             assert meta == set()
         ns.set_metadata("meta1", set())
 
+    def testIndexesFollowChanges(self):
+        ns = Pyro5.nameserver.NameServer(storageProvider=self.storageProvider)
+        self.clearStorage()
+        ns.register("app.a", "PYRO:a@host:555", metadata={"red", "round"})
+        ns.register("app.b", "PYRO:b@host:555", metadata={"red"})
+        ns.register("application", "PYRO:c@host:555", metadata={"blue"})
+        ns.register("other", "PYRO:d@host:555")
+        assert set(ns.list(prefix="app.")) == {"app.a", "app.b"}
+        assert set(ns.list(prefix="app")) == {"app.a", "app.b", "application"}
+        assert set(ns.yplookup(meta_all={"red", "round"})) == {"app.a"}
+        assert set(ns.yplookup(meta_any={"round", "blue"})) == {"app.a", "application"}
+        ns.set_metadata("app.a", {"blue"})
+        ns.register("app.b", "PYRO:b2@host:555", metadata={"round"})
+        assert ns.yplookup(meta_all={"red"}) == {}
+        assert ns.yplookup(meta_any={"round"}, return_metadata=False) == {"app.b": "PYRO:b2@host:555"}
+        assert set(ns.yplookup(meta_all={"blue"})) == {"app.a", "application"}
+        assert ns.remove(prefix="app.") == 2
+        assert set(ns.list(prefix="app")) == {"application"}
+        assert set(ns.yplookup(meta_any={"blue", "round"})) == {"application"}
+        ns.remove("application")
+        assert ns.list(prefix="app") == {}
+        assert ns.yplookup(meta_any={"blue"}) == {}
+        ns.storage.close()
+
+    def testBulkOperations(self):
+        ns = Pyro5.nameserver.NameServer(storageProvider=self.storageProvider)
+        self.clearStorage()
+        ns.register("existing", "PYRO:existing@host:555", metadata={"old"})
+        result = ns.register_many({
+            "one": "PYRO:one@host:555",
+            "two": ("PYRO:two@host:555", {"a", "b"}),
+            "existing": "PYRO:other@host:555",
+            "invalid": "THISVALUEISNOTANURI",
+            "badmeta": ("PYRO:badmeta@host:555", "abc"),
+            "badtuple": ("PYRO:badtuple@host:555", {"a"}, "extra"),
+        }, safe=True)
+        assert result["one"] is None
+        assert result["two"] is None
+        assert isinstance(result["existing"], NamingError)
+        assert isinstance(result["invalid"], PyroError)
+        assert isinstance(result["badmeta"], TypeError)
+        assert isinstance(result["badtuple"], ValueError)
+        assert ns.count() == 3
+        assert ns.lookup("existing") == Pyro5.core.URI("PYRO:existing@host:555")
+        result = ns.lookup_many(["one", "two", "existing", "unknown"])
+        assert result["one"] == Pyro5.core.URI("PYRO:one@host:555")
+        assert result["two"] == Pyro5.core.URI("PYRO:two@host:555")
+        assert isinstance(result["unknown"], NamingError)
+        result = ns.lookup_many(["two"], return_metadata=True)
+        assert result == {"two": (Pyro5.core.URI("PYRO:two@host:555"), {"a", "b"})}
+        result = ns.set_metadata_many({"one": {"x"}, "two": None, "unknown": {"y"}, "existing": "abc"})
+        assert result["one"] is None
+        assert result["two"] is None
+        assert isinstance(result["unknown"], NamingError)
+        assert isinstance(result["existing"], TypeError)
+        assert ns.lookup("one", return_metadata=True)[1] == {"x"}
+        assert ns.lookup("two", return_metadata=True)[1] == set()
+        assert ns.lookup("existing", return_metadata=True)[1] == {"old"}
+        assert ns.yplookup(meta_any={"x", "a", "b"}, return_metadata=False) == {"one": "PYRO:one@host:555"}
+        result = ns.register_many({"existing": ("PYRO:other@host:555", ["new"])})
+        assert result == {"existing": None}
+        assert ns.lookup("existing", return_metadata=True) == (Pyro5.core.URI("PYRO:other@host:555"), {"new"})
+        assert ns.register_many({}) == {}
+        assert ns.lookup_many([]) == {}
+        ns.storage.close()
+
+    def testChangesSince(self):
+        ns = Pyro5.nameserver.NameServer(storageProvider=self.storageProvider)
+        self.clearStorage()
+        r = ns.current_revision()
+        assert r > 0
+        assert ns.changes_since(r) == (r, [])
+        assert ns.changes_since(0) == (r, None)    # not a revision of this name server
+        ns.register("app.one", "PYRO:one@host:555")
+        ns.register_many({"app.two": "PYRO:two@host:555", "other": "PYRO:other@host:555"})
+        assert ns.current_revision() == r + 2
+        assert ns.changes_since(r) == (r + 2, ["app.one", "app.two", "other"])
+        assert ns.changes_since(r + 1) == (r + 2, ["app.two", "other"])
+        assert ns.changes_since(r, prefix="app.") == (r + 2, ["app.one", "app.two"])
+        assert ns.changes_since(r + 2) == (r + 2, [])
+        assert ns.changes_since(r + 3) == (r + 2, None)
+        ns.set_metadata("other", {"tag"})
+        ns.set_metadata_many({"app.one": {"tag"}, "unknown": {"tag"}})
+        ns.remove("app.two")
+        assert ns.changes_since(r + 2) == (r + 5, ["app.one", "app.two", "other"])
+        assert ns.remove(prefix="app.") == 1
+        assert ns.remove(prefix="app.") == 0
+        ns.register_many({"invalid": 42})
+        assert ns.changes_since(r + 5) == (r + 6, ["app.one"])
+        ns.storage.close()
+
+    def testChangesDropped(self):
+        ns = Pyro5.nameserver.NameServer(storageProvider=self.storageProvider)
+        self.clearStorage()
+        ns.changes = collections.deque(maxlen=3)
+        r = ns.current_revision()
+        ns.register_many({"a": "PYRO:a@host:555", "b": "PYRO:b@host:555"})
+        ns.register("c", "PYRO:c@host:555")
+        assert ns.changes_since(r) == (r + 2, ["a", "b", "c"])
+        ns.register("d", "PYRO:d@host:555")
+        assert ns.changes_since(r) == (r + 3, None)
+        assert ns.changes_since(r + 1) == (r + 3, ["c", "d"])
+        ns.register("e", "PYRO:e@host:555")
+        assert ns.changes_since(r + 1) == (r + 4, ["c", "d", "e"])
+        ns.register("f", "PYRO:f@host:555")
+        assert ns.changes_since(r + 1) == (r + 5, None)
+        assert ns.changes_since(r + 2) == (r + 5, ["d", "e", "f"])
+        ns.storage.close()
+
+    def testWatch(self):
+        ns = Pyro5.nameserver.NameServer(storageProvider=self.storageProvider)
+        self.clearStorage()
+        r = ns.current_revision()
+        ns.register("other", "PYRO:other@host:555")
+        assert ns.watch(revision=r, timeout=1) == (r + 1, ["other"])
+        start = time.time()
+        assert ns.watch("app.", r + 1, timeout=0.1) == (r + 1, [])
+        assert time.time() - start >= 0.1
+        assert ns.watch(revision=r + 99) == (r + 1, None)
+
+        def change():
+            time.sleep(0.1)
+            ns.register("other2", "PYRO:other2@host:555")
+            time.sleep(0.1)
+            ns.register("app.one", "PYRO:one@host:555")
+        thread = threading.Thread(target=change)
+        thread.start()
+        start = time.time()
+        assert ns.watch("app.", r + 1, timeout=5) == (r + 3, ["app.one"])
+        assert time.time() - start < 4
+        thread.join()
+        ns.storage.close()
+
+    def testPaging(self):
+        ns = Pyro5.nameserver.NameServer(storageProvider=self.storageProvider)
+        self.clearStorage()
+        ns.register_many({"test.%02d" % i: ("PYRO:obj%d@host:555" % i, ["odd" if i % 2 else "even", "tag"]) for i in range(25)})
+        ns.register("other", "PYRO:other@host:555")
+        page, cursor = ns.list_page(prefix="test.", limit=10)
+        assert list(page) == ["test.%02d" % i for i in range(10)]
+        assert page["test.03"] == "PYRO:obj3@host:555"
+        assert cursor == "test.09"
+        page, cursor = ns.list_page(prefix="test.", cursor=cursor, limit=10, return_metadata=True)
+        assert list(page) == ["test.%02d" % i for i in range(10, 20)]
+        assert page["test.11"][0] == "PYRO:obj11@host:555"
+        assert set(page["test.11"][1]) == {"odd", "tag"}
+        page, cursor = ns.list_page(prefix="test.", cursor=cursor, limit=10)
+        assert list(page) == ["test.%02d" % i for i in range(20, 25)]
+        assert cursor is None
+        page, cursor = ns.list_page(limit=25)
+        assert len(page) == 25
+        assert cursor == "test.23"
+        assert ns.list_page(cursor=cursor, limit=25) == ({"test.24": "PYRO:obj24@host:555"}, None)
+        assert ns.list_page(prefix="nothing") == ({}, None)
+        page, cursor = ns.list_page(regex=r"test\.1.", limit=8)
+        assert list(page) == ["test.%02d" % i for i in range(10, 18)]
+        assert ns.list_page(regex=r"test\.1.", limit=8, cursor=cursor) == ({"test.18": "PYRO:obj18@host:555", "test.19": "PYRO:obj19@host:555"}, None)
+        page, cursor = ns.yplookup_page(meta_all={"odd", "tag"}, return_metadata=False, limit=5)
+        assert list(page) == ["test.01", "test.03", "test.05", "test.07", "test.09"]
+        page, cursor = ns.yplookup_page(meta_all={"odd", "tag"}, return_metadata=False, limit=5, cursor=cursor)
+        assert list(page) == ["test.11", "test.13", "test.15", "test.17", "test.19"]
+        page, cursor = ns.yplookup_page(meta_all={"odd", "tag"}, return_metadata=False, limit=5, cursor=cursor)
+        assert list(page) == ["test.21", "test.23"]
+        assert cursor is None
+        assert [name for name, uri in ns.list_iter(prefix="test.", page_size=7)] == ["test.%02d" % i for i in range(25)]
+        assert list(ns.list_iter(prefix="other", return_metadata=True)) == [("other", ("PYRO:other@host:555", ns.lookup("other", True)[1]))]
+        assert [name for name, (uri, meta) in ns.yplookup_iter(meta_any={"even"}, page_size=4)] == ["test.%02d" % i for i in range(0, 25, 2)]
+        # a regex listing is matched a page at a time, a metadata search is done only once
+        original_list, original_yplookup, original_everything = ns.list, ns.yplookup, ns.storage.everything
+        calls = []
+        ns.list = lambda *args: calls.append("list") or original_list(*args)
+        ns.yplookup = lambda *args: calls.append("yplookup") or original_yplookup(*args)
+        ns.storage.everything = lambda *args: calls.append("everything") or original_everything(*args)
+        result = ns.list_iter(regex=r"test\.1.", page_size=3)
+        assert next(result) == ("test.10", "PYRO:obj10@host:555")
+        assert [name for name, uri in result] == ["test.%02d" % i for i in range(11, 20)]
+        assert len(list(ns.yplookup_iter(meta_any={"odd"}, page_size=2))) == 12
+        assert calls == ["yplookup"]
+        ns.list, ns.yplookup, ns.storage.everything = original_list, original_yplookup, original_everything
+        with pytest.raises(ValueError):
+            ns.list_page(limit=0)
+        with pytest.raises(ValueError):
+            ns.yplookup_page(meta_any={"odd"}, limit="10")
+        with pytest.raises(ValueError):
+            ns.list_page(prefix="a", regex="a")
+        ns.storage.close()
+
+    def testRegexCache(self):
+        ns = Pyro5.nameserver.NameServer(storageProvider=self.storageProvider)
+        self.clearStorage()
+        ns.register_many({"cache.%d" % i: "PYRO:obj%d@host:555" % i for i in range(10)})
+        Pyro5.nameserver._compile_regex.cache_clear()
+        assert len(ns.list(regex=r"cache\.[0-4]")) == 5
+        assert len(ns.list(regex=r"cache\.[0-4]")) == 5
+        info = Pyro5.nameserver._compile_regex.cache_info()
+        assert info.misses == 1
+        assert info.hits == 1
+        assert ns.remove(regex=r"cache\.[0-4]") == 5
+        assert Pyro5.nameserver._compile_regex.cache_info().hits == 2
+        assert ns.remove(prefix="cache.") == 5
+        assert ns.count() == 0
+        with pytest.raises(NamingError):
+            ns.remove(regex="((((")
+        ns.storage.close()
+
     def testListNoMultipleFilters(self):
         ns = Pyro5.nameserver.NameServer(storageProvider=self.storageProvider)
         with pytest.raises(ValueError):
@@ -604,6 +978,415 @@ class TestOfflineNameServer:
             ns.yplookup(meta_any={"a"}, meta_all={"a"})
 
 
+class TestReadWriteLock:
+    def testReaders(self):
+        lock = Pyro5.nameserver.ReadWriteLock()
+        inside = threading.Barrier(3, timeout=2)
+
+        def reader():
+            with lock.read():
+                inside.wait()      # all readers hold the lock at the same time
+
+        threads = [threading.Thread(target=reader) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        with lock.read():
+            inside.wait()
+        for thread in threads:
+            thread.join()
+
+    def testWriterExcludes(self):
+        lock = Pyro5.nameserver.ReadWriteLock()
+        events = []
+
+        def reader():
+            with lock.read():
+                events.append("read")
+
+        with lock:
+            thread = threading.Thread(target=reader)
+            thread.start()
+            time.sleep(0.1)
+            events.append("write")
+        thread.join()
+        assert events == ["write", "read"]
+
+    def testWriterPreferred(self):
+        lock = Pyro5.nameserver.ReadWriteLock()
+        events = []
+
+        def writer():
+            with lock:
+                events.append("write")
+
+        def reader():
+            with lock.read():
+                events.append("read")
+
+        with lock.read():
+            writer_thread = threading.Thread(target=writer)
+            writer_thread.start()
+            time.sleep(0.1)
+            reader_thread = threading.Thread(target=reader)
+            reader_thread.start()
+            time.sleep(0.1)
+            assert events == []
+        writer_thread.join()
+        reader_thread.join()
+        assert events == ["write", "read"]
+
+    def testReentrant(self):
+        lock = Pyro5.nameserver.ReadWriteLock()
+        with lock:
+            with lock:
+                with lock.read():
+                    pass
+        with lock.read():
+            with lock.read():
+                with pytest.raises(RuntimeError):
+                    lock.acquire_write()
+        with lock:
+            pass
+
+
+class TestMemoryStorage:
+    def testIndexes(self):
+        storage = Pyro5.nameserver.MemoryStorage()
+        storage["b"] = "PYRO:b@host:555", {"x"}
+        storage["a"] = "PYRO:a@host:555", {"x", "y"}
+        storage.update({"c": ("PYRO:c@host:555", None)})
+        assert storage.sorted_names == ["a", "b", "c"]
+        assert storage.metadata_index == {"x": {"a", "b"}, "y": {"a"}}
+        assert storage["c"] == ("PYRO:c@host:555", set())
+        assert storage.pop("a") == ("PYRO:a@host:555", {"x", "y"})
+        assert storage.pop("a", None) is None
+        assert storage.popitem() == ("c", ("PYRO:c@host:555", set()))
+        assert storage.sorted_names == ["b"]
+        assert storage.metadata_index == {"x": {"b"}}
+        storage.remove_items(["b", "nonexisting"])
+        assert storage.sorted_names == []
+        assert storage.metadata_index == {}
+        storage.setdefault("d", ("PYRO:d@host:555", {"z"}))
+        storage.clear()
+        assert len(storage) == 0
+        assert storage.sorted_names == []
+        assert storage.metadata_index == {}
+
+    def testOptimizedQueries(self):
+        storage = Pyro5.nameserver.MemoryStorage()
+        for i in range(200):
+            storage["test.%03d" % i] = "PYRO:obj%d@host:555" % i, {"even" if i % 2 == 0 else "odd", "n%d" % (i % 10)}
+        result = storage.optimized_prefix_list("test.01")
+        assert sorted(result) == ["test.%03d" % i for i in range(10, 20)]
+        assert result["test.010"] == "PYRO:obj10@host:555"
+        result = storage.optimized_prefix_list("test.199", return_metadata=True)
+        assert result == {"test.199": ("PYRO:obj199@host:555", {"odd", "n9"})}
+        assert storage.optimized_prefix_list("zzz") == {}
+        assert len(storage.optimized_metadata_search(metadata_all={"even", "n4"})) == 20
+        assert storage.optimized_metadata_search(metadata_all={"even", "n5"}) == {}
+        assert storage.optimized_metadata_search(metadata_all={"even", "unknown"}) == {}
+        assert len(storage.optimized_metadata_search(metadata_any={"n1", "n2", "unknown"})) == 40
+        result = storage.optimized_metadata_search(metadata_any={"n3"}, return_metadata=True)
+        assert result["test.013"] == ("PYRO:obj13@host:555", {"odd", "n3"})
+
+
+class TestSqlStorage:
+    def setup_method(self):
+        self.storage = Pyro5.nameserver.SqlStorage("pyro-test.sqlite")
+
+    def teardown_method(self):
+        self.storage.close()
+        import glob
+        for file in glob.glob("pyro-test.sqlite*"):
+            os.remove(file)
+
+    def testConnections(self):
+        db = self.storage._connection()
+        assert self.storage._connection() is db
+        assert db.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        indexes = {row[0] for row in db.execute("SELECT name FROM sqlite_master WHERE type='index'")}
+        assert {"pyro_metadata_object", "pyro_metadata_metadata"} <= indexes
+        other = []
+        thread = threading.Thread(target=lambda: other.append(self.storage._connection()))
+        thread.start()
+        thread.join()
+        assert other[0] is not db
+        assert len(self.storage.connections) == 2
+        self.storage.close()
+        assert len(self.storage.connections) == 0
+        assert len(self.storage) == 0   # reconnects
+        assert len(self.storage.connections) == 1
+
+    def testPrefixRange(self):
+        assert Pyro5.nameserver.SqlStorage._prefix_range("abc") == ("abc", "abd")
+        assert Pyro5.nameserver.SqlStorage._prefix_range("a\U0010ffff") == ("a\U0010ffff", "b")
+        assert Pyro5.nameserver.SqlStorage._prefix_range("\U0010ffff") == ("\U0010ffff", None)
+        assert Pyro5.nameserver.SqlStorage._prefix_range("a\ud7ff") == ("a\ud7ff", "a\ue000")
+
+    def testQueries(self):
+        self.storage["app_1"] = "PYRO:a@host:555", {"x", "y"}
+        self.storage["app%2"] = "PYRO:b@host:555", None
+        self.storage["APP.3"] = "PYRO:c@host:555", {"x"}
+        self.storage["apple"] = "PYRO:d@host:555", {"y"}
+        self.storage["\U0010ffff.1"] = "PYRO:e@host:555", None
+        assert set(self.storage.optimized_prefix_list("app")) == {"app_1", "app%2", "apple"}
+        assert self.storage.optimized_prefix_list("app_") == {"app_1": "PYRO:a@host:555"}
+        assert self.storage.optimized_prefix_list("app%", return_metadata=True) == {"app%2": ("PYRO:b@host:555", set())}
+        assert set(self.storage.optimized_prefix_list("\U0010ffff")) == {"\U0010ffff.1"}
+        assert self.storage["app_1"] == ("PYRO:a@host:555", {"x", "y"})
+        everything = self.storage.everything(return_metadata=True)
+        assert len(everything) == 5
+        assert everything["APP.3"] == ("PYRO:c@host:555", {"x"})
+        assert everything["app%2"] == ("PYRO:b@host:555", set())
+        result = self.storage.optimized_metadata_search(metadata_all=["x", "y", "x"], return_metadata=True)
+        assert result == {"app_1": ("PYRO:a@host:555", {"x", "y"})}
+        assert set(self.storage.optimized_metadata_search(metadata_any={"y", "z"})) == {"app_1", "apple"}
+        self.storage["app_1"] = "PYRO:a2@host:555", {"z"}
+        assert self.storage.optimized_metadata_search(metadata_any={"z"}) == {"app_1": "PYRO:a2@host:555"}
+        self.storage.remove_items(["app_1", "apple", "nonexisting"])
+        assert set(self.storage) == {"app%2", "APP.3", "\U0010ffff.1"}
+        assert self.storage._connection().execute("SELECT COUNT(*) FROM pyro_metadata").fetchone()[0] == 1
+
+
+class TestAutoCleaner:
+    def setup_method(self):
+        config.NS_AUTOCLEAN = 1
+        Pyro5.nameserver.AutoCleaner.override_autoclean_min = True
+
+    def teardown_method(self):
+        Pyro5.nameserver.AutoCleaner.override_autoclean_min = False
+        config.NS_AUTOCLEAN = 0.0
+
+    def testProbe(self):
+        listener = Pyro5.socketutil.create_socket(bind=("127.0.0.1", 0))
+        closed = Pyro5.socketutil.create_socket(bind=("127.0.0.1", 0))
+        closed_port = closed.getsockname()[1]
+        closed.close()
+        try:
+            cleaner = Pyro5.nameserver.AutoCleaner(Pyro5.nameserver.NameServer())
+            cleaner.max_probes = 2
+            reachable = ("127.0.0.1", listener.getsockname()[1])
+            unreachable = cleaner.probe([reachable, ("127.0.0.1", closed_port), ("invalid.hostname.", 9999)] + [reachable] * 5)
+            assert unreachable == {("127.0.0.1", closed_port), ("invalid.hostname.", 9999)}
+            assert cleaner.probe([]) == set()
+        finally:
+            listener.close()
+
+    def testProbeSlowResolve(self):
+        listener = Pyro5.socketutil.create_socket(bind=("127.0.0.1", 0))
+        reachable = ("127.0.0.1", listener.getsockname()[1])
+        original_getaddrinfo = socket.getaddrinfo
+        release = threading.Event()
+
+        def getaddrinfo(host, port, family=0, type=0, proto=0, flags=0):
+            if host.startswith("slow"):
+                if not flags & socket.AI_NUMERICHOST:
+                    release.wait(5)
+                raise socket.gaierror("slow host")
+            return original_getaddrinfo(host, port, family, type, proto, flags)
+        socket.getaddrinfo = getaddrinfo
+        old_timeout = config.COMMTIMEOUT
+        config.COMMTIMEOUT = 0.5
+        try:
+            cleaner = Pyro5.nameserver.AutoCleaner(Pyro5.nameserver.NameServer())
+            cleaner.max_resolvers = 4
+            start = time.time()
+            unreachable = cleaner.probe([reachable, ("localhost", reachable[1])] + [("slow%d" % i, 9999) for i in range(3)])
+            duration = time.time() - start
+            assert unreachable == {("slow%d" % i, 9999) for i in range(3)}
+            assert duration < 2.0, "slow lookups must run concurrently and be bounded by the timeout"
+        finally:
+            release.set()
+            socket.getaddrinfo = original_getaddrinfo
+            config.COMMTIMEOUT = old_timeout
+            listener.close()
+
+    def testClean(self):
+        listener = Pyro5.socketutil.create_socket(bind=("127.0.0.1", 0))
+        closed = Pyro5.socketutil.create_socket(bind=("127.0.0.1", 0))
+        closed_port = closed.getsockname()[1]
+        closed.close()
+        port = listener.getsockname()[1]
+        ns = Pyro5.nameserver.NameServer()
+        ns.register(Pyro5.core.NAMESERVER_NAME, "PYRO:nameserver@127.0.0.1:%d" % closed_port)
+        ns.register("alive1", "PYRO:alive1@127.0.0.1:%d" % port)
+        ns.register("alive2", "PYRO:alive2@127.0.0.1:%d" % port)
+        ns.register("dead1", "PYRO:dead1@127.0.0.1:%d" % closed_port)
+        ns.register("dead2", "PYRO:dead2@127.0.0.1:%d" % closed_port)
+        ns.register("dead3", "PYRO:dead3@127.0.0.1:%d" % closed_port)
+        ns.register("indirect", "PYRONAME:alive1")
+        probed = []
+        removed = []
+        cleaner = Pyro5.nameserver.AutoCleaner(ns)
+        cleaner.max_unreachable_time = 0
+        original_probe, original_remove_items = cleaner.probe, ns.storage.remove_items
+        cleaner.probe = lambda locations: probed.append(sorted(locations)) or original_probe(locations)
+        ns.storage.remove_items = lambda items: removed.append(sorted(items)) or original_remove_items(items)
+        original_list = ns.list
+
+        def list_and_reregister():
+            # a name that is registered again during the probing must not be removed
+            result = original_list()
+            ns.register("dead3", "PYRO:dead3@127.0.0.1:%d" % port)
+            return result
+        ns.list = list_and_reregister
+        try:
+            cleaner.clean()
+        finally:
+            listener.close()
+        assert probed == [sorted([("127.0.0.1", closed_port), ("127.0.0.1", port)])]
+        assert removed == [["dead1", "dead2"]]
+        assert sorted(original_list()) == ["Pyro.NameServer", "alive1", "alive2", "dead3", "indirect"]
+        assert cleaner.unreachable == {}
+        assert ns.changes_since(ns.current_revision() - 1) == (ns.current_revision(), ["dead1", "dead2"])
+
+
+class TestReplication:
+    def testApplyChanges(self):
+        primary = Pyro5.nameserver.NameServer()
+        primary.changes = collections.deque(maxlen=2)
+        replica = Pyro5.nameserver.NameServerReplica("PYRO:Pyro.NameServer@localhost:9999")
+        primary.register("one", "PYRO:one@host:555", metadata={"tag"})
+        primary.register("two", "PYRO:two@host:555")
+        r = primary.current_revision()
+        revision, registrations, snapshot = primary.replication_changes(-1, timeout=0)
+        assert (revision, snapshot) == (r, True)
+        replica._apply_replication(revision, registrations, snapshot)
+        assert replica.list(return_metadata=True) == primary.list(return_metadata=True)
+        assert replica.current_revision() == r
+        assert replica.changes_since(r - 1) == (r, None)
+        primary.remove("one")
+        primary.set_metadata("two", ["tag"])
+        revision, registrations, snapshot = primary.replication_changes(r, timeout=0)
+        assert (revision, snapshot) == (r + 2, False)
+        assert registrations == {"one": None, "two": ("PYRO:two@host:555", {"tag"})}
+        replica._apply_replication(revision, registrations, snapshot)
+        assert replica.list(return_metadata=True) == primary.list(return_metadata=True)
+        assert replica.changes_since(r) == (r + 2, ["one", "two"])
+        assert replica.yplookup(meta_all={"tag"}, return_metadata=False) == {"two": "PYRO:two@host:555"}
+        assert primary.replication_changes(r + 2, timeout=0) == (r + 2, {}, False)
+        replica.storage["stale"] = "PYRO:stale@host:555", None
+        replica._apply_replication(*primary.replication_changes(-1, timeout=0))
+        assert replica.list() == {"two": "PYRO:two@host:555"}
+
+    def testReadOnly(self):
+        replica = Pyro5.nameserver.NameServerReplica("PYRO:Pyro.NameServer@localhost:9999")
+        assert replica.replication_status() == {"role": "replica", "primary": "PYRO:Pyro.NameServer@localhost:9999", "revision": 0}
+        with pytest.raises(NamingError) as x:
+            replica.register("one", "PYRO:one@host:555")
+        assert "PYRO:Pyro.NameServer@localhost:9999" in str(x.value)
+        with pytest.raises(NamingError):
+            replica.register_many({"one": "PYRO:one@host:555"})
+        with pytest.raises(NamingError):
+            replica.set_metadata("one", {"tag"})
+        with pytest.raises(NamingError):
+            replica.set_metadata_many({"one": {"tag"}})
+        with pytest.raises(NamingError):
+            replica.remove(prefix="o")
+        replica.promote()
+        status = replica.replication_status()
+        assert status["role"] == "primary" and status["primary"] is None
+        assert status["revision"] > 0, "a replica that never synced gets an epoch of its own when promoted"
+        replica.register("one", "PYRO:one@host:555")
+        assert replica.lookup("one") == Pyro5.core.URI("PYRO:one@host:555")
+
+    def testReplicaDaemon(self):
+        old_poll_timeout = Pyro5.nameserver.Replicator.poll_timeout
+        Pyro5.nameserver.Replicator.poll_timeout = 0.5
+        config.POLLTIMEOUT = 0.1
+        try:
+            primary_uri, primary_daemon, _ = Pyro5.nameserver.start_ns(host="localhost", port=0, enableBroadcast=False)
+            primary_thread = NSLoopThread(primary_daemon)
+            primary_thread.start()
+            replica_uri, replica_daemon, _ = Pyro5.nameserver.start_ns(host="localhost", port=0, enableBroadcast=False, primary=primary_uri)
+            replica_thread = NSLoopThread(replica_daemon)
+            replica_thread.start()
+            try:
+                with Pyro5.client.Proxy(primary_uri) as primary, Pyro5.client.Proxy(replica_uri) as replica:
+                    primary.register("example.one", "PYRO:one@host:555", metadata={"tag"})
+                    revision = primary.current_revision()
+                    start = time.time()
+                    while replica.current_revision() < revision and time.time() - start < 5:
+                        time.sleep(0.05)
+                    assert replica.list(return_metadata=True) == primary.list(return_metadata=True)
+                    assert replica.lookup(Pyro5.core.NAMESERVER_NAME) == primary_uri
+                    assert replica.replication_status() == {"role": "replica", "primary": str(primary_uri), "revision": revision}
+                    with pytest.raises(NamingError):
+                        replica.register("example.two", "PYRO:two@host:555")
+                    primary.remove("example.one")
+                    revision, names = replica.watch("example.", revision, timeout=5)
+                    assert names == ["example.one"]
+                    assert replica.list(prefix="example.") == {}
+            finally:
+                replica_daemon.shutdown()
+                replica_thread.join()
+                primary_daemon.shutdown()
+                primary_thread.join()
+        finally:
+            Pyro5.nameserver.Replicator.poll_timeout = old_poll_timeout
+
+
+    def testPrimaryRestart(self):
+        # the primary runs in its own process, so that stopping it also drops the replica's connection to it
+        old_poll_timeout, old_retry_delay = Pyro5.nameserver.Replicator.poll_timeout, Pyro5.nameserver.Replicator.retry_delay
+        Pyro5.nameserver.Replicator.poll_timeout = 0.5
+        Pyro5.nameserver.Replicator.retry_delay = 0.2
+        config.POLLTIMEOUT = 0.1
+        port = Pyro5.socketutil.find_probably_unused_port()
+        primary_uri = "PYRO:Pyro.NameServer@localhost:%d" % port
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+
+        def start_primary():
+            process = subprocess.Popen([sys.executable, "-m", "Pyro5.nameserver", "-n", "localhost", "-p", str(port), "-x"],
+                                       env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            start = time.time()
+            while time.time() - start < 10:
+                try:
+                    with Pyro5.client.Proxy(primary_uri) as primary:
+                        primary.ping()
+                    return process
+                except CommunicationError:
+                    time.sleep(0.1)
+            process.kill()
+            pytest.fail("primary name server didn't start")
+
+        def stop_primary(process):
+            process.terminate()
+            process.wait()
+
+        def wait_for(replica, name):
+            start = time.time()
+            while name not in replica.list() and time.time() - start < 10:
+                time.sleep(0.05)
+
+        primary_process = start_primary()
+        try:
+            replica_uri, replica_daemon, _ = Pyro5.nameserver.start_ns(host="localhost", port=0, enableBroadcast=False, primary=primary_uri)
+            replica_thread = NSLoopThread(replica_daemon)
+            replica_thread.start()
+            try:
+                with Pyro5.client.Proxy(replica_uri) as replica:
+                    with Pyro5.client.Proxy(primary_uri) as primary:
+                        primary.register_many({"before%d" % i: "PYRO:before@host:555" for i in range(5)})
+                    wait_for(replica, "before4")
+                    stop_primary(primary_process)
+                    # restarted, with other registrations: its revisions don't follow on from the old ones
+                    primary_process = start_primary()
+                    with Pyro5.client.Proxy(primary_uri) as primary:
+                        for i in range(8):
+                            primary.register("after%d" % i, "PYRO:after@host:555")
+                        wait_for(replica, "after7")
+                        assert replica.list() == primary.list()
+                        assert replica.current_revision() == primary.current_revision()
+            finally:
+                replica_daemon.shutdown()
+                replica_thread.join()
+        finally:
+            stop_primary(primary_process)
+            Pyro5.nameserver.Replicator.poll_timeout = old_poll_timeout
+            Pyro5.nameserver.Replicator.retry_delay = old_retry_delay
+
+
 class TestOfflineNameServerTestsSqlStorage(TestOfflineNameServer):
     def setup_method(self):
         super().setup_method()
@@ -617,3 +1400,195 @@ class TestOfflineNameServerTestsSqlStorage(TestOfflineNameServer):
         import glob
         for file in glob.glob("pyro-test.sqlite*"):
             os.remove(file)
+
+
+class TestOfflineNameServerTestsLogStorage(TestOfflineNameServer):
+    def setup_method(self):
+        super().setup_method()
+        self.storageProvider = Pyro5.nameserver.LogStorage("pyro-test-log")
+
+    def teardown_method(self):
+        super().teardown_method()
+        shutil.rmtree("pyro-test-log")
+
+
+class TestLogStorage:
+    def teardown_method(self):
+        shutil.rmtree("pyro-test-log", ignore_errors=True)
+
+    def testPersistence(self):
+        storage = Pyro5.nameserver.LogStorage("pyro-test-log")
+        storage["one"] = "PYRO:one@host:555", {"a", "b"}
+        storage["two"] = "PYRO:two@host:555", None
+        storage.set_items({"three": ("PYRO:three@host:555", ["c"]), "four": ("PYRO:four@host:555", None)})
+        storage.remove_items(["four", "nonexisting"])
+        del storage["two"]
+        storage.close()
+        storage = Pyro5.nameserver.LogStorage("pyro-test-log")
+        assert storage.everything(return_metadata=True) == {
+            "one": ("PYRO:one@host:555", {"a", "b"}),
+            "three": ("PYRO:three@host:555", {"c"})
+        }
+        assert storage.optimized_prefix_list("t") == {"three": "PYRO:three@host:555"}
+        assert storage.optimized_metadata_search(metadata_any={"a", "c"}) == {"one": "PYRO:one@host:555", "three": "PYRO:three@host:555"}
+        assert storage.log_entries == 6
+        storage.clear()
+        storage["five"] = "PYRO:five@host:555", None
+        storage.close()
+        storage = Pyro5.nameserver.LogStorage("pyro-test-log")
+        assert storage.everything() == {"five": "PYRO:five@host:555"}
+        storage.close()
+
+    def testCompaction(self):
+        storage = Pyro5.nameserver.LogStorage("pyro-test-log")
+        storage.compact_min_entries = 10
+        for i in range(10):
+            storage["name%d" % i] = "PYRO:obj@host:555", None
+        assert storage.log_entries == 10
+        for i in range(5):
+            storage["name%d" % i] = "PYRO:other@host:555", {"tag"}
+        # the log is compacted when it has more than twice the number of registrations
+        assert storage.log_entries == 15
+        del storage["name0"]
+        assert storage.log_entries == 16
+        del storage["name1"]
+        assert storage.log_entries == 0
+        assert os.path.getsize(os.path.join("pyro-test-log", "pyro-names.log")) == 0
+        storage["name0"] = "PYRO:obj@host:555", None
+        storage.close()
+        storage = Pyro5.nameserver.LogStorage("pyro-test-log")
+        assert storage.log_entries == 1
+        assert sorted(storage) == ["name%d" % i for i in [0, 2, 3, 4, 5, 6, 7, 8, 9]]
+        assert storage["name2"] == ("PYRO:other@host:555", {"tag"})
+        storage.close()
+
+    def testTornWrite(self):
+        storage = Pyro5.nameserver.LogStorage("pyro-test-log")
+        storage["one"] = "PYRO:one@host:555", None
+        storage["two"] = "PYRO:two@host:555", None
+        storage.close()
+        logfile = os.path.join("pyro-test-log", "pyro-names.log")
+        with open(logfile, "r+b") as file:
+            file.truncate(os.path.getsize(logfile) - 5)
+        storage = Pyro5.nameserver.LogStorage("pyro-test-log")
+        assert storage.everything() == {"one": "PYRO:one@host:555"}
+        storage.close()
+
+    def testSync(self):
+        storage = Pyro5.nameserver.LogStorage("pyro-test-log")
+        try:
+            assert storage.sync_thread.is_alive()
+            storage["one"] = "PYRO:one@host:555", None
+            assert storage.synced_batches == storage.written_batches == 1
+        finally:
+            storage.close()
+        assert storage.sync_thread is None
+        storage["two"] = "PYRO:two@host:555", None    # without the sync thread, the writer does the fsync itself
+        assert storage.synced_batches == storage.written_batches == 2
+        storage.close()
+
+    def testGroupCommit(self):
+        ns = Pyro5.nameserver.NameServer(storageProvider=Pyro5.nameserver.LogStorage("pyro-test-log"))
+        logfile = os.path.join("pyro-test-log", "pyro-names.log")
+        original_fsync = os.fsync
+        synced_names = set()
+        fsyncs = []
+        lookups_during_fsync = []
+
+        def fsync(fd):
+            fsyncs.append(fd)
+            time.sleep(0.02)
+            original_fsync(fd)
+            with open(logfile, encoding="utf-8") as file:
+                synced_names.update(json.loads(line)[1] for line in file)
+
+        def register(name):
+            ns.register(name, "PYRO:obj@host:555")
+            if name not in synced_names:
+                not_synced.append(name)
+
+        def lookup():
+            # readers aren't held up by the fsyncs
+            while len(fsyncs) < 2:
+                time.sleep(0.001)
+            start = time.time()
+            ns.list_page(limit=5)
+            lookups_during_fsync.append(time.time() - start)
+
+        not_synced = []
+        os.fsync = fsync
+        try:
+            threads = [threading.Thread(target=register, args=("name%d" % i,)) for i in range(50)]
+            threads.append(threading.Thread(target=lookup))
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            os.fsync = original_fsync
+            ns.storage.close()
+        assert not_synced == [], "a change must not be acknowledged before it is on disk"
+        assert ns.count() == 50
+        assert len(fsyncs) < 25, "concurrent registrations should share fsyncs"
+        assert lookups_during_fsync[0] < 0.015
+
+    def testDeferredSync(self):
+        storage = Pyro5.nameserver.LogStorage("pyro-test-log")
+        try:
+            with storage.deferred_sync():
+                storage["one"] = "PYRO:one@host:555", None
+                with storage.deferred_sync():
+                    storage["two"] = "PYRO:two@host:555", None
+                assert storage.deferred.batch == storage.written_batches == 2
+            assert storage.synced_batches == 2
+            with pytest.raises(NamingError):
+                with storage.deferred_sync():
+                    storage["three"] = "PYRO:three@host:555", None
+                    raise NamingError("failed after the change")
+            assert storage.synced_batches == 3
+        finally:
+            storage.close()
+
+    def testCompactionSyncsDirectory(self):
+        storage = Pyro5.nameserver.LogStorage("pyro-test-log")
+        storage["one"] = "PYRO:one@host:555", None
+        original_fsync = os.fsync
+        synced_directories = []
+
+        def fsync(fd):
+            if stat.S_ISDIR(os.fstat(fd).st_mode):
+                synced_directories.append(fd)
+            original_fsync(fd)
+        os.fsync = fsync
+        try:
+            storage.compact()
+        finally:
+            os.fsync = original_fsync
+            storage.close()
+        if os.name != "nt":
+            assert len(synced_directories) == 1
+
+    def testRevisionsAfterRestart(self):
+        ns = Pyro5.nameserver.NameServer(storageProvider=Pyro5.nameserver.LogStorage("pyro-test-log"))
+        for i in range(5):
+            ns.register("a%d" % i, "PYRO:a@host:555")
+        old_revision = ns.current_revision()
+        ns.register("late", "PYRO:late@host:555")
+        ns.storage.close()
+        # restarted on the same storage: the old revisions don't mean anything anymore
+        ns = Pyro5.nameserver.NameServer(storageProvider=Pyro5.nameserver.LogStorage("pyro-test-log"))
+        try:
+            for i in range(6):
+                ns.register("b%d" % i, "PYRO:b@host:555")
+            assert ns.changes_since(old_revision) == (ns.current_revision(), None)
+            assert ns.watch(revision=old_revision, timeout=1) == (ns.current_revision(), None)
+            assert ns.changes_since(ns.current_revision() - 1) == (ns.current_revision(), ["b5"])
+        finally:
+            ns.storage.close()
+
+    def testNameServerDaemon(self):
+        with Pyro5.nameserver.NameServerDaemon(port=0, storage="log:pyro-test-log") as daemon:
+            assert isinstance(daemon.nameserver.storage, Pyro5.nameserver.LogStorage)
+            daemon.nameserver.register("example", "PYRO:example@host:555")
+        with Pyro5.nameserver.NameServerDaemon(port=0, storage="log:pyro-test-log") as daemon:
+            assert daemon.nameserver.lookup("example") == Pyro5.core.URI("PYRO:example@host:555")
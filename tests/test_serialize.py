@@ -3,10 +3,16 @@ Tests for the data serializer.
 
 Pyro - Python Remote Objects.  Copyright by Irmen de Jong (irmen@razorvine.net).
 """
+import abc
 import array
 import collections
 import copy
+import dataclasses
+import importlib.util
 import math
+import os
+import subprocess
+import sys
 import uuid
 import pytest
 import Pyro5.errors
@@ -257,9 +263,16 @@ class TestSerializer2_serpent:
     def testProxySerializationCompat(self):
         proxy = Pyro5.client.Proxy("PYRO:object@host:4444")
         proxy._pyroSerializer = "serializer"
+        proxy._pyroIdempotent = {"work"}
         pickle_state = proxy.__getstate__()
-        assert len(pickle_state) == 6
+        assert len(pickle_state) == 7
         proxy.__setstate__(pickle_state)
+        assert proxy._pyroIdempotent == {"work"}
+        proxy.__setstate__(pickle_state[:6])     # state of older versions
+        assert proxy._pyroIdempotent == set()
+        proxy._pyroIdempotent = {"work"}
+        assert copy.copy(proxy)._pyroIdempotent == {"work"}
+        assert self.serializer.loads(self.serializer.dumps(proxy))._pyroIdempotent == {"work"}
 
     def testAutoProxyPartlyExposed(self):
         self.serializer.register_type_replacement(MyThingPartlyExposed, Pyro5.server._pyro_obj_to_auto_proxy)
@@ -448,6 +461,20 @@ class TestSerializer2_serpent:
         assert number == 1
         assert uri["uri"] == Pyro5.core.URI("PYRO:555@localhost:80")
 
+    def testPlainDataSkipsRecreate(self):
+        data = self.serializer.dumps([1, 2, {"key": [3, 4]}, "five"])
+        assert not self.serializer._may_contain_classes(data)
+        assert not self.serializer._may_contain_classes(memoryview(data))
+        assert self.serializer.loads(memoryview(data)) == [1, 2, {"key": [3, 4]}, "five"]
+        uri = Pyro5.core.URI("PYRO:555@localhost:80")
+        data = self.serializer.dumps(uri)
+        assert self.serializer._may_contain_classes(data)
+        assert self.serializer.loads(data) == uri
+        data = self.serializer.dumpsCall("obj", "method", (uri, 42), {"kw": uri})
+        obj, method, vargs, kwargs = self.serializer.loadsCall(data)
+        assert vargs[0] == uri
+        assert kwargs == {"kw": uri}
+
     def testUriSerializationWithoutSlots(self):
         u = Pyro5.core.URI("PYRO:obj@localhost:1234")
         d = self.serializer.dumps(u)
@@ -600,6 +627,7 @@ class TestGenericCases:
         assert Pyro5.serializers.MarshalSerializer.serializer_id == 2
         assert Pyro5.serializers.JsonSerializer.serializer_id == 3
         assert Pyro5.serializers.MsgpackSerializer.serializer_id == 4
+        assert Pyro5.serializers.PickleSerializer.serializer_id == 5
 
     def testSerializersAvailableById(self):
         _ = Pyro5.serializers.serializers_by_id[1]  # serpent
@@ -607,8 +635,9 @@ class TestGenericCases:
         _ = Pyro5.serializers.serializers_by_id[3]  # json
         if "msgpack" in Pyro5.serializers.serializers:
             _ = Pyro5.serializers.serializers_by_id[4]  # msgpack
+        _ = Pyro5.serializers.serializers_by_id[5]  # pickle
         assert 0 not in Pyro5.serializers.serializers_by_id
-        assert 5 not in Pyro5.serializers.serializers_by_id
+        assert 6 not in Pyro5.serializers.serializers_by_id
 
     def testDictClassFail(self):
         o = MyThingFullExposed("hello")
@@ -671,6 +700,45 @@ class TestGenericCases:
         with pytest.raises(Pyro5.errors.ProtocolError):
             _ = Pyro5.serializers.SerializerBase.dict_to_class(d)
 
+    def testCustomDictClassMro(self):
+        class Base(object):
+            def __init__(self, name):
+                self.name = name
+
+        class Derived(Base):
+            pass
+
+        class VirtualBase(abc.ABC):
+            pass
+
+        VirtualBase.register(MyThingPartlyExposed)
+        ser = Pyro5.serializers.SerializerBase
+        try:
+            ser.register_class_to_dict(Base, lambda obj: {"__class__": "base", "name": obj.name})
+            assert ser.class_to_dict(Derived("derived")) == {"__class__": "base", "name": "derived"}
+            ser.register_class_to_dict(Derived, lambda obj: {"__class__": "derived", "name": obj.name})
+            assert ser.class_to_dict(Derived("derived"))["__class__"] == "derived"   # most specific converter wins
+            assert ser.class_to_dict(Base("base"))["__class__"] == "base"
+            ser.unregister_class_to_dict(Derived)
+            assert ser.class_to_dict(Derived("derived"))["__class__"] == "base"
+            ser.register_class_to_dict(VirtualBase, lambda obj: {"__class__": "virtual"})
+            assert ser.class_to_dict(MyThingPartlyExposed("thing")) == {"__class__": "virtual"}
+        finally:
+            ser.unregister_class_to_dict(Base)
+            ser.unregister_class_to_dict(Derived)
+            ser.unregister_class_to_dict(VirtualBase)
+        assert ser.class_to_dict(Derived("derived")).get("__class__") != "base"
+
+    def testBuiltinDictClasses(self):
+        ser = Pyro5.serializers.SerializerBase
+        assert isinstance(ser.dict_to_class({"__class__": "Pyro5.util.JsonSerializer"}), Pyro5.serializers.JsonSerializer)
+        exc = ser.dict_to_class({"__class__": "Pyro5.errors.NamingError", "__exception__": True, "args": ("error",)})
+        assert isinstance(exc, Pyro5.errors.NamingError)
+        exc = ser.dict_to_class({"__class__": "struct.error", "__exception__": True, "args": ("error",)})
+        assert type(exc).__name__ == "error"
+        with pytest.raises(Pyro5.errors.SerializeError):
+            ser.dict_to_class({"__class__": "Pyro5.errors.nonexisting", "__exception__": True, "args": ()})
+
     def testExceptionNamespace(self):
         data = {'__class__': 'builtins.ZeroDivisionError',
                 '__exception__': True,
@@ -700,6 +768,185 @@ class TestGenericCases:
         assert math.isnan(s2[2])
 
 
+
+class TestArrays:
+    @pytest.mark.parametrize("name", sorted(Pyro5.serializers.serializers))
+    def testRoundtrip(self, name):
+        ser = Pyro5.serializers.serializers[name]
+        for typecode in "bBhHiIlLqQfd":
+            a1 = array.array(typecode, range(10))
+            a2 = ser.loads(ser.dumps(a1))
+            assert type(a2) is array.array
+            assert a2 == a1
+        assert ser.loads(ser.dumps(array.array('u', "hello"))) in ("hello", array.array('u', "hello"))
+        assert ser.loads(ser.dumps(array.array('d'))) == array.array('d')
+
+    def testByteorder(self):
+        a1 = array.array('i', [1, 2, 3])
+        d = Pyro5.serializers.array_to_dict(a1)
+        assert d["typecode"] == "i"
+        assert bytes(d["data"]) == a1.tobytes()
+        swapped = array.array('i', [1, 2, 3])
+        swapped.byteswap()
+        d["data"] = swapped.tobytes()
+        d["byteorder"] = "big" if sys.byteorder == "little" else "little"
+        assert Pyro5.serializers.dict_to_array(d) == a1
+
+    def testInvalid(self):
+        d = Pyro5.serializers.array_to_dict(array.array('i', [1, 2, 3]))
+        d["itemsize"] = 99
+        with pytest.raises(Pyro5.errors.SerializeError):
+            Pyro5.serializers.dict_to_array(d)
+        d = Pyro5.serializers.array_to_dict(array.array('i', [1, 2, 3]))
+        d["typecode"] = "X"
+        with pytest.raises(Pyro5.errors.SerializeError):
+            Pyro5.serializers.dict_to_array(d)
+
+
+@dataclasses.dataclass
+class SchemaRecord:
+    ident: int
+    name: str
+    score: float = 0.0
+
+
+@dataclasses.dataclass(frozen=True)
+class SchemaPair:
+    first: SchemaRecord
+    second: SchemaRecord
+
+
+class SchemaPoint:
+    __slots__ = ("x", "y")
+
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+
+    def __eq__(self, other):
+        return type(other) is SchemaPoint and (self.x, self.y) == (other.x, other.y)
+
+
+class TestSchemas:
+    def setup_method(self):
+        Pyro5.serializers.SerializerBase.register_schema(SchemaRecord)
+        Pyro5.serializers.SerializerBase.register_schema(SchemaPair, tag="pair")
+        Pyro5.serializers.SerializerBase.register_schema(SchemaPoint)
+
+    def teardown_method(self):
+        Pyro5.serializers.SerializerBase.unregister_schema(SchemaRecord)
+        Pyro5.serializers.SerializerBase.unregister_schema(SchemaPair)
+        Pyro5.serializers.SerializerBase.unregister_schema(SchemaPoint)
+
+    @pytest.mark.parametrize("name", sorted(Pyro5.serializers.serializers))
+    def testRoundtrip(self, name):
+        ser = Pyro5.serializers.serializers[name]
+        record = SchemaRecord(42, "name", 1.5)
+        data = ser.dumps(record)
+        if name != "pickle":
+            assert b"ident" not in data
+            assert b"score" not in data
+        assert ser.loads(data) == record
+        assert ser.loads(ser.dumps(SchemaPoint(1, 2))) == SchemaPoint(1, 2)
+        pair = SchemaPair(SchemaRecord(1, "one"), SchemaRecord(2, "two", 2.5))
+        assert ser.loads(ser.dumps(pair)) == pair
+        obj, method, vargs, kwargs = ser.loadsCall(ser.dumpsCall("obj", "method", (SchemaPoint(5, 6),), {"record": record}))
+        assert vargs[0] == SchemaPoint(5, 6)
+        assert kwargs == {"record": record}
+
+    @pytest.mark.parametrize("name", sorted(set(Pyro5.serializers.serializers) - {"marshal"}))
+    def testContainers(self, name):
+        ser = Pyro5.serializers.serializers[name]
+        records = [SchemaRecord(i, "name%d" % i, i / 2) for i in range(100)]
+        assert ser.loads(ser.dumps(records)) == records
+        pair = SchemaPair(SchemaRecord(1, "one"), SchemaRecord(2, "two", 2.5))
+        assert ser.loads(ser.dumps({"pair": pair, "points": [SchemaPoint(1, 2)]})) == {"pair": pair, "points": [SchemaPoint(1, 2)]}
+
+    def testFields(self):
+        assert Pyro5.serializers._Schema.fields_of(SchemaRecord) == ("ident", "name", "score")
+        assert Pyro5.serializers._Schema.fields_of(SchemaPoint) == ("x", "y")
+        with pytest.raises(ValueError):
+            Pyro5.serializers.SerializerBase.register_schema(Pyro5.core.URI)
+        with pytest.raises(TypeError):
+            Pyro5.serializers.SerializerBase.register_schema(SchemaPoint(1, 2))
+
+    @pytest.mark.parametrize("name", ["serpent", "json", "msgpack"])
+    def testSmaller(self, name):
+        ser = Pyro5.serializers.serializers[name]
+        records = [SchemaRecord(i, "name%d" % i, i / 2) for i in range(100)]
+        Pyro5.serializers.SerializerBase.register_schema(SchemaRecord, tag="rec")
+        compact = ser.dumps(records)
+        Pyro5.serializers.SerializerBase.unregister_schema(SchemaRecord)
+        Pyro5.serializers.SerializerBase.register_class_to_dict(SchemaRecord, lambda obj: dict(vars(obj), __class__="rec"))
+        try:
+            plain = ser.dumps(records)
+        finally:
+            Pyro5.serializers.SerializerBase.unregister_class_to_dict(SchemaRecord)
+        assert len(compact) < len(plain) * 0.85
+
+
+@pytest.mark.skipif(importlib.util.find_spec("numpy") is None, reason="numpy is not available")
+class TestNumpyArrays:
+    def testNotImportedEagerly(self):
+        code = "import sys, Pyro5.api; Pyro5.serializers.serializers['serpent'].dumps([1, 2]); print('numpy' in sys.modules)"
+        output = subprocess.check_output([sys.executable, "-c", code], cwd=os.path.dirname(os.path.dirname(__file__)))
+        assert output.strip() == b"False"
+
+    def arrays(self):
+        import numpy
+        return [
+            numpy.arange(12, dtype=numpy.float32).reshape(3, 4),
+            numpy.asfortranarray(numpy.arange(6).reshape(2, 3)),
+            numpy.arange(20)[::3],
+            numpy.array(5.0),
+            numpy.zeros((0, 3)),
+            numpy.arange(4, dtype=">i4"),
+            numpy.array(["x", "yz"]),
+            numpy.array([(1, 2.0)], dtype=[("a", "i4"), ("b", "f8")])
+        ]
+
+    @pytest.mark.parametrize("name", sorted(Pyro5.serializers.serializers))
+    def testRoundtrip(self, name):
+        import numpy
+        ser = Pyro5.serializers.serializers[name]
+        for array in self.arrays():
+            result = ser.loads(ser.dumps(array))
+            assert type(result) is numpy.ndarray
+            assert result.dtype == array.dtype
+            assert result.shape == array.shape
+            assert numpy.array_equal(result, array)
+        array = self.arrays()[0]
+        obj, method, vargs, kwargs = ser.loadsCall(ser.dumpsCall("obj", "method", (array,), {"kw": array}))
+        assert numpy.array_equal(vargs[0], array)
+        assert numpy.array_equal(kwargs["kw"], array)
+
+    def testNoCopy(self):
+        import numpy
+        array = numpy.arange(100000, dtype=numpy.float64)
+        if "msgpack" in Pyro5.serializers.serializers:
+            result = Pyro5.serializers.serializers["msgpack"].loads(Pyro5.serializers.serializers["msgpack"].dumps(array))
+            assert not result.flags.owndata
+            assert not result.flags.writeable
+        d = Pyro5.serializers.ndarray_to_dict(array)
+        assert d["dtype"] == "<f8"
+        assert d["shape"] == [100000]
+        assert len(d["data"]) == 800000
+        result = Pyro5.serializers.dict_to_ndarray(d)
+        assert not result.flags.owndata
+        assert numpy.array_equal(result, array)
+
+    def testObjectArraysRefused(self):
+        import numpy
+        for name, ser in Pyro5.serializers.serializers.items():
+            if name != "pickle":
+                with pytest.raises(Pyro5.errors.SerializeError):
+                    ser.dumps(numpy.array([object()]))
+        d = Pyro5.serializers.ndarray_to_dict(numpy.arange(3))
+        d["dtype"] = "|O"
+        with pytest.raises(Pyro5.errors.SerializeError):
+            Pyro5.serializers.dict_to_ndarray(d)
+
+
 def mything_dict(obj):
     return {
         "__class__": "CUSTOM-Mythingymabob",
@@ -6,6 +6,7 @@ Pyro - Python Remote Objects.  Copyright by Irmen de Jong (irmen@razorvine.net).
 
 import time
 import threading
+import collections
 import serpent
 import pytest
 import Pyro5.core
@@ -95,6 +96,12 @@ class ServerTestObject(object):
         yield "four"
         yield "five"
 
+    def sequence(self, size, unserializable_at=-1):
+        result = list(range(size))
+        if unserializable_at >= 0:
+            result[unserializable_at] = lambda: None
+        return result
+
     def response_annotation(self):
         # part of the annotations tests
         if "XYZZ" not in Pyro5.callcontext.current_context.annotations:
@@ -120,6 +127,63 @@ class NotEverythingExposedClass(object):
         return "you should not see this"
 
 
+@Pyro5.server.expose
+class HedgeTestObject(object):
+    def __init__(self, name, delay):
+        self.name = name
+        self.delay = delay
+
+    @Pyro5.server.idempotent
+    def work(self):
+        time.sleep(self.delay)
+        return self.name
+
+    def not_idempotent(self):
+        time.sleep(self.delay)
+        return self.name
+
+
+@Pyro5.server.expose
+class CacheTestObject(object):
+    def __init__(self):
+        self.calls = 0
+        self._setting = "initial"
+
+    @Pyro5.server.cacheable(ttl=10)
+    def lookup(self, arg):
+        self.calls += 1
+        return [arg, self.calls]
+
+    @Pyro5.server.cacheable(ttl=0.2)
+    def short_lived(self):
+        self.calls += 1
+        return self.calls
+
+    def uncached(self):
+        self.calls += 1
+        return self.calls
+
+    @Pyro5.server.cache_serialized()
+    def reference(self, arg):
+        self.calls += 1
+        return {"arg": arg, "data": list(range(10))}
+
+    @Pyro5.server.cache_serialized(ttl=0.2)
+    def short_lived_reference(self):
+        self.calls += 1
+        return "reference"
+
+    @property
+    @Pyro5.server.cacheable(ttl=10)
+    def setting(self):
+        self.calls += 1
+        return self._setting
+
+    @setting.setter
+    def setting(self, value):
+        self._setting = value
+
+
 class DaemonLoopThread(threading.Thread):
     def __init__(self, pyrodaemon):
         super().__init__()
@@ -148,6 +212,31 @@ class DaemonWithSabotagedHandshake(Pyro5.server.Daemon):
         return False
 
 
+class DaemonWithPickledHandshake(Pyro5.server.Daemon):
+    def _handshake(self, conn, denied_reason=None):
+        msg = Pyro5.protocol.recv_stub(conn, [Pyro5.protocol.MSG_CONNECT])
+        # respond in pickle, regardless of what the client used
+        data = Pyro5.serializers.PickleSerializer().dumps({"handshake": "hello", "meta": {}})
+        msg = Pyro5.protocol.SendingMessage(Pyro5.protocol.MSG_CONNECTOK, 0, msg.seq,
+                                            Pyro5.serializers.PickleSerializer.serializer_id, data)
+        conn.send(msg.data)
+        return False
+
+
+class DaemonWithSpoofedNegotiation(Pyro5.server.Daemon):
+    def _handshake(self, conn, denied_reason=None):
+        msg = Pyro5.protocol.recv_stub(conn, [Pyro5.protocol.MSG_CONNECT])
+        serializer = Pyro5.serializers.serializers_by_id[msg.serializer_id]
+        data = serializer.loads(msg.data)
+        # tell the client to switch to pickle, whatever it offered
+        response = {"handshake": "hello", "serializer": "pickle",
+                    "meta": self.objectsById[Pyro5.core.DAEMON_NAME].get_metadata(data["object"])}
+        msg = Pyro5.protocol.SendingMessage(Pyro5.protocol.MSG_CONNECTOK, 0, msg.seq, serializer.serializer_id,
+                                            serializer.dumps(response))
+        conn.send(msg.data)
+        return True
+
+
 class TestServerBrokenHandshake:
     def setup_method(self):
         config.LOGWIRE = True
@@ -173,6 +262,47 @@ class TestServerBrokenHandshake:
             message = str(x.value)
             assert "rejected:" in message
             assert "rigged connection failure" in message
+        # the daemon did answer, so its location isn't considered unreachable
+        assert (self.objectUri.host, self.objectUri.port) not in Pyro5.client.endpoint_states.states
+
+    def testDaemonSpoofsNegotiation(self):
+        config.SERIALIZERS_ACCEPTED = config.SERIALIZERS_ACCEPTED | {"pickle"}
+        try:
+            with DaemonWithSpoofedNegotiation(port=0) as daemon:
+                uri = daemon.register(ServerTestObject(), "something")
+                thread = DaemonLoopThread(daemon)
+                thread.start()
+                thread.running.wait()
+                try:
+                    with Pyro5.client.Proxy(uri) as p:
+                        p._pyroBind()
+                        assert p._pyroSerializer is None     # didn't offer any serializers
+                    config.SERIALIZERS_PREFERRED = ["json", "marshal"]
+                    with Pyro5.client.Proxy(uri) as p:
+                        p._pyroBind()
+                        assert p._pyroSerializer is None     # pickle wasn't offered
+                        assert p.multiply(5, 11) == 55
+                finally:
+                    config.SERIALIZERS_PREFERRED = []
+                    daemon.shutdown()
+                    thread.join()
+        finally:
+            config.SERIALIZERS_ACCEPTED = config.SERIALIZERS_ACCEPTED - {"pickle"}
+
+    def testDaemonRespondsWithOtherSerializer(self):
+        with DaemonWithPickledHandshake(port=0) as daemon:
+            uri = daemon.register(ServerTestObject(), "something")
+            thread = DaemonLoopThread(daemon)
+            thread.start()
+            thread.running.wait()
+            try:
+                with Pyro5.client.Proxy(uri) as p:
+                    with pytest.raises(Pyro5.errors.SerializeError) as x:
+                        p._pyroBind()
+                    assert "invalid serializer in connect response" in str(x.value)
+            finally:
+                daemon.shutdown()
+                thread.join()
 
 
 class TestServerOnce:
@@ -189,6 +319,8 @@ class TestServerOnce:
         self.objectUri = uri
         obj2 = NotEverythingExposedClass("hello")
         self.daemon.register(obj2, "unexposed")
+        self.cacheObject = CacheTestObject()
+        self.cacheUri = self.daemon.register(self.cacheObject, "cached")
         self.daemonthread = DaemonLoopThread(self.daemon)
         self.daemonthread.start()
         self.daemonthread.running.wait()
@@ -237,6 +369,227 @@ class TestServerOnce:
                 # attribute should fail (meta only works for exposed properties)
                 p.dict_attr.update({"more": 666})
 
+    def testCacheableResults(self):
+        with Pyro5.client.Proxy(self.cacheUri) as p:
+            assert p.lookup(1) == [1, 1]
+            result = p.lookup(1)
+            assert result == [1, 1]
+            result.append("modified")
+            assert p.lookup(1) == [1, 1]     # every hit returns its own copy
+            assert p.lookup(2) == [2, 2]
+            assert p.uncached() == 3
+            assert p.uncached() == 4
+            assert p._pyroCacheable == {"lookup": 10, "short_lived": 0.2, "setting": 10}
+            p._pyroCacheInvalidate("lookup")
+            assert p.lookup(1) == [1, 5]
+            assert p.short_lived() == 6
+            assert p.short_lived() == 6
+            time.sleep(0.25)
+            assert p.short_lived() == 7
+            # cached properties
+            assert p.setting == "initial"
+            assert p.setting == "initial"
+            assert p.uncached() == 9
+            p.setting = "changed"
+            assert p.setting == "changed"
+            assert p.uncached() == 11
+            p._pyroCacheInvalidate()
+            assert len(p._pyroResultCache) == 0
+
+    def testCacheableLimit(self):
+        config.RESULT_CACHE_SIZE = 2
+        try:
+            with Pyro5.client.Proxy(self.cacheUri) as p:
+                for arg in range(5):
+                    p.lookup(arg)
+                assert len(p._pyroResultCache) == 2
+                assert p.lookup(4) == [4, 5]
+                assert p.lookup(0) == [0, 6]
+        finally:
+            config.RESULT_CACHE_SIZE = 1000
+
+    def testCacheableDecorator(self):
+        with pytest.raises(SyntaxError):
+            @Pyro5.server.cacheable
+            def method(self):
+                pass
+        with pytest.raises(SyntaxError):
+            Pyro5.server.cacheable(ttl=0)
+
+    def testCacheSerialized(self):
+        with Pyro5.client.Proxy(self.cacheUri) as p:
+            assert p.reference("a") == {"arg": "a", "data": list(range(10))}
+            assert p.reference("a") == {"arg": "a", "data": list(range(10))}
+            assert self.cacheObject.calls == 1
+            assert p.reference(arg="a") == {"arg": "a", "data": list(range(10))}
+            assert p.reference("b") == {"arg": "b", "data": list(range(10))}
+            assert self.cacheObject.calls == 3
+            p.reference(["list"])
+            p.reference(["list"])
+            assert self.cacheObject.calls == 4
+            # equal but different values don't share a cached response
+            assert p.reference(1)["arg"] == 1
+            assert p.reference(True)["arg"] is True
+            assert type(p.reference(1.0)["arg"]) is float
+            assert type(p.reference(1)["arg"]) is int
+            assert self.cacheObject.calls == 7
+            self.daemon.invalidate_cached_responses(self.cacheObject, "reference")
+            p.reference("a")
+            p.reference("a")
+            assert self.cacheObject.calls == 8
+            self.daemon.invalidate_cached_responses("cached")
+            p.reference("a")
+            assert self.cacheObject.calls == 9
+            assert p.short_lived_reference() == "reference"
+            assert p.short_lived_reference() == "reference"
+            assert self.cacheObject.calls == 10
+            time.sleep(0.3)
+            assert p.short_lived_reference() == "reference"
+            assert self.cacheObject.calls == 11
+        with Pyro5.client.Proxy(self.cacheUri) as p:
+            p._pyroSerializer = "json"
+            p.reference("a")
+            p.reference("a")
+            assert self.cacheObject.calls == 12    # cached per serializer
+
+    def testCacheSerializedHandshake(self):
+        with Pyro5.client.Proxy("PYRO:replaced@" + self.objectUri.location) as p:
+            with pytest.raises(Pyro5.errors.CommunicationError):
+                p._pyroBind()
+        self.daemon.register(CacheTestObject(), "replaced")
+        with Pyro5.client.Proxy("PYRO:replaced@" + self.objectUri.location) as p:
+            p._pyroBind()
+            assert "reference" in p._pyroMethods
+        self.daemon.unregister("replaced")
+        self.daemon.register(ServerTestObject(), "replaced")
+        with Pyro5.client.Proxy("PYRO:replaced@" + self.objectUri.location) as p:
+            p._pyroBind()
+            assert "reference" not in p._pyroMethods
+            assert "echo" in p._pyroMethods
+        with Pyro5.client.Proxy(self.daemon.uriFor(Pyro5.core.DAEMON_NAME)) as p:
+            assert "echo" in p.get_metadata("replaced")["methods"]
+            self.daemon.unregister("replaced")
+            self.daemon.register(CacheTestObject(), "replaced")
+            assert "echo" not in p.get_metadata("replaced")["methods"]
+
+    def testCacheSerializedDecorator(self):
+        with pytest.raises(SyntaxError):
+            Pyro5.server.cache_serialized(ttl=-1)
+        with pytest.raises(SyntaxError):
+            Pyro5.server.cache_serialized(ttl="10")
+
+    def testPickleRefusedByDefault(self):
+        assert "pickle" not in self.daemon.serializers_accepted
+        assert "pickle" not in config.SERIALIZERS_ACCEPTED
+        with Pyro5.client.Proxy(self.objectUri) as p:
+            p._pyroSerializer = "pickle"
+            with pytest.raises(Pyro5.errors.SecurityError) as x:
+                p._pyroBind()     # refused by the proxy itself
+            assert "SERIALIZERS_ACCEPTED" in str(x.value)
+        config.SERIALIZERS_ACCEPTED = config.SERIALIZERS_ACCEPTED | {"pickle"}
+        try:
+            with Pyro5.client.Proxy(self.objectUri) as p:
+                p._pyroSerializer = "pickle"
+                with pytest.raises(Pyro5.errors.CommunicationError) as x:
+                    p._pyroBind()
+                assert "serializer not accepted" in str(x.value)
+            with Pyro5.client.Proxy(self.objectUri) as p:
+                assert p.testargs(1) == [1, [], {}]
+                p._pyroSerializer = "pickle"
+                with pytest.raises(Pyro5.errors.SecurityError):
+                    p.testargs(1)
+        finally:
+            config.SERIALIZERS_ACCEPTED = config.SERIALIZERS_ACCEPTED - {"pickle"}
+
+    def testPickleAccepted(self):
+        self.daemon.serializers_accepted = self.daemon.serializers_accepted | {"pickle"}
+        config.SERIALIZERS_ACCEPTED = config.SERIALIZERS_ACCEPTED | {"pickle"}
+        try:
+            with Pyro5.client.Proxy(self.objectUri) as p:
+                p._pyroSerializer = "pickle"
+                assert p.testargs(1, {2, 3}, a=(4, 5)) == [1, [{2, 3}], {'a': (4, 5)}]
+                data = bytearray(100000)
+                assert p.echo(data) == data
+                with pytest.raises(ZeroDivisionError):
+                    p.divide(1, 0)
+        finally:
+            config.SERIALIZERS_ACCEPTED = config.SERIALIZERS_ACCEPTED - {"pickle"}
+
+    def testChunkedResults(self):
+        with Pyro5.client.Proxy(self.objectUri) as p:
+            p._pyroChunkedResults = True
+            assert p.sequence(10) == list(range(10))     # small results are not chunked
+            result = p.sequence(config.RESULT_CHUNK_SIZE * 2 + 10)
+            assert isinstance(result, Pyro5.client._ChunkedResultIterator)
+            assert list(result) == list(range(config.RESULT_CHUNK_SIZE * 2 + 10))
+            assert list(p.echo(tuple(range(config.RESULT_CHUNK_SIZE * 2)))) == list(range(config.RESULT_CHUNK_SIZE * 2))
+            large_dict = {"key%d" % i: i for i in range(config.RESULT_CHUNK_SIZE * 2 + 10)}
+            result = p.echo(large_dict)
+            assert isinstance(result, Pyro5.client._ChunkedResultIterator)
+            assert next(result) == ("key0", 0)
+            assert dict(result) == {"key%d" % i: i for i in range(1, config.RESULT_CHUNK_SIZE * 2 + 10)}
+            assert dict(p.echo({i: str(i) for i in range(config.RESULT_CHUNK_SIZE * 2)})) == \
+                {i: str(i) for i in range(config.RESULT_CHUNK_SIZE * 2)}
+            assert p.multiply(5, 11) == 55
+            p._pyroChunkedResults = False
+            assert p.sequence(config.RESULT_CHUNK_SIZE * 2) == list(range(config.RESULT_CHUNK_SIZE * 2))
+
+    def testChunkedResultsAbandoned(self):
+        with Pyro5.client.Proxy(self.objectUri) as p:
+            p._pyroChunkedResults = True
+            result = p.sequence(config.RESULT_CHUNK_SIZE * 5)
+            assert next(result) == 0
+            connection = p._pyroConnection
+            assert p.multiply(5, 11) == 55     # the unfinished result is closed, the proxy reconnects
+            assert p._pyroConnection is not connection
+            with pytest.raises(StopIteration):
+                next(result)
+            result = p.sequence(config.RESULT_CHUNK_SIZE * 5)
+            p._pyroRelease()
+            for _ in range(config.RESULT_CHUNK_SIZE):
+                next(result)     # the first chunk was already received
+            with pytest.raises(Pyro5.errors.ConnectionClosedError):
+                next(result)
+            result = p.sequence(config.RESULT_CHUNK_SIZE * 5)
+            assert next(result) == 0
+            result.close()
+            assert p._pyroConnection is None
+            assert p.multiply(5, 11) == 55
+
+    def testChunkedResultsError(self):
+        with Pyro5.client.Proxy(self.objectUri) as p:
+            p._pyroChunkedResults = True
+            p._pyroSerializer = "marshal"
+            result = p.sequence(config.RESULT_CHUNK_SIZE * 3, unserializable_at=config.RESULT_CHUNK_SIZE * 2 + 1)
+            assert next(result) == 0
+            received = 1
+            with pytest.raises(ValueError):
+                for _ in result:
+                    received += 1
+            assert received == config.RESULT_CHUNK_SIZE * 2
+            assert p.multiply(5, 11) == 55
+
+    def testSerializerNegotiation(self):
+        try:
+            config.SERIALIZERS_PREFERRED = ["pickle", "nonexisting", "marshal", "json"]
+            with Pyro5.client.Proxy(self.objectUri) as p:
+                assert p.echo(42) == 42
+                assert p._pyroSerializer == "marshal"    # pickle is not accepted by the daemon
+            self.daemon.serializers_accepted = {"serpent", "json"}
+            with Pyro5.client.Proxy(self.objectUri) as p:
+                assert p.echo(42) == 42
+                assert p._pyroSerializer == "json"
+            config.SERIALIZERS_PREFERRED = ["marshal"]
+            with Pyro5.client.Proxy(self.objectUri) as p:
+                assert p.echo(42) == 42
+                assert p._pyroSerializer is None   # no match, keeps using the configured serializer
+            with Pyro5.client.Proxy(self.objectUri) as p:
+                p._pyroSerializer = "json"
+                assert p.echo(42) == 42
+                assert p._pyroSerializer == "json"
+        finally:
+            config.SERIALIZERS_PREFERRED = []
+
     def testSomeArgumentTypes(self):
         with Pyro5.client.Proxy(self.objectUri) as p:
             assert p.testargs(1) == [1, [], {}]
@@ -272,7 +625,8 @@ class TestServerOnce:
             p._pyroBind()
             assert p._pyroAttrs == {'value', 'dictionary'}
             assert p._pyroMethods == {'echo', 'getDict', 'divide', 'nonserializableException', 'ping', 'oneway_delay', 'delayAndId', 'delay', 'testargs',
-                              'multiply', 'oneway_multiply', 'getDictAttr', 'iterator', 'generator', 'response_annotation', 'blob', 'new_test_object'}
+                              'multiply', 'oneway_multiply', 'getDictAttr', 'iterator', 'generator', 'response_annotation', 'blob', 'new_test_object',
+                              'sequence'}
             assert p._pyroOneway == {'oneway_multiply', 'oneway_delay'}
             p._pyroAttrs = None
             p._pyroGetMetadata()
@@ -800,6 +1154,130 @@ class TestServerMultiplexNoTimeout(TestServerThreadNoTimeout):
         pass
 
 
+class FixedCandidatesBalancingProxy(Pyro5.client.BalancingProxy):
+    def __init__(self, candidates, **kwargs):
+        super().__init__("PYROMETA:test.balancing", **kwargs)
+        self._pyroCandidates = candidates
+
+    def _pyroLookupCandidates(self):
+        return self._pyroCandidates
+
+
+class TestBalancingProxy:
+    def setup_method(self):
+        config.SERIALIZER = "serpent"
+        config.POLLTIMEOUT = 0.1
+        self.daemons = []
+        self.threads = []
+        self.uris = []
+        self.hedge_uris = []
+        for name, delay in (("first", 1.0), ("second", 0.0)):
+            daemon = Pyro5.server.Daemon(port=0)
+            self.uris.append(daemon.register(NotEverythingExposedClass(name), "balanced"))
+            self.hedge_uris.append(daemon.register(HedgeTestObject(name, delay), "hedged"))
+            thread = DaemonLoopThread(daemon)
+            thread.start()
+            thread.running.wait()
+            self.daemons.append(daemon)
+            self.threads.append(thread)
+        time.sleep(0.05)
+
+    def teardown_method(self):
+        time.sleep(0.05)
+        for daemon, thread in zip(self.daemons, self.threads):
+            daemon.shutdown()
+            thread.join()
+
+    def testInvalidUri(self):
+        with pytest.raises(ValueError):
+            Pyro5.client.BalancingProxy("PYRO:obj@localhost:5555")
+        with pytest.raises(ValueError):
+            Pyro5.client.BalancingProxy("PYROMETA:tag", strategy="~invalid~")
+
+    def testSpreadsCalls(self):
+        with FixedCandidatesBalancingProxy(self.uris) as p:
+            names = {p.getName() for _ in range(20)}
+            assert names == {"first", "second"}
+            assert len(p._pyroEndpoints) == 2
+            assert p._pyroMethods == {"getName"}
+            with pytest.raises(AttributeError):
+                p.unexposed()
+            with pytest.raises(AttributeError):
+                p.something = 42
+
+    def testLeastOutstanding(self):
+        with FixedCandidatesBalancingProxy(self.uris) as p:
+            p.getName()
+            busy = list(p._pyroEndpoints.values())[0]
+            busy.outstanding += 1
+            names = {p.getName() for _ in range(5)}
+            assert len(names) == 1
+            busy.outstanding -= 1
+
+    def testSharedAmongThreads(self):
+        results = []
+        with FixedCandidatesBalancingProxy(self.uris, strategy="ewma") as p:
+            def work():
+                for _ in range(10):
+                    results.append(p.getName())
+            threads = [threading.Thread(target=work) for _ in range(4)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        assert len(results) == 40
+        assert set(results) <= {"first", "second"}
+
+    def testUnreachableEndpointSkipped(self):
+        candidates = self.uris + ["PYRO:balanced@localhost:%d" % Pyro5.socketutil.find_probably_unused_port()]
+        with FixedCandidatesBalancingProxy(candidates) as p:
+            names = {p.getName() for _ in range(10)}
+            assert names == {"first", "second"}
+            down = [ep for ep in p._pyroEndpoints.values() if ep.down_until > time.time()]
+            assert len(down) == 1
+            assert str(down[0].uri) == candidates[2]
+
+    def testRefresh(self):
+        with FixedCandidatesBalancingProxy(self.uris[:1], refresh_interval=0) as p:
+            assert p.getName() == "first"
+            p._pyroCandidates = self.uris[1:]
+            assert p.getName() == "second"
+            assert list(p._pyroEndpoints) == [str(self.uris[1])]
+            p._pyroCandidates = []
+            with pytest.raises(Pyro5.errors.CommunicationError):
+                p.getName()
+
+    def _prefer_slow_endpoint(self, proxy, method):
+        proxy._pyroRefresh()
+        proxy._pyroLatencies[method] = collections.deque([0.01] * proxy.hedge_min_samples)
+        for endpoint in proxy._pyroEndpoints.values():
+            endpoint.ewma = 0.001 if endpoint.uri == self.hedge_uris[0] else 1.0
+
+    def testHedgedIdempotentCall(self):
+        with FixedCandidatesBalancingProxy(self.hedge_uris, hedge_percentile=95) as p:
+            p._pyroGetMetadata()
+            assert p._pyroIdempotent == {"work"}
+            self._prefer_slow_endpoint(p, "work")
+            start = time.time()
+            assert p.work() == "second"
+            assert time.time() - start < 0.8
+            assert p._pyroHedgeStats == {"calls": 1, "hedged": 1, "hedge_wins": 1}
+
+    def testNoHedgingForOtherMethods(self):
+        with FixedCandidatesBalancingProxy(self.hedge_uris, hedge_percentile=95) as p:
+            p._pyroGetMetadata()
+            self._prefer_slow_endpoint(p, "not_idempotent")
+            assert p.not_idempotent() == "first"
+            assert p._pyroHedgeStats["calls"] == 0
+
+    def testNoHedgingWithoutSamples(self):
+        with FixedCandidatesBalancingProxy(self.hedge_uris, hedge_percentile=95) as p:
+            assert p.work() in ("first", "second")
+            assert p._pyroHedgeStats["calls"] == 0
+        with pytest.raises(ValueError):
+            FixedCandidatesBalancingProxy(self.hedge_uris, hedge_percentile=100)
+
+
 class TestMetaAndExpose:
     def testBasic(self):
         o = MyThingFullExposed("irmen")
@@ -812,6 +1290,13 @@ class TestMetaAndExpose:
         assert "attrs" in keys
         assert "oneway" in keys
 
+    def testIdempotent(self):
+        m = Pyro5.server._get_exposed_members(HedgeTestObject)
+        assert m["idempotent"] == {"work"}
+        assert m["methods"] == {"work", "not_idempotent"}
+        m = Pyro5.server._get_exposed_members(MyThingFullExposed)
+        assert "idempotent" not in m
+
     def testGetExposedCacheWorks(self):
         class Thingy(object):
             def method1(self):
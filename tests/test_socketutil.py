@@ -533,3 +533,64 @@ class TestSSL:
                 sock.close()
         finally:
             config.SSL = False
+
+    def testContextCachedPerParameters(self):
+        cert_dir = os.path.join(os.path.dirname(__file__), "..", "certs")
+        try:
+            config.SSL_REQUIRECLIENTCERT = False
+            ctx1 = socketutil.get_ssl_context(cert_dir+"/server_cert.pem", cert_dir+"/server_key.pem")
+            ctx2 = socketutil.get_ssl_context(cert_dir+"/server_cert.pem", cert_dir+"/server_key.pem")
+            assert ctx1 is ctx2
+            assert ctx1.verify_mode == ssl.CERT_NONE
+            config.SSL_REQUIRECLIENTCERT = True
+            ctx3 = socketutil.get_ssl_context(cert_dir+"/server_cert.pem", cert_dir+"/server_key.pem")
+            assert ctx3 is not ctx1
+            assert ctx3.verify_mode == ssl.CERT_REQUIRED
+            client1 = socketutil.get_ssl_context()
+            client2 = socketutil.get_ssl_context(clientcert=cert_dir+"/client_cert.pem", clientkey=cert_dir+"/client_key.pem")
+            assert client1 is not client2
+            assert client1 is socketutil.get_ssl_context()
+            with pytest.raises(ValueError):
+                socketutil.get_ssl_context(servercert=cert_dir+"/server_cert.pem", clientcert=cert_dir+"/client_cert.pem")
+        finally:
+            config.SSL_REQUIRECLIENTCERT = False
+            socketutil.clear_ssl_cache()
+
+    def testSessionResumption(self):
+        cert_dir = os.path.join(os.path.dirname(__file__), "..", "certs")
+        config.SSL_REQUIRECLIENTCERT = False
+        server_ctx = socketutil.get_ssl_context(cert_dir+"/server_cert.pem", cert_dir+"/server_key.pem")
+        client_ctx = socketutil.get_ssl_context()
+        client_ctx.check_hostname = False
+        client_ctx.verify_mode = ssl.CERT_NONE      # the test certificates are self-signed
+        server_sock = socketutil.create_socket(bind=("localhost", 0), timeout=2, sslContext=server_ctx)
+        location = server_sock.getsockname()[:2]
+
+        def serve():
+            for _ in range(3):
+                with contextlib.suppress(Exception):
+                    conn, _ = server_sock.accept()
+                    conn.sendall(b"hello")
+                    conn.recv(10)
+                    conn.close()
+
+        server_thread = threading.Thread(target=serve, daemon=True)
+        server_thread.start()
+        try:
+            assert socketutil.get_ssl_session(client_ctx, location) is None
+            for _ in range(3):
+                session = socketutil.get_ssl_session(client_ctx, location)
+                sock = socketutil.create_socket(connect=location, timeout=2, sslContext=client_ctx, sslSession=session)
+                assert socketutil.receive_data(sock, 5) == b"hello"
+                socketutil.store_ssl_session(client_ctx, location, sock)
+                sock.close()
+            assert socketutil.get_ssl_session(client_ctx, location) is not None
+            stats = socketutil.ssl_session_stats()
+            assert stats["new"] == 1
+            assert stats["reused"] == 2
+            assert stats["hit_rate"] == pytest.approx(2/3)
+        finally:
+            server_thread.join(timeout=2)
+            server_sock.close()
+            socketutil.clear_ssl_cache()
+        assert socketutil.ssl_session_stats() == {"new": 0, "reused": 0, "hit_rate": 0.0}